@@ -0,0 +1,24 @@
+"""event embedding version stamp
+
+Revision ID: 0004_event_embedding_version
+Revises: 0003_auth_users_guest_auth
+Create Date: 2026-03-02 10:15:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_event_embedding_version"
+down_revision = "0003_auth_users_guest_auth"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("events", sa.Column("embedding_version", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    op.drop_column("events", "embedding_version")
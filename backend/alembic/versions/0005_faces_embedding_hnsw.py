@@ -0,0 +1,31 @@
+"""hnsw cosine index on face embeddings
+
+Revision ID: 0005_faces_embedding_hnsw
+Revises: 0004_event_embedding_version
+Create Date: 2026-03-04 09:30:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+
+revision = "0005_faces_embedding_hnsw"
+down_revision = "0004_event_embedding_version"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_faces_embedding_hnsw",
+        "faces",
+        ["embedding"],
+        unique=False,
+        postgresql_using="hnsw",
+        postgresql_with={"m": 16, "ef_construction": 64},
+        postgresql_ops={"embedding": "vector_cosine_ops"},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_faces_embedding_hnsw", table_name="faces")
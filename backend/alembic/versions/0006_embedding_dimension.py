@@ -0,0 +1,59 @@
+"""size embedding columns to the SFace model dimension
+
+Revision ID: 0006_embedding_dimension
+Revises: 0005_faces_embedding_hnsw
+Create Date: 2026-03-06 11:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+
+revision = "0006_embedding_dimension"
+down_revision = "0005_faces_embedding_hnsw"
+branch_labels = None
+depends_on = None
+
+LEGACY_DIMENSION = 512
+# Fixed here rather than read from FACE_EMBEDDING_DIM so the schema does not
+# depend on the environment of whoever runs the upgrade; startup verifies the
+# setting against the column.
+EMBEDDING_DIMENSION = 128
+
+
+def upgrade() -> None:
+    dim = EMBEDDING_DIMENSION
+    op.drop_index("ix_faces_embedding_hnsw", table_name="faces")
+    # SFace vectors were zero-padded to 512, so keeping the leading components
+    # preserves both the direction and the unit norm.
+    _resize_column("faces", "embedding", dim)
+    _resize_column("face_clusters", "centroid", dim)
+    _create_hnsw_index()
+
+
+def downgrade() -> None:
+    op.drop_index("ix_faces_embedding_hnsw", table_name="faces")
+    _resize_column("faces", "embedding", LEGACY_DIMENSION)
+    _resize_column("face_clusters", "centroid", LEGACY_DIMENSION)
+    _create_hnsw_index()
+
+
+def _resize_column(table: str, column: str, dim: int) -> None:
+    op.execute(
+        f"ALTER TABLE {table} ALTER COLUMN {column} TYPE vector({dim}) USING ("
+        f"CASE WHEN vector_dims({column}) >= {dim} THEN ({column}::real[])[1:{dim}] "
+        f"ELSE ({column}::real[]) || array_fill(0::real, ARRAY[{dim} - vector_dims({column})]) END"
+        f")::vector({dim})"
+    )
+
+
+def _create_hnsw_index() -> None:
+    op.create_index(
+        "ix_faces_embedding_hnsw",
+        "faces",
+        ["embedding"],
+        unique=False,
+        postgresql_using="hnsw",
+        postgresql_with={"m": 16, "ef_construction": 64},
+        postgresql_ops={"embedding": "vector_cosine_ops"},
+    )
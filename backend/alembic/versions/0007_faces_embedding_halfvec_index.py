@@ -0,0 +1,36 @@
+"""half-precision hnsw index for compact embedding mode
+
+Revision ID: 0007_faces_embedding_halfvec_index
+Revises: 0006_embedding_dimension
+Create Date: 2026-03-09 14:20:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+
+revision = "0007_faces_embedding_halfvec_index"
+down_revision = "0006_embedding_dimension"
+branch_labels = None
+depends_on = None
+
+EMBEDDING_DIMENSION = 128
+
+
+def upgrade() -> None:
+    # Built regardless of EMBEDDING_PRECISION, which can change after migrating:
+    # float32 searches walk ix_faces_embedding_hnsw, compact ones this halfvec
+    # expression index, and faces.embedding stays float32 as the re-rank source.
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_faces_embedding_hnsw_half ON faces "
+        f"USING hnsw ((embedding::halfvec({EMBEDDING_DIMENSION})) halfvec_cosine_ops) "
+        "WITH (m = 16, ef_construction = 64)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_faces_embedding_hnsw ON faces "
+        "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_faces_embedding_hnsw_half")
@@ -0,0 +1,32 @@
+"""incremental clustering state
+
+Revision ID: 0008_incremental_clustering
+Revises: 0007_faces_embedding_halfvec_index
+Create Date: 2026-03-11 10:05:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008_incremental_clustering"
+down_revision = "0007_faces_embedding_halfvec_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing faces start unclustered and baselines at zero, so each event's
+    # next cluster job is a full recluster that seeds the incremental state.
+    op.add_column("faces", sa.Column("clustered", sa.Boolean(), nullable=False, server_default=sa.false()))
+    op.create_index("ix_faces_event_unclustered", "faces", ["event_id"], postgresql_where=sa.text("NOT clustered"))
+    op.add_column("events", sa.Column("cluster_baseline_faces", sa.Integer(), nullable=False, server_default="0"))
+    op.add_column("events", sa.Column("cluster_incremental_faces", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    op.drop_column("events", "cluster_incremental_faces")
+    op.drop_column("events", "cluster_baseline_faces")
+    op.drop_index("ix_faces_event_unclustered", table_name="faces")
+    op.drop_column("faces", "clustered")
@@ -0,0 +1,34 @@
+"""job priority lanes
+
+Revision ID: 0009_job_priority
+Revises: 0008_incremental_clustering
+Create Date: 2026-03-12 09:20:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009_job_priority"
+down_revision = "0008_incremental_clustering"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("jobs", sa.Column("priority", sa.Integer(), nullable=False, server_default="10"))
+    op.execute("UPDATE jobs SET priority = 0 WHERE job_type = 'match_guest'")
+    op.execute("UPDATE jobs SET priority = 5 WHERE job_type = 'cluster_event'")
+    # Claims only ever look at queued rows, ordered by (priority, created_at).
+    op.create_index(
+        "ix_jobs_queued_priority",
+        "jobs",
+        ["priority", "created_at"],
+        postgresql_where=sa.text("status = 'queued'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_jobs_queued_priority", table_name="jobs")
+    op.drop_column("jobs", "priority")
@@ -0,0 +1,24 @@
+"""job lease retry backoff
+
+Revision ID: 0010_job_leases
+Revises: 0009_job_priority
+Create Date: 2026-03-13 11:40:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010_job_leases"
+down_revision = "0009_job_priority"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("jobs", sa.Column("run_after", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("jobs", "run_after")
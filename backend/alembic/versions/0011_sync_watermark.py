@@ -0,0 +1,26 @@
+"""event drive sync watermark
+
+Revision ID: 0011_sync_watermark
+Revises: 0010_job_leases
+Create Date: 2026-03-14 09:15:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011_sync_watermark"
+down_revision = "0010_job_leases"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("events", sa.Column("drive_modified_watermark", sa.String(length=40), nullable=True))
+    op.add_column("events", sa.Column("full_synced_at", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("events", "full_synced_at")
+    op.drop_column("events", "drive_modified_watermark")
@@ -0,0 +1,34 @@
+"""sync listing stored per parent job
+
+Revision ID: 0013_sync_listing_files
+Revises: 0011_sync_watermark
+Create Date: 2026-03-16 09:30:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0013_sync_listing_files"
+down_revision = "0011_sync_watermark"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sync_listing_files",
+        sa.Column("job_id", sa.String(length=36), sa.ForeignKey("jobs.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("drive_file_id", sa.String(length=200), primary_key=True),
+        sa.Column("queue_index", sa.Integer(), nullable=True),
+        sa.Column("content_stamp", sa.String(length=400), nullable=False, server_default=""),
+        sa.Column("photo_id", sa.String(length=36), nullable=True),
+        sa.Column("file", sa.JSON(), nullable=True),
+    )
+    op.create_index("ix_sync_listing_files_queue", "sync_listing_files", ["job_id", "queue_index"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_sync_listing_files_queue", table_name="sync_listing_files")
+    op.drop_table("sync_listing_files")
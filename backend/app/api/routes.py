@@ -69,6 +69,7 @@ from app.services.jobs import (
     JOB_STATUS_FAILED,
     JOB_STATUS_QUEUED,
     JOB_STATUS_RUNNING,
+    JOB_STATUS_WAITING,
     request_job_cancel,
 )
 from app.services.storage import save_selfie
@@ -183,6 +184,7 @@ def get_event(
 @router.post("/events/{event_id}/resync", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
 def resync_event(
     event_id: str,
+    full_recluster: bool = False,
     db: Session = Depends(get_db),
     current_user: AppUser = Depends(require_role([Role.SUPER_ADMIN, Role.ADMIN, Role.PHOTOGRAPHER])),
 ) -> JobResponse:
@@ -196,7 +198,7 @@ def resync_event(
         db,
         job_type=JOB_SYNC_EVENT,
         event_id=event.id,
-        payload={"trigger": "manual_resync"},
+        payload={"trigger": "manual_resync", "full_recluster": bool(full_recluster)},
         stage="queued_for_sync",
     )
     db.commit()
@@ -296,6 +298,10 @@ def update_event(
         folder_id = extract_drive_folder_id(payload.drive_link)
         if not folder_id:
             raise APIException("invalid_drive_link", "Invalid Google Drive folder link", status.HTTP_400_BAD_REQUEST)
+        if folder_id != event.drive_folder_id:
+            # A different folder has nothing in common with the old watermark.
+            event.drive_modified_watermark = None
+            event.full_synced_at = None
         event.drive_link = payload.drive_link.strip()
         event.drive_folder_id = folder_id
     if payload.guest_auth_required is not None:
@@ -997,6 +1003,7 @@ def photographer_event_status(
 @router.post("/photographer/events/{event_id}/sync", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
 def photographer_sync_event(
     event_id: str,
+    full_recluster: bool = False,
     db: Session = Depends(get_db),
     current_user: AppUser = Depends(require_role([Role.SUPER_ADMIN, Role.ADMIN, Role.PHOTOGRAPHER])),
 ) -> JobResponse:
@@ -1010,7 +1017,7 @@ def photographer_sync_event(
         db,
         job_type=JOB_SYNC_EVENT,
         event_id=event.id,
-        payload={"trigger": "manual_resync"},
+        payload={"trigger": "manual_resync", "full_recluster": bool(full_recluster)},
         stage="queued_for_sync",
     )
     db.commit()
@@ -1335,7 +1342,7 @@ def _latest_cancelable_event_job(db: Session, event_id: str) -> Job | None:
             .where(
                 Job.event_id == event_id,
                 Job.job_type.in_([JOB_SYNC_EVENT, JOB_CLUSTER_EVENT]),
-                Job.status.in_([JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_CANCEL_REQUESTED]),
+                Job.status.in_([JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_WAITING, JOB_STATUS_CANCEL_REQUESTED]),
             )
             .order_by(Job.created_at.desc())
             .limit(1)
@@ -1352,7 +1359,7 @@ def _latest_active_event_processing_job(db: Session, event_id: str) -> Job | Non
             .where(
                 Job.event_id == event_id,
                 Job.job_type.in_([JOB_SYNC_EVENT, JOB_CLUSTER_EVENT]),
-                Job.status.in_([JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_CANCEL_REQUESTED]),
+                Job.status.in_([JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_WAITING, JOB_STATUS_CANCEL_REQUESTED]),
             )
             .order_by(Job.created_at.desc())
             .limit(1)
@@ -1366,7 +1373,7 @@ def _normalize_processing_status(raw_status: str, *, event_status: str) -> str:
     value = str(raw_status or "").strip().lower()
     if value == JOB_STATUS_QUEUED:
         return "QUEUED"
-    if value == JOB_STATUS_RUNNING:
+    if value in {JOB_STATUS_RUNNING, JOB_STATUS_WAITING}:
         return "RUNNING"
     if value == JOB_STATUS_COMPLETED:
         return "COMPLETED"
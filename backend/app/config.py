@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 from functools import lru_cache
 from pathlib import Path
 
@@ -43,6 +44,9 @@ class Settings(BaseSettings):
 
     cluster_eps: float = Field(default=0.32)
     cluster_min_samples: int = Field(default=2)
+    cluster_drift_ratio: float = Field(default=0.25, validation_alias=AliasChoices("CLUSTER_DRIFT_RATIO"))
+    cluster_engine: str = Field(default="dbscan", validation_alias=AliasChoices("CLUSTER_ENGINE"))
+    cluster_graph_neighbors: int = Field(default=32, validation_alias=AliasChoices("CLUSTER_GRAPH_NEIGHBORS"))
     match_min_confidence: float = Field(default=0.58)
     face_similarity_threshold_percent: float = Field(
         default=90.0,
@@ -68,17 +72,80 @@ class Settings(BaseSettings):
     face_min_sharpness: float = Field(default=10.0, validation_alias=AliasChoices("FACE_MIN_SHARPNESS"))
     face_max_faces_per_image: int = Field(default=26, validation_alias=AliasChoices("FACE_MAX_FACES_PER_IMAGE"))
     face_resize_max_side: int = Field(default=2200, validation_alias=AliasChoices("FACE_RESIZE_MAX_SIDE"))
+    face_embed_batch_size: int = Field(default=32, validation_alias=AliasChoices("FACE_EMBED_BATCH_SIZE"))
+    face_embedding_dim: int = Field(default=128, validation_alias=AliasChoices("FACE_EMBEDDING_DIM"))
+    embedding_precision: str = Field(default="float32", validation_alias=AliasChoices("EMBEDDING_PRECISION"))
+    face_inference_backend: str = Field(default="opencv", validation_alias=AliasChoices("FACE_INFERENCE_BACKEND"))
+    ort_intra_op_threads: int = Field(default=0, validation_alias=AliasChoices("ORT_INTRA_OP_THREADS"))
+    ort_inter_op_threads: int = Field(default=0, validation_alias=AliasChoices("ORT_INTER_OP_THREADS"))
+    ort_graph_optimization_level: str = Field(
+        default="all",
+        validation_alias=AliasChoices("ORT_GRAPH_OPTIMIZATION_LEVEL"),
+    )
+    face_model_precision: str = Field(default="fp32", validation_alias=AliasChoices("FACE_MODEL_PRECISION"))
+    face_int8_min_cosine: float = Field(default=0.98, validation_alias=AliasChoices("FACE_INT8_MIN_COSINE"))
+    face_int8_min_agreement: float = Field(default=0.99, validation_alias=AliasChoices("FACE_INT8_MIN_AGREEMENT"))
+    face_int8_max_false_positive_rate: float = Field(
+        default=0.001,
+        validation_alias=AliasChoices("FACE_INT8_MAX_FALSE_POSITIVE_RATE"),
+    )
+
+    match_engine: str = Field(default="numpy", validation_alias=AliasChoices("MATCH_ENGINE"))
+    match_ann_top_k: int = Field(default=2000, validation_alias=AliasChoices("MATCH_ANN_TOP_K"))
+    match_ann_ef_search: int = Field(default=200, validation_alias=AliasChoices("MATCH_ANN_EF_SEARCH"))
+    match_rerank_candidates: int = Field(default=300, validation_alias=AliasChoices("MATCH_RERANK_CANDIDATES"))
+    match_index_cache_mb: int = Field(default=512, validation_alias=AliasChoices("MATCH_INDEX_CACHE_MB"))
+    match_cluster_top_k: int = Field(default=8, validation_alias=AliasChoices("MATCH_CLUSTER_TOP_K"))
+    match_cluster_margin: float = Field(default=0.08, validation_alias=AliasChoices("MATCH_CLUSTER_MARGIN"))
+    match_cluster_audit_rate: float = Field(default=0.02, validation_alias=AliasChoices("MATCH_CLUSTER_AUDIT_RATE"))
 
     job_poll_interval_seconds: int = Field(default=2)
     job_idle_sleep_seconds: int = Field(default=1)
+    job_lease_seconds: int = Field(default=120, validation_alias=AliasChoices("JOB_LEASE_SECONDS"))
+    job_heartbeat_seconds: int = Field(default=30, validation_alias=AliasChoices("JOB_HEARTBEAT_SECONDS"))
+    job_max_attempts: int = Field(default=3, validation_alias=AliasChoices("JOB_MAX_ATTEMPTS"))
+    job_retry_backoff_seconds: int = Field(default=30, validation_alias=AliasChoices("JOB_RETRY_BACKOFF_SECONDS"))
+    worker_lanes: str = Field(default="all", validation_alias=AliasChoices("WORKER_LANES"))
+    job_listen_timeout_seconds: int = Field(default=15, validation_alias=AliasChoices("JOB_LISTEN_TIMEOUT_SECONDS"))
 
     auto_sync_enabled: bool = Field(default=True, validation_alias=AliasChoices("AUTO_SYNC_ENABLED"))
     auto_sync_interval_minutes: int = Field(default=5, validation_alias=AliasChoices("AUTO_SYNC_INTERVAL_MINUTES"))
     auto_sync_batch_size: int = Field(default=4, validation_alias=AliasChoices("AUTO_SYNC_BATCH_SIZE"))
     worker_concurrency: int = Field(default=2, validation_alias=AliasChoices("WORKER_CONCURRENCY"))
+    sync_download_workers: int = Field(default=4, validation_alias=AliasChoices("SYNC_DOWNLOAD_WORKERS"))
+    drive_http2: bool = Field(default=True, validation_alias=AliasChoices("DRIVE_HTTP2"))
+    drive_list_workers: int = Field(default=4, validation_alias=AliasChoices("DRIVE_LIST_WORKERS"))
+    drive_download_mode: str = Field(default="original", validation_alias=AliasChoices("DRIVE_DOWNLOAD_MODE"))
+    drive_rendition_side: int = Field(default=0, validation_alias=AliasChoices("DRIVE_RENDITION_SIDE"))
+    drive_rate_per_host: float = Field(default=10.0, validation_alias=AliasChoices("DRIVE_RATE_PER_HOST"))
+    drive_rate_min: float = Field(default=0.5, validation_alias=AliasChoices("DRIVE_RATE_MIN"))
+    drive_rate_max: float = Field(default=50.0, validation_alias=AliasChoices("DRIVE_RATE_MAX"))
+    drive_max_retries: int = Field(default=4, validation_alias=AliasChoices("DRIVE_MAX_RETRIES"))
+    drive_backoff_base_seconds: float = Field(default=0.5, validation_alias=AliasChoices("DRIVE_BACKOFF_BASE_SECONDS"))
+    drive_backoff_max_seconds: float = Field(default=30.0, validation_alias=AliasChoices("DRIVE_BACKOFF_MAX_SECONDS"))
+    sync_inference_workers: int = Field(default=0, validation_alias=AliasChoices("SYNC_INFERENCE_WORKERS"))
+    sync_queue_size: int = Field(default=16, validation_alias=AliasChoices("SYNC_QUEUE_SIZE"))
+    sync_full_rescan_hours: float = Field(default=24.0, validation_alias=AliasChoices("SYNC_FULL_RESCAN_HOURS"))
+    sync_watermark_overlap_seconds: int = Field(
+        default=300,
+        validation_alias=AliasChoices("SYNC_WATERMARK_OVERLAP_SECONDS"),
+    )
+    sync_progress_every: int = Field(default=25, validation_alias=AliasChoices("SYNC_PROGRESS_EVERY"))
+    sync_progress_interval_seconds: float = Field(
+        default=1.0,
+        validation_alias=AliasChoices("SYNC_PROGRESS_INTERVAL_SECONDS"),
+    )
+    sync_shard_size: int = Field(default=500, validation_alias=AliasChoices("SYNC_SHARD_SIZE"))
 
     storage_root: str = Field(default="storage")
 
+    @property
+    def drive_rendition_max_side(self) -> int:
+        # Big enough for both the detector and the stored thumbnail unless pinned.
+        if int(self.drive_rendition_side) > 0:
+            return int(self.drive_rendition_side)
+        return max(int(self.face_resize_max_side), int(self.thumbnail_max_size))
+
     @property
     def storage_root_path(self) -> Path:
         return Path(self.storage_root).resolve()
@@ -96,6 +163,12 @@ class Settings(BaseSettings):
         values = [item.strip() for item in str(self.cors_allow_origins or "").split(",")]
         return [item for item in values if item]
 
+    @property
+    def sync_inference_worker_count(self) -> int:
+        if int(self.sync_inference_workers) > 0:
+            return int(self.sync_inference_workers)
+        return max(1, os.cpu_count() or 1)
+
     @property
     def face_model_cache_dir_path(self) -> Path:
         return Path(self.face_model_cache_dir).expanduser().resolve()
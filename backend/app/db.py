@@ -1,8 +1,9 @@
 from __future__ import annotations
 
+import re
 from collections.abc import Generator
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
 
 from app.config import get_settings
@@ -24,3 +25,19 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+
+def verify_embedding_dimension(db: Session, expected: int) -> None:
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    declared = db.execute(
+        text(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = to_regclass('faces') AND attname = 'embedding' AND NOT attisdropped"
+        )
+    ).scalar_one_or_none()
+    match = re.search(r"\((\d+)\)", str(declared or ""))
+    if match and int(match.group(1)) != int(expected):
+        raise RuntimeError(
+            f"faces.embedding is {declared} but FACE_EMBEDDING_DIM is {expected}; "
+            "migrate the column or fix the setting before starting"
+        )
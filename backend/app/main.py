@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -8,12 +10,24 @@ from fastapi.staticfiles import StaticFiles
 from app.api.auth_routes import router as auth_router
 from app.api.routes import router
 from app.config import get_settings
+from app.db import get_db, verify_embedding_dimension
 from app.errors import APIException, error_response
 
 
 def create_app() -> FastAPI:
     settings = get_settings()
-    app = FastAPI(title=settings.app_name)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Resolve the session like a request would, so overridden databases are checked instead.
+        sessions = app.dependency_overrides.get(get_db, get_db)()
+        try:
+            verify_embedding_dimension(next(sessions), settings.face_embedding_dim)
+        finally:
+            sessions.close()
+        yield
+
+    app = FastAPI(title=settings.app_name, lifespan=lifespan)
 
     app.add_middleware(
         CORSMiddleware,
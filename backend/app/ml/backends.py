@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import logging
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any
+
+import cv2
+import numpy as np
+
+from app.config import Settings
+
+try:
+    import onnxruntime as ort
+except Exception:  # pragma: no cover
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+BACKEND_OPENCV = "opencv"
+BACKEND_ONNXRUNTIME = "onnxruntime"
+
+SFACE_INPUT_SIZE = (112, 112)
+# Landmark template FaceRecognizerSF.alignCrop warps onto (right eye, left eye,
+# nose tip, right and left mouth corners) in the 112x112 crop.
+SFACE_TEMPLATE = np.array(
+    [
+        [38.2946, 51.6963],
+        [73.5318, 51.5014],
+        [56.0252, 71.7366],
+        [41.5493, 92.3655],
+        [70.7299, 92.2041],
+    ],
+    dtype=np.float32,
+)
+YUNET_STRIDES = (8, 16, 32)
+YUNET_NMS_THRESHOLD = 0.3
+YUNET_TOP_K = 5000
+
+_GRAPH_OPTIMIZATION_LEVELS = {
+    "disabled": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+def similarity_transform(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    # Umeyama least-squares similarity (rotation, uniform scale, translation).
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+    src_mean = src.mean(axis=0)
+    dst_mean = dst.mean(axis=0)
+    src_centered = src - src_mean
+    dst_centered = dst - dst_mean
+    cov = dst_centered.T @ src_centered / src.shape[0]
+    u, s, vt = np.linalg.svd(cov)
+    signs = np.ones(2)
+    if np.linalg.det(cov) < 0:
+        signs[-1] = -1.0
+    rotation = u @ np.diag(signs) @ vt
+    src_var = float((src_centered**2).sum() / src.shape[0])
+    scale = float((s * signs).sum() / src_var) if src_var > 0 else 1.0
+    translation = dst_mean - scale * rotation @ src_mean
+    return np.hstack([scale * rotation, translation.reshape(2, 1)]).astype(np.float32)
+
+
+def align_face(image: np.ndarray, face: np.ndarray) -> np.ndarray:
+    landmarks = np.asarray(face[4:14], dtype=np.float32).reshape(5, 2)
+    matrix = similarity_transform(landmarks, SFACE_TEMPLATE)
+    return cv2.warpAffine(image, matrix, SFACE_INPUT_SIZE, flags=cv2.INTER_LINEAR)
+
+
+def sface_input_blob(crops: Sequence[np.ndarray]) -> np.ndarray:
+    batch = np.stack(
+        [
+            cv2.cvtColor(
+                crop if crop.shape[:2] == SFACE_INPUT_SIZE[::-1] else cv2.resize(crop, SFACE_INPUT_SIZE),
+                cv2.COLOR_BGR2RGB,
+            )
+            for crop in crops
+        ]
+    )
+    return batch.transpose(0, 3, 1, 2).astype(np.float32)
+
+
+class OpenCVBackend:
+    name = BACKEND_OPENCV
+
+    def __init__(self, detector: Any, recognizer: Any, sface_net: Any | None = None) -> None:
+        self.detector = detector
+        self.recognizer = recognizer
+        self.sface_net = sface_net
+
+    @classmethod
+    def load(cls, settings: Settings, yunet_path: Path, sface_path: Path) -> OpenCVBackend:
+        detector = cv2.FaceDetectorYN.create(
+            str(yunet_path),
+            "",
+            (int(settings.face_det_size), int(settings.face_det_size)),
+            float(settings.face_det_score_threshold),
+            YUNET_NMS_THRESHOLD,
+            YUNET_TOP_K,
+        )
+        recognizer = cv2.FaceRecognizerSF.create(str(sface_path), "")
+        if detector is None or recognizer is None:
+            raise RuntimeError("Failed to initialize YuNet/SFace models")
+        sface_net = None
+        try:
+            sface_net = cv2.dnn.readNetFromONNX(str(sface_path))
+        except Exception as exc:
+            logger.warning("SFace batch network unavailable; using per-face features: %s", exc)
+        return cls(detector, recognizer, sface_net)
+
+    def detect(self, image: np.ndarray) -> np.ndarray | None:
+        image_h, image_w = image.shape[:2]
+        self.detector.setInputSize((image_w, image_h))
+        _ok, faces = self.detector.detect(image)
+        return faces
+
+    def align(self, image: np.ndarray, face: np.ndarray) -> np.ndarray | None:
+        return self.recognizer.alignCrop(image, face)
+
+    def embed(self, crops: Sequence[np.ndarray]) -> list[np.ndarray | None]:
+        raw = self._forward_batch(list(crops))
+        if raw is None:
+            return [self.recognizer.feature(crop) for crop in crops]
+        return list(raw)
+
+    def _forward_batch(self, crops: list[np.ndarray]) -> np.ndarray | None:
+        net = self.sface_net
+        if net is None:
+            return None
+        try:
+            # Same preprocessing as FaceRecognizerSF.feature, stacked along N.
+            blob = cv2.dnn.blobFromImages(crops, 1.0, SFACE_INPUT_SIZE, (0, 0, 0), swapRB=True, crop=False)
+            net.setInput(blob)
+            output = np.asarray(net.forward(), dtype=np.float32)
+        except Exception as exc:
+            logger.warning("SFace batch forward failed; falling back to per-face features: %s", exc)
+            self.sface_net = None
+            return None
+        output = output.reshape(output.shape[0], -1) if output.ndim > 1 else output.reshape(1, -1)
+        if output.shape[0] != len(crops):
+            self.sface_net = None
+            return None
+        return output
+
+
+class OnnxRuntimeBackend:
+    name = BACKEND_ONNXRUNTIME
+
+    def __init__(self, settings: Settings, yunet_session: Any, sface_session: Any) -> None:
+        self.score_threshold = float(settings.face_det_score_threshold)
+        self.yunet = yunet_session
+        self.sface = sface_session
+        self._yunet_input = yunet_session.get_inputs()[0]
+        self._sface_input = sface_session.get_inputs()[0]
+        self._yunet_outputs = [
+            f"{kind}_{stride}" for kind in ("cls", "obj", "bbox", "kps") for stride in YUNET_STRIDES
+        ]
+        fixed_shape = self._yunet_input.shape[2:]
+        self._yunet_fixed_size = (
+            (int(fixed_shape[1]), int(fixed_shape[0])) if all(isinstance(v, int) for v in fixed_shape) else None
+        )
+        batch_dim = self._sface_input.shape[0]
+        self._sface_max_batch = int(batch_dim) if isinstance(batch_dim, int) and batch_dim > 0 else None
+
+    @classmethod
+    def load(cls, settings: Settings, yunet_path: Path, sface_path: Path) -> OnnxRuntimeBackend:
+        options = session_options(settings)
+        providers = ["CPUExecutionProvider"]
+        yunet = ort.InferenceSession(str(yunet_path), sess_options=options, providers=providers)
+        sface = ort.InferenceSession(str(sface_path), sess_options=options, providers=providers)
+        return cls(settings, yunet, sface)
+
+    def detect(self, image: np.ndarray) -> np.ndarray | None:
+        image_h, image_w = image.shape[:2]
+        scale = 1.0
+        if self._yunet_fixed_size is not None:
+            pad_w, pad_h = self._yunet_fixed_size
+            scale = min(pad_w / image_w, pad_h / image_h)
+            if scale != 1.0:
+                image = cv2.resize(image, (max(1, int(image_w * scale)), max(1, int(image_h * scale))))
+        else:
+            # YuNet's feature pyramid needs both sides divisible by the largest stride.
+            pad_w = ((image_w - 1) // 32 + 1) * 32
+            pad_h = ((image_h - 1) // 32 + 1) * 32
+        padded = cv2.copyMakeBorder(
+            image, 0, pad_h - image.shape[0], 0, pad_w - image.shape[1], cv2.BORDER_CONSTANT, value=0
+        )
+        blob = padded.transpose(2, 0, 1)[np.newaxis].astype(np.float32)
+        outputs = self.yunet.run(self._yunet_outputs, {self._yunet_input.name: blob})
+        faces = self._decode_yunet(outputs, pad_w)
+        if faces is None:
+            return None
+        if scale != 1.0:
+            faces[:, :14] /= scale
+        return faces
+
+    def _decode_yunet(self, outputs: list[np.ndarray], pad_w: int) -> np.ndarray | None:
+        count = len(YUNET_STRIDES)
+        rows: list[np.ndarray] = []
+        for level, stride in enumerate(YUNET_STRIDES):
+            cols = pad_w // stride
+            cls_score = np.clip(outputs[level].reshape(-1), 0.0, 1.0)
+            obj_score = np.clip(outputs[level + count].reshape(-1), 0.0, 1.0)
+            bbox = outputs[level + 2 * count].reshape(-1, 4)
+            kps = outputs[level + 3 * count].reshape(-1, 10)
+            scores = np.sqrt(cls_score * obj_score)
+            keep = np.flatnonzero(scores >= self.score_threshold)
+            if keep.size == 0:
+                continue
+            anchor_x = (keep % cols).astype(np.float32)
+            anchor_y = (keep // cols).astype(np.float32)
+            cx = (anchor_x + bbox[keep, 0]) * stride
+            cy = (anchor_y + bbox[keep, 1]) * stride
+            w = np.exp(bbox[keep, 2]) * stride
+            h = np.exp(bbox[keep, 3]) * stride
+            level_rows = np.empty((keep.size, 15), dtype=np.float32)
+            level_rows[:, 0] = cx - w / 2
+            level_rows[:, 1] = cy - h / 2
+            level_rows[:, 2] = w
+            level_rows[:, 3] = h
+            level_rows[:, 4:14:2] = (kps[keep, 0::2] + anchor_x[:, None]) * stride
+            level_rows[:, 5:14:2] = (kps[keep, 1::2] + anchor_y[:, None]) * stride
+            level_rows[:, 14] = scores[keep]
+            rows.append(level_rows)
+        if not rows:
+            return None
+        candidates = np.concatenate(rows, axis=0)
+        if candidates.shape[0] == 1:
+            return candidates
+        # FaceDetectorYN runs NMS on integer rects; truncating keeps the kept set identical.
+        keep = cv2.dnn.NMSBoxes(
+            np.trunc(candidates[:, :4]).astype(np.int32).tolist(),
+            candidates[:, 14].tolist(),
+            self.score_threshold,
+            YUNET_NMS_THRESHOLD,
+            top_k=YUNET_TOP_K,
+        )
+        if len(keep) == 0:
+            return None
+        return candidates[np.asarray(keep, dtype=np.int64).reshape(-1)]
+
+    def align(self, image: np.ndarray, face: np.ndarray) -> np.ndarray | None:
+        return align_face(image, face)
+
+    def embed(self, crops: Sequence[np.ndarray]) -> list[np.ndarray | None]:
+        if not crops:
+            return []
+        batch = sface_input_blob(crops)
+        step = self._sface_max_batch or batch.shape[0]
+        features: list[np.ndarray | None] = []
+        for start in range(0, batch.shape[0], step):
+            output = self.sface.run(None, {self._sface_input.name: batch[start : start + step]})[0]
+            output = np.asarray(output, dtype=np.float32)
+            features.extend(output.reshape(output.shape[0], -1))
+        return features
+
+
+def session_options(settings: Settings) -> Any:
+    options = ort.SessionOptions()
+    intra = int(settings.ort_intra_op_threads)
+    inter = int(settings.ort_inter_op_threads)
+    if intra > 0:
+        options.intra_op_num_threads = intra
+    if inter > 0:
+        options.inter_op_num_threads = inter
+        if inter > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    level = _GRAPH_OPTIMIZATION_LEVELS.get(str(settings.ort_graph_optimization_level).strip().lower(), "ORT_ENABLE_ALL")
+    options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, level)
+    return options
+
+
+def load_inference_backend(
+    settings: Settings,
+    yunet_path: Path,
+    sface_path: Path,
+    backend: str | None = None,
+) -> OpenCVBackend | OnnxRuntimeBackend:
+    requested = str(backend or settings.face_inference_backend or BACKEND_OPENCV).strip().lower()
+    if requested == BACKEND_ONNXRUNTIME:
+        if ort is not None:
+            return OnnxRuntimeBackend.load(settings, yunet_path, sface_path)
+        logger.warning("onnxruntime is not installed; using the OpenCV inference backend")
+    return OpenCVBackend.load(settings, yunet_path, sface_path)
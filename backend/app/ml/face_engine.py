@@ -2,15 +2,21 @@ from __future__ import annotations
 
 import logging
 import math
+import threading
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
 from dataclasses import dataclass
+from io import BytesIO
 from pathlib import Path
-from typing import Any
 
 import cv2
 import numpy as np
 import requests
+from PIL import Image
 
 from app.config import Settings
+from app.ml.backends import OnnxRuntimeBackend, OpenCVBackend, load_inference_backend
+from app.ml.quantization import resolve_model_files
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +30,24 @@ SFACE_MODEL_URL = (
     "https://github.com/opencv/opencv_zoo/blob/main/models/face_recognition_sface/"
     "face_recognition_sface_2021dec.onnx?raw=true"
 )
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def full_resolution_retry_side(max_side: int) -> int:
+    # Faceless images are re-detected at full resolution only when the source is
+    # clearly larger than the inference size.
+    return max(1800, int(max_side) + 200)
+
+
+@dataclass
+class DecodedImage:
+    pixels: np.ndarray
+    source: bytes | None = None
+    reduced: bool = False
 
 
 @dataclass
@@ -35,6 +59,13 @@ class FaceEmbedding:
     bbox: tuple[float, float, float, float]
 
 
+@dataclass
+class ImageFaces:
+    faces: list[FaceEmbedding]
+    # Detections dropped as too small that the full-resolution pass would keep.
+    small_faces: int = 0
+
+
 def _normalize(vec: np.ndarray) -> np.ndarray | None:
     norm = float(np.linalg.norm(vec))
     if norm <= 0:
@@ -42,51 +73,125 @@ def _normalize(vec: np.ndarray) -> np.ndarray | None:
     return vec / norm
 
 
+def _fit_dimension(vec: np.ndarray, dim: int) -> np.ndarray:
+    if vec.size < dim:
+        return np.pad(vec, (0, dim - vec.size), mode="constant")
+    return vec[:dim]
+
+
 class FaceEngine:
-    def __init__(self, settings: Settings) -> None:
+    def __init__(self, settings: Settings, backend: OpenCVBackend | OnnxRuntimeBackend | None = None) -> None:
         self.settings = settings
-        self._detector: cv2.FaceDetectorYN | None = None
-        self._recognizer: cv2.FaceRecognizerSF | None = None
+        # SFace emits 128-D features; the DB columns are sized from the same setting.
+        self.embedding_dim = max(1, int(settings.face_embedding_dim))
+        self._backend: OpenCVBackend | OnnxRuntimeBackend | None = backend
         self._init_error: str = ""
 
     def embed_faces(self, image_bytes: bytes, max_faces: int = 12) -> list[FaceEmbedding]:
-        image = self._decode_image(image_bytes)
-        if image is None:
-            return []
+        return self.embed_faces_batch([image_bytes], max_faces=max_faces)[0]
 
-        detector, recognizer = self._ensure_models_loaded()
-        if detector is None or recognizer is None:
-            if self.settings.enable_ml_fallback:
-                return [self._fallback_face(image)]
-            return []
+    def embed_faces_batch(
+        self,
+        images: Sequence[bytes | np.ndarray | DecodedImage],
+        max_faces: int = 12,
+    ) -> list[list[FaceEmbedding]]:
+        return [result.faces for result in self.analyze_faces_batch(images, max_faces=max_faces)]
 
-        resized = self._resize_for_inference(image, self.settings.face_resize_max_side)
-        faces = self._detect_faces(
-            image=resized,
-            detector=detector,
-            min_face_ratio=float(self.settings.face_min_face_ratio),
-            max_faces=max(1, min(int(max_faces), int(self.settings.face_max_faces_per_image))),
-        )
+    def analyze_faces_batch(
+        self,
+        images: Sequence[bytes | np.ndarray | DecodedImage],
+        max_faces: int = 12,
+    ) -> list[ImageFaces]:
+        outputs = [ImageFaces(faces=[]) for _ in images]
+        max_side = int(self.settings.face_resize_max_side)
+        decoded: list[DecodedImage | None] = []
+        for item in images:
+            if isinstance(item, DecodedImage):
+                decoded.append(item)
+            elif isinstance(item, np.ndarray):
+                decoded.append(DecodedImage(pixels=item))
+            else:
+                decoded.append(self.decode_image(item))
+
+        backend = self._ensure_models_loaded()
+        if backend is None:
+            if self.settings.enable_ml_fallback:
+                return [
+                    ImageFaces(faces=[self._fallback_face(image.pixels)] if image is not None else [])
+                    for image in decoded
+                ]
+            return outputs
 
-        out: list[FaceEmbedding] = []
-        for face, conf, area_ratio in faces:
-            sharpness = self._face_sharpness(resized, face)
-            if sharpness < float(self.settings.face_min_sharpness):
+        face_limit = max(1, min(int(max_faces), int(self.settings.face_max_faces_per_image)))
+        crops: list[np.ndarray] = []
+        pending: list[tuple[int, np.ndarray, float, float, float]] = []
+        for image_idx, image in enumerate(decoded):
+            if image is None:
                 continue
-            feature = self._face_feature(resized, face, recognizer)
+            resized = self._resize_for_inference(image.pixels, max_side)
+            faces, small_faces = self._detect_faces(
+                image=resized,
+                backend=backend,
+                min_face_ratio=float(self.settings.face_min_face_ratio),
+                max_faces=face_limit,
+            )
+            outputs[image_idx].small_faces = small_faces
+            if not faces:
+                # Small faces can vanish at inference size; retry once at full resolution.
+                full = self._full_resolution_image(image, max_side)
+                if full is not None:
+                    faces, _small = self._detect_faces(
+                        image=full,
+                        backend=backend,
+                        min_face_ratio=self._retry_min_face_ratio(),
+                        max_faces=face_limit,
+                    )
+                    if faces:
+                        resized = full
+            for face, conf, area_ratio in faces:
+                sharpness = self._face_sharpness(resized, face)
+                if sharpness < float(self.settings.face_min_sharpness):
+                    continue
+                aligned = backend.align(resized, face)
+                if aligned is None or aligned.size == 0:
+                    continue
+                crops.append(aligned)
+                pending.append((image_idx, face, float(conf), float(area_ratio), float(sharpness)))
+
+        features = self.embed_aligned_faces(crops)
+        for (image_idx, face, conf, area_ratio, sharpness), feature in zip(pending, features):
             if feature is None:
                 continue
             x, y, w, h = [float(v) for v in face[:4]]
-            out.append(
+            outputs[image_idx].faces.append(
                 FaceEmbedding(
                     embedding=[round(float(v), 7) for v in feature.tolist()],
-                    area_ratio=float(area_ratio),
-                    det_confidence=float(conf),
-                    sharpness=float(sharpness),
+                    area_ratio=area_ratio,
+                    det_confidence=conf,
+                    sharpness=sharpness,
                     bbox=(x, y, w, h),
                 )
             )
-        return out
+        return outputs
+
+    def embed_aligned_faces(self, crops: Sequence[np.ndarray]) -> list[np.ndarray | None]:
+        if not crops:
+            return []
+        backend = self._ensure_models_loaded()
+        if backend is None:
+            return [None for _ in crops]
+
+        batch_size = max(1, int(self.settings.face_embed_batch_size))
+        features: list[np.ndarray | None] = []
+        for start in range(0, len(crops), batch_size):
+            chunk = list(crops[start : start + batch_size])
+            for feature in backend.embed(chunk):
+                if feature is None:
+                    features.append(None)
+                    continue
+                vec = _fit_dimension(np.asarray(feature, dtype=np.float32).reshape(-1), self.embedding_dim)
+                features.append(_normalize(vec))
+        return features
 
     def embed_single_face(self, image_bytes: bytes) -> list[float] | None:
         faces = self.embed_faces(image_bytes=image_bytes, max_faces=8)
@@ -95,11 +200,11 @@ class FaceEngine:
         faces.sort(key=lambda item: (item.area_ratio, item.det_confidence), reverse=True)
         return faces[0].embedding
 
-    def _ensure_models_loaded(self) -> tuple[cv2.FaceDetectorYN | None, cv2.FaceRecognizerSF | None]:
-        if self._detector is not None and self._recognizer is not None:
-            return self._detector, self._recognizer
+    def _ensure_models_loaded(self) -> OpenCVBackend | OnnxRuntimeBackend | None:
+        if self._backend is not None:
+            return self._backend
         if self._init_error:
-            return None, None
+            return None
 
         try:
             cache_dir = self.settings.face_model_cache_dir_path
@@ -108,26 +213,13 @@ class FaceEngine:
             sface_path = cache_dir / SFACE_MODEL_FILE
             self._download_if_missing(yunet_path, YUNET_MODEL_URL, min_bytes=100_000)
             self._download_if_missing(sface_path, SFACE_MODEL_URL, min_bytes=5_000_000)
-
-            detector = cv2.FaceDetectorYN.create(
-                str(yunet_path),
-                "",
-                (int(self.settings.face_det_size), int(self.settings.face_det_size)),
-                float(self.settings.face_det_score_threshold),
-                0.3,
-                5000,
-            )
-            recognizer = cv2.FaceRecognizerSF.create(str(sface_path), "")
-            if detector is None or recognizer is None:
-                raise RuntimeError("Failed to initialize YuNet/SFace models")
-
-            self._detector = detector
-            self._recognizer = recognizer
-            return detector, recognizer
+            yunet_path, sface_path, backend_name = resolve_model_files(self.settings, yunet_path, sface_path)
+            self._backend = load_inference_backend(self.settings, yunet_path, sface_path, backend=backend_name)
+            return self._backend
         except Exception as exc:
             self._init_error = str(exc)
             logger.warning("YuNet/SFace init failed; fallback enabled=%s; error=%s", self.settings.enable_ml_fallback, exc)
-            return None, None
+            return None
 
     def _download_if_missing(self, model_path: Path, model_url: str, min_bytes: int) -> None:
         if model_path.exists() and model_path.stat().st_size >= min_bytes:
@@ -145,11 +237,45 @@ class FaceEngine:
             raise RuntimeError(f"Downloaded model file is incomplete for {model_path.name}")
         tmp_path.replace(model_path)
 
-    def _decode_image(self, image_bytes: bytes) -> np.ndarray | None:
+    def decode_image(self, image_bytes: bytes) -> DecodedImage | None:
         arr = np.frombuffer(image_bytes, dtype=np.uint8)
         if arr.size == 0:
             return None
-        return cv2.imdecode(arr, cv2.IMREAD_COLOR)
+        flag = self._decode_flag(image_bytes, int(self.settings.face_resize_max_side))
+        image = cv2.imdecode(arr, flag)
+        if image is None and flag != cv2.IMREAD_COLOR:
+            flag = cv2.IMREAD_COLOR
+            image = cv2.imdecode(arr, flag)
+        if image is None:
+            return None
+        return DecodedImage(pixels=image, source=image_bytes, reduced=flag != cv2.IMREAD_COLOR)
+
+    def _decode_flag(self, image_bytes: bytes, max_side: int) -> int:
+        # libjpeg can scale by 1/2, 1/4 or 1/8 while decoding; pick the smallest
+        # output that still covers the inference size so the resize stays a downscale.
+        if max_side <= 0:
+            return cv2.IMREAD_COLOR
+        try:
+            with Image.open(BytesIO(image_bytes)) as header:
+                if header.format != "JPEG":
+                    return cv2.IMREAD_COLOR
+                long_side = max(header.size)
+        except Exception:
+            return cv2.IMREAD_COLOR
+        for factor, flag in REDUCED_DECODE_FLAGS:
+            if -(-long_side // factor) >= max_side:
+                return flag
+        return cv2.IMREAD_COLOR
+
+    def _full_resolution_image(self, image: DecodedImage, max_side: int) -> np.ndarray | None:
+        # Retry only reduced decodes: re-detecting every faceless full decode doubled
+        # the detector cost of scenery-heavy folders.
+        if not image.reduced or image.source is None:
+            return None
+        full = cv2.imdecode(np.frombuffer(image.source, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if full is None or max(full.shape[:2]) <= full_resolution_retry_side(max_side):
+            return None
+        return full
 
     def _resize_for_inference(self, image: np.ndarray, max_side: int) -> np.ndarray:
         if max_side <= 0:
@@ -163,36 +289,41 @@ class FaceEngine:
         new_h = max(1, int(round(h * scale)))
         return cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
 
+    def _retry_min_face_ratio(self) -> float:
+        return max(0.0008, float(self.settings.face_min_face_ratio) * 0.75)
+
     def _detect_faces(
         self,
         *,
         image: np.ndarray,
-        detector: cv2.FaceDetectorYN,
+        backend: OpenCVBackend | OnnxRuntimeBackend,
         min_face_ratio: float,
         max_faces: int,
-    ) -> list[tuple[np.ndarray, float, float]]:
+    ) -> tuple[list[tuple[np.ndarray, float, float]], int]:
         image_h, image_w = image.shape[:2]
         if image_h < 2 or image_w < 2:
-            return []
-        detector.setInputSize((image_w, image_h))
-        _ok, faces = detector.detect(image)
+            return [], 0
+        faces = backend.detect(image)
         if faces is None or len(faces) == 0:
-            return []
+            return [], 0
 
         image_area = float(image_h * image_w)
+        small_floor = min(min_face_ratio, self._retry_min_face_ratio())
         candidates: list[tuple[np.ndarray, float, float]] = []
+        small_faces = 0
         for face in faces:
             x, y, w, h = [float(v) for v in face[:4]]
             if w <= 1 or h <= 1:
                 continue
             area_ratio = (w * h) / image_area
             if area_ratio < min_face_ratio:
+                small_faces += int(area_ratio >= small_floor)
                 continue
             det_conf = float(face[14]) if len(face) > 14 else 0.0
             candidates.append((face.astype(np.float32), det_conf, area_ratio))
 
         candidates.sort(key=lambda item: (item[2], item[1]), reverse=True)
-        return candidates[: max(1, int(max_faces))]
+        return candidates[: max(1, int(max_faces))], small_faces
 
     def _face_sharpness(self, image: np.ndarray, face: np.ndarray) -> float:
         x, y, w, h = [float(v) for v in face[:4]]
@@ -208,31 +339,16 @@ class FaceEngine:
         gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
         return float(cv2.Laplacian(gray, cv2.CV_64F).var())
 
-    def _face_feature(self, image: np.ndarray, face: np.ndarray, recognizer: cv2.FaceRecognizerSF) -> np.ndarray | None:
-        aligned = recognizer.alignCrop(image, face)
-        if aligned is None or aligned.size == 0:
-            return None
-        feature = recognizer.feature(aligned)
-        if feature is None:
-            return None
-        vec = np.asarray(feature, dtype=np.float32).reshape(-1)
-        # SFace commonly returns 128-D vectors; pad to DB vector size (512) for schema consistency.
-        if vec.size < 512:
-            vec = np.pad(vec, (0, 512 - vec.size), mode="constant")
-        elif vec.size > 512:
-            vec = vec[:512]
-        normalized = _normalize(vec)
-        return normalized
-
     def _fallback_face(self, image: np.ndarray) -> FaceEmbedding:
         h, w = image.shape[:2]
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        small = cv2.resize(gray, (32, 16), interpolation=cv2.INTER_AREA).astype(np.float32).reshape(-1)
-        if small.size < 512:
-            small = np.pad(small, (0, 512 - small.size), mode="constant")
-        vec = small[:512]
+        dim = self.embedding_dim
+        grid_h = max(1, int(math.sqrt(dim / 2)))
+        grid_w = max(1, dim // grid_h)
+        small = cv2.resize(gray, (grid_w, grid_h), interpolation=cv2.INTER_AREA).astype(np.float32).reshape(-1)
+        vec = _fit_dimension(small, dim)
         normalized = _normalize(vec)
-        vector = normalized.tolist() if normalized is not None else [0.0] * 512
+        vector = normalized.tolist() if normalized is not None else [0.0] * dim
         return FaceEmbedding(
             embedding=[float(v) for v in vector],
             area_ratio=1.0,
@@ -240,3 +356,24 @@ class FaceEngine:
             sharpness=float(cv2.Laplacian(gray, cv2.CV_64F).var()),
             bbox=(0.0, 0.0, float(w), float(h)),
         )
+
+
+class FaceEnginePool:
+    # cv2 detectors keep per-call input size state, so concurrent sync
+    # threads each lease their own engine instead of sharing one.
+    def __init__(self, settings: Settings, primary: FaceEngine | None = None) -> None:
+        self.settings = settings
+        self._idle: list[FaceEngine] = [primary] if primary is not None else []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self) -> Iterator[FaceEngine]:
+        with self._lock:
+            engine = self._idle.pop() if self._idle else None
+        if engine is None:
+            engine = FaceEngine(self.settings)
+        try:
+            yield engine
+        finally:
+            with self._lock:
+                self._idle.append(engine)
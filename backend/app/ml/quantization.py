@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+from collections.abc import Iterator
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import cv2
+import numpy as np
+
+from app.config import Settings, get_settings
+from app.ml.backends import BACKEND_ONNXRUNTIME, OnnxRuntimeBackend, sface_input_blob
+from app.services.matching import percent_to_cosine_threshold
+
+try:
+    from onnxruntime import quantization as ort_quantization
+except Exception:  # pragma: no cover
+    ort_quantization = None
+
+logger = logging.getLogger(__name__)
+
+MODEL_PRECISION_FP32 = "fp32"
+MODEL_PRECISION_INT8 = "int8"
+INT8_REPORT_FILE = "face_models_int8_report.json"
+QUANTIZE_DYNAMIC = "dynamic"
+QUANTIZE_STATIC = "static"
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+DETECTION_IOU = 0.5
+
+
+def int8_model_path(model_path: Path) -> Path:
+    return model_path.with_name(f"{model_path.stem}_int8{model_path.suffix}")
+
+
+def _digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _iter_images(image_dir: Path, limit: int, max_side: int) -> Iterator[np.ndarray]:
+    paths = sorted(path for path in image_dir.rglob("*") if path.suffix.lower() in IMAGE_SUFFIXES)
+    for path in paths[: max(1, limit)]:
+        image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        long_side = max(image.shape[:2])
+        if max_side > 0 and long_side > max_side:
+            scale = max_side / long_side
+            size = (max(1, int(round(image.shape[1] * scale))), max(1, int(round(image.shape[0] * scale))))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        yield image
+
+
+def _aligned_crops(backend: OnnxRuntimeBackend, images: Iterator[np.ndarray], max_faces: int) -> list[np.ndarray]:
+    crops: list[np.ndarray] = []
+    for image in images:
+        faces = backend.detect(image)
+        if faces is None:
+            continue
+        for face in faces[:max_faces]:
+            crop = backend.align(image, face)
+            if crop is not None and crop.size:
+                crops.append(crop)
+    return crops
+
+
+class _CropCalibrationReader:
+    def __init__(self, input_name: str, crops: list[np.ndarray]) -> None:
+        self._batches = iter([{input_name: sface_input_blob([crop])} for crop in crops])
+
+    def get_next(self) -> dict[str, np.ndarray] | None:
+        return next(self._batches, None)
+
+
+def quantize_models(
+    settings: Settings,
+    *,
+    models: tuple[str, ...] = ("sface",),
+    mode: str = QUANTIZE_DYNAMIC,
+    calibration_dir: Path | None = None,
+    calibration_images: int = 200,
+) -> list[Path]:
+    if ort_quantization is None:
+        raise RuntimeError("onnxruntime is required to quantize face models")
+    from app.ml.face_engine import SFACE_MODEL_FILE, YUNET_MODEL_FILE
+
+    cache_dir = settings.face_model_cache_dir_path
+    sources = {"yunet": cache_dir / YUNET_MODEL_FILE, "sface": cache_dir / SFACE_MODEL_FILE}
+    written: list[Path] = []
+    for name in models:
+        source = sources[name]
+        if not source.exists():
+            raise FileNotFoundError(f"{source} is missing; run the worker once to download it")
+        target = int8_model_path(source)
+        if mode == QUANTIZE_STATIC and name == "sface":
+            if calibration_dir is None:
+                raise ValueError("Static quantization needs --calibration-dir")
+            reference = OnnxRuntimeBackend.load(settings, sources["yunet"], source)
+            crops = _aligned_crops(
+                reference,
+                _iter_images(calibration_dir, calibration_images, int(settings.face_resize_max_side)),
+                max_faces=int(settings.face_max_faces_per_image),
+            )
+            if not crops:
+                raise RuntimeError(f"No faces found for calibration in {calibration_dir}")
+            ort_quantization.quantize_static(
+                str(source),
+                str(target),
+                _CropCalibrationReader(reference.sface.get_inputs()[0].name, crops),
+                quant_format=ort_quantization.QuantFormat.QDQ,
+                activation_type=ort_quantization.QuantType.QUInt8,
+                weight_type=ort_quantization.QuantType.QInt8,
+            )
+        else:
+            # YuNet takes arbitrary input sizes, so it only gets dynamic quantization. The CPU
+            # ConvInteger kernel is uint8-only, hence QUInt8 weights here.
+            ort_quantization.quantize_dynamic(str(source), str(target), weight_type=ort_quantization.QuantType.QUInt8)
+        written.append(target)
+        logger.info("Wrote %s", target)
+    return written
+
+
+def _box_iou(box: np.ndarray, others: np.ndarray) -> np.ndarray:
+    x1 = np.maximum(box[0], others[:, 0])
+    y1 = np.maximum(box[1], others[:, 1])
+    x2 = np.minimum(box[0] + box[2], others[:, 0] + others[:, 2])
+    y2 = np.minimum(box[1] + box[3], others[:, 1] + others[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = box[2] * box[3] + others[:, 2] * others[:, 3] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def _unit_rows(features: list[np.ndarray | None]) -> np.ndarray:
+    matrix = np.stack([np.asarray(item, dtype=np.float32).reshape(-1) for item in features])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def decision_gate(
+    expected: np.ndarray,
+    actual: np.ndarray,
+    threshold: float,
+    *,
+    min_recall: float,
+    max_false_positive_rate: float,
+) -> dict[str, Any]:
+    # Nearly all pairs in a photo set are different people, so agreement over every
+    # pair hides INT8 losing real matches; score the two decision classes separately.
+    upper = np.triu_indices(len(expected), k=1)
+    same_expected = (expected @ expected.T)[upper] >= threshold
+    same_actual = (actual @ actual.T)[upper] >= threshold
+    positives = int(same_expected.sum())
+    negatives = int(same_expected.size - positives)
+    recall = float(same_actual[same_expected].mean()) if positives else None
+    false_positive_rate = float(same_actual[~same_expected].mean()) if negatives else 0.0
+    if not positives:
+        logger.warning("INT8 gate photo set has no FP32 matching pairs; match recall is unmeasured")
+    return {
+        "positive_pairs": positives,
+        "negative_pairs": negatives,
+        "match_recall": recall,
+        "false_positive_rate": false_positive_rate,
+        "passed": (recall is None or recall >= min_recall) and false_positive_rate <= max_false_positive_rate,
+    }
+
+
+def evaluate_int8_models(settings: Settings, image_dir: Path, *, max_images: int = 200) -> dict[str, Any]:
+    from app.ml.face_engine import SFACE_MODEL_FILE, YUNET_MODEL_FILE
+
+    cache_dir = settings.face_model_cache_dir_path
+    yunet_path, sface_path = cache_dir / YUNET_MODEL_FILE, cache_dir / SFACE_MODEL_FILE
+    yunet_int8, sface_int8 = int8_model_path(yunet_path), int8_model_path(sface_path)
+    if not sface_int8.exists() and not yunet_int8.exists():
+        raise FileNotFoundError(f"No INT8 models in {cache_dir}; run the quantize command first")
+
+    reference = OnnxRuntimeBackend.load(settings, yunet_path, sface_path)
+    candidate = OnnxRuntimeBackend.load(
+        settings,
+        yunet_int8 if yunet_int8.exists() else yunet_path,
+        sface_int8 if sface_int8.exists() else sface_path,
+    )
+
+    max_faces = int(settings.face_max_faces_per_image)
+    crops: list[np.ndarray] = []
+    detected = 0
+    recovered = 0
+    images = 0
+    for image in _iter_images(image_dir, max_images, int(settings.face_resize_max_side)):
+        images += 1
+        faces = reference.detect(image)
+        if faces is None:
+            continue
+        faces = faces[:max_faces]
+        if yunet_int8.exists():
+            other = candidate.detect(image)
+            detected += len(faces)
+            if other is not None:
+                recovered += sum(int(_box_iou(face[:4], other[:, :4]).max() >= DETECTION_IOU) for face in faces)
+        crops.extend(crop for crop in (reference.align(image, face) for face in faces) if crop is not None)
+
+    report: dict[str, Any] = {
+        "evaluated_at": datetime.now(timezone.utc).isoformat(),
+        "images": images,
+        "faces": len(crops),
+        "min_cosine": float(settings.face_int8_min_cosine),
+        "min_agreement": float(settings.face_int8_min_agreement),
+        "max_false_positive_rate": float(settings.face_int8_max_false_positive_rate),
+        "models": {},
+    }
+    passed = bool(crops)
+    if crops:
+        expected = _unit_rows(reference.embed(crops))
+        actual = _unit_rows(candidate.embed(crops))
+        cosines = np.sum(expected * actual, axis=1)
+        threshold = percent_to_cosine_threshold(settings.face_similarity_threshold_percent)
+        decisions = decision_gate(
+            expected,
+            actual,
+            threshold,
+            min_recall=report["min_agreement"],
+            max_false_positive_rate=report["max_false_positive_rate"],
+        )
+        report.update(
+            mean_cosine=float(cosines.mean()),
+            p01_cosine=float(np.percentile(cosines, 1)),
+            decision_threshold=float(threshold),
+            **{key: value for key, value in decisions.items() if key != "passed"},
+        )
+        passed = passed and report["mean_cosine"] >= report["min_cosine"] and decisions["passed"]
+    if yunet_int8.exists():
+        recall = recovered / detected if detected else 0.0
+        report["detection_recall"] = recall
+        passed = passed and recall >= report["min_agreement"]
+    for path in (yunet_int8, sface_int8):
+        if path.exists():
+            report["models"][path.name] = _digest(path)
+    report["passed"] = passed
+    (cache_dir / INT8_REPORT_FILE).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return report
+
+
+def approved_int8_models(yunet_path: Path, sface_path: Path) -> tuple[Path, Path] | None:
+    report_path = sface_path.parent / INT8_REPORT_FILE
+    try:
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        logger.warning("INT8 face models have no evaluation report; run `python -m app.ml.quantization evaluate`")
+        return None
+    if not report.get("passed"):
+        logger.warning("INT8 face models failed the accuracy gate; using FP32 models")
+        return None
+    approved = report.get("models") or {}
+    resolved: list[Path] = []
+    for path in (yunet_path, sface_path):
+        candidate = int8_model_path(path)
+        if candidate.name not in approved:
+            resolved.append(path)
+            continue
+        if not candidate.exists() or _digest(candidate) != approved[candidate.name]:
+            logger.warning("%s changed since it was evaluated; using FP32 models", candidate.name)
+            return None
+        resolved.append(candidate)
+    return resolved[0], resolved[1]
+
+
+def resolve_model_files(settings: Settings, yunet_path: Path, sface_path: Path) -> tuple[Path, Path, str | None]:
+    precision = str(settings.face_model_precision or MODEL_PRECISION_FP32).strip().lower()
+    if precision != MODEL_PRECISION_INT8:
+        return yunet_path, sface_path, None
+    approved = approved_int8_models(yunet_path, sface_path)
+    if approved is None:
+        return yunet_path, sface_path, None
+    # Integer ops from onnxruntime.quantization only run on ONNX Runtime.
+    return approved[0], approved[1], BACKEND_ONNXRUNTIME
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build and gate INT8 YuNet/SFace models")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("quantize", help="Write *_int8.onnx next to the cached FP32 models")
+    build.add_argument("--models", default="sface", help="Comma separated: sface,yunet")
+    build.add_argument("--mode", choices=(QUANTIZE_DYNAMIC, QUANTIZE_STATIC), default=QUANTIZE_DYNAMIC)
+    build.add_argument("--calibration-dir", type=Path, default=None)
+    build.add_argument("--calibration-images", type=int, default=200)
+    evaluate = commands.add_parser("evaluate", help="Compare INT8 against FP32 on local photos and write the gate report")
+    evaluate.add_argument("image_dir", type=Path)
+    evaluate.add_argument("--max-images", type=int, default=200)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    settings = get_settings()
+    if args.command == "quantize":
+        models = tuple(item.strip() for item in args.models.split(",") if item.strip())
+        quantize_models(
+            settings,
+            models=models,
+            mode=args.mode,
+            calibration_dir=args.calibration_dir,
+            calibration_images=args.calibration_images,
+        )
+        return
+    report = evaluate_int8_models(settings, args.image_dir, max_images=args.max_images)
+    print(json.dumps(report, indent=2))
+    if not report["passed"]:
+        raise SystemExit("INT8 models are below the agreement threshold; FACE_MODEL_PRECISION=int8 stays disabled")
+
+
+if __name__ == "__main__":
+    main()
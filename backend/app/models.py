@@ -3,7 +3,7 @@ from __future__ import annotations
 from datetime import datetime, timezone
 from uuid import uuid4
 
-from sqlalchemy import JSON, Boolean, DateTime, Float, ForeignKey, Integer, String, Text, UniqueConstraint
+from sqlalchemy import JSON, Boolean, DateTime, Float, ForeignKey, Index, Integer, String, Text, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.db import Base
@@ -27,6 +27,11 @@ class Event(Base):
     admin_token_hash: Mapped[str] = mapped_column(String(300), nullable=False)
     status: Mapped[str] = mapped_column(String(40), nullable=False, default="queued")
     guest_auth_required: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    embedding_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    cluster_baseline_faces: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    cluster_incremental_faces: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    drive_modified_watermark: Mapped[str | None] = mapped_column(String(40), nullable=True)
+    full_synced_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now, onupdate=utc_now)
 
@@ -49,8 +54,10 @@ class Job(Base):
     stage: Mapped[str] = mapped_column(String(180), nullable=False, default="queued")
     error_text: Mapped[str] = mapped_column(Text, nullable=False, default="")
     payload: Mapped[dict] = mapped_column(JSON, default=dict)
+    priority: Mapped[int] = mapped_column(Integer, nullable=False, default=10)
     attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     locked_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    run_after: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     completed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
@@ -60,6 +67,19 @@ class Job(Base):
     query: Mapped["GuestQuery | None"] = relationship(back_populates="jobs")
 
 
+class SyncListingFile(Base):
+    __tablename__ = "sync_listing_files"
+    __table_args__ = (Index("ix_sync_listing_files_queue", "job_id", "queue_index"),)
+
+    job_id: Mapped[str] = mapped_column(String(36), ForeignKey("jobs.id", ondelete="CASCADE"), primary_key=True)
+    drive_file_id: Mapped[str] = mapped_column(String(200), primary_key=True)
+    # Position in the shard queue; null for files the parent job already handled.
+    queue_index: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    content_stamp: Mapped[str] = mapped_column(String(400), nullable=False, default="")
+    photo_id: Mapped[str | None] = mapped_column(String(36), nullable=True)
+    file: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+
+
 class Photo(Base):
     __tablename__ = "photos"
     __table_args__ = (UniqueConstraint("event_id", "drive_file_id", name="uq_photo_event_drive_file"),)
@@ -91,7 +111,7 @@ class Face(Base):
     event_id: Mapped[str] = mapped_column(String(36), ForeignKey("events.id", ondelete="CASCADE"), nullable=False, index=True)
     photo_id: Mapped[str] = mapped_column(String(36), ForeignKey("photos.id", ondelete="CASCADE"), nullable=False, index=True)
     face_index: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
-    embedding: Mapped[list[float]] = mapped_column(EmbeddingVector(512), nullable=False)
+    embedding: Mapped[list[float]] = mapped_column(EmbeddingVector(), nullable=False)
     area_ratio: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
     det_confidence: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
     sharpness: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
@@ -100,6 +120,7 @@ class Face(Base):
     bbox_w: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
     bbox_h: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
     cluster_label: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
+    clustered: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
 
     photo: Mapped["Photo"] = relationship(back_populates="faces")
@@ -112,7 +133,7 @@ class FaceCluster(Base):
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid4()))
     event_id: Mapped[str] = mapped_column(String(36), ForeignKey("events.id", ondelete="CASCADE"), nullable=False, index=True)
     cluster_label: Mapped[int] = mapped_column(Integer, nullable=False)
-    centroid: Mapped[list[float]] = mapped_column(EmbeddingVector(512), nullable=False)
+    centroid: Mapped[list[float]] = mapped_column(EmbeddingVector(), nullable=False)
     face_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     cover_photo_id: Mapped[str | None] = mapped_column(String(36), ForeignKey("photos.id", ondelete="SET NULL"), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
@@ -1,13 +1,47 @@
 from __future__ import annotations
 
 from collections import Counter
+from dataclasses import dataclass
+from uuid import uuid4
 
 import numpy as np
+from scipy import sparse
 from sklearn.cluster import DBSCAN
-from sqlalchemy import delete, select
+from sklearn.neighbors import NearestNeighbors, sort_graph_by_row_values
+from sqlalchemy import Integer, String, bindparam, column, delete, func, insert, select, update, values
 from sqlalchemy.orm import Session
 
-from app.models import Face, FaceCluster
+from app.models import Event, Face, FaceCluster, utc_now
+
+try:
+    import hnswlib
+except Exception:  # pragma: no cover
+    hnswlib = None
+
+CLUSTER_MODE_FULL = "full"
+CLUSTER_MODE_INCREMENTAL = "incremental"
+CLUSTER_ENGINE_DBSCAN = "dbscan"
+CLUSTER_ENGINE_GRAPH = "graph"
+# Sparse matrices drop explicit zeros; duplicate faces keep their edge with this floor.
+GRAPH_MIN_DISTANCE = 1e-9
+# Below this size an exact brute-force kNN is cheaper than building an HNSW index.
+GRAPH_EXACT_MAX_FACES = 20000
+BULK_CHUNK_SIZE = 5000
+# Touched clusters larger than this skip the local split check; drift-triggered
+# full reclusters still cover them.
+CLUSTER_SPLIT_MAX_FACES = 5000
+CLUSTER_MERGE_FACTOR = 0.5
+
+
+@dataclass
+class ClusteringResult:
+    cluster_count: int
+    mode: str
+    assigned: int = 0
+    created: int = 0
+    merged: int = 0
+    split: int = 0
+    drift: float = 0.0
 
 
 def normalize(vec: np.ndarray) -> np.ndarray:
@@ -17,46 +51,426 @@ def normalize(vec: np.ndarray) -> np.ndarray:
     return vec / norm
 
 
-def cluster_event_faces(db: Session, *, event_id: str, eps: float, min_samples: int) -> int:
-    faces = db.execute(select(Face).where(Face.event_id == event_id).order_by(Face.photo_id, Face.face_index)).scalars().all()
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def neighbor_graph(vectors: np.ndarray, *, eps: float, neighbors: int) -> sparse.csr_matrix:
+    unit = np.ascontiguousarray(_unit_rows(np.asarray(vectors, dtype=np.float32)))
+    count = unit.shape[0]
+    k = max(1, min(count, int(neighbors)))
+    if hnswlib is not None and count > GRAPH_EXACT_MAX_FACES:
+        index = hnswlib.Index(space="cosine", dim=unit.shape[1])
+        index.init_index(max_elements=count, ef_construction=80, M=16)
+        index.add_items(unit, np.arange(count), num_threads=-1)
+        index.set_ef(max(2 * k, 64))
+        indices, distances = index.knn_query(unit, k=k, num_threads=-1)
+    else:
+        model = NearestNeighbors(n_neighbors=k, metric="cosine", algorithm="brute", n_jobs=-1).fit(unit)
+        distances, indices = model.kneighbors(unit)
+    keep = (distances <= eps).ravel()
+    rows = np.repeat(np.arange(count), k)[keep]
+    cols = indices.ravel()[keep].astype(np.int64)
+    values = np.maximum(distances.ravel()[keep].astype(np.float32), GRAPH_MIN_DISTANCE)
+    graph = sparse.csr_matrix((values, (rows, cols)), shape=(count, count))
+    # kNN lists are one-sided; the union keeps DBSCAN's symmetric neighborhoods.
+    return sort_graph_by_row_values(graph.maximum(graph.T).tocsr(), warn_when_not_sorted=False)
+
+
+def cluster_labels(
+    vectors: np.ndarray,
+    *,
+    eps: float,
+    min_samples: int,
+    engine: str = CLUSTER_ENGINE_DBSCAN,
+    neighbors: int = 32,
+) -> np.ndarray:
+    if str(engine).strip().lower() == CLUSTER_ENGINE_GRAPH:
+        graph = neighbor_graph(vectors, eps=float(eps), neighbors=neighbors)
+        return DBSCAN(eps=float(eps), min_samples=int(min_samples), metric="precomputed", n_jobs=-1).fit_predict(graph)
+    return DBSCAN(eps=float(eps), min_samples=int(min_samples), metric="cosine").fit_predict(vectors)
+
+
+def summarize_clusters(labels: np.ndarray, vectors: np.ndarray, photo_ids: list[str]) -> list[dict]:
+    labels = np.asarray(labels)
+    member_rows = np.flatnonzero(labels >= 0)
+    if member_rows.size == 0:
+        return []
+    # Sort members by label once; every per-cluster aggregate is then a segment reduction.
+    order = member_rows[np.argsort(labels[member_rows], kind="stable")]
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    counts = np.diff(np.r_[starts, order.size])
+    sums = np.add.reduceat(np.asarray(vectors, dtype=np.float32)[order], starts, axis=0)
+    centroids = _unit_rows(sums)
+
+    photo_names, photo_codes = np.unique(np.asarray(photo_ids, dtype=object)[order].astype(str), return_inverse=True)
+    pair_keys = sorted_labels.astype(np.int64) * (len(photo_names) + 1) + photo_codes
+    unique_pairs, pair_counts = np.unique(pair_keys, return_counts=True)
+    pair_labels = unique_pairs // (len(photo_names) + 1)
+    # Most faces per (cluster, photo) wins the cover; ties go to the smallest photo id.
+    best = np.lexsort((-pair_counts, pair_labels))
+    first = best[np.r_[True, pair_labels[best][1:] != pair_labels[best][:-1]]]
+    covers = photo_names[unique_pairs[first] % (len(photo_names) + 1)]
+
+    return [
+        {
+            "cluster_label": int(label),
+            "centroid": centroid.astype(np.float32).tolist(),
+            "face_count": int(count),
+            "cover_photo_id": str(cover),
+        }
+        for label, centroid, count, cover in zip(sorted_labels[starts].tolist(), centroids, counts.tolist(), covers)
+    ]
+
+
+def write_cluster_labels(db: Session, assignments: list[tuple[str, int]]) -> None:
+    table = Face.__table__
+    for start in range(0, len(assignments), BULK_CHUNK_SIZE):
+        chunk = assignments[start : start + BULK_CHUNK_SIZE]
+        if db.get_bind().dialect.name == "postgresql":
+            data = values(column("face_id", String), column("label", Integer), name="labels").data(chunk)
+            db.execute(update(table).where(table.c.id == data.c.face_id).values(cluster_label=data.c.label))
+        else:
+            db.execute(
+                update(table).where(table.c.id == bindparam("face_id")).values(cluster_label=bindparam("label")),
+                [{"face_id": face_id, "label": label} for face_id, label in chunk],
+            )
+
+
+def insert_clusters(db: Session, event_id: str, summaries: list[dict]) -> None:
+    now = utc_now()
+    rows = [
+        {"id": str(uuid4()), "event_id": event_id, "created_at": now, "updated_at": now, **summary}
+        for summary in summaries
+    ]
+    for start in range(0, len(rows), BULK_CHUNK_SIZE):
+        db.execute(insert(FaceCluster.__table__).values(rows[start : start + BULK_CHUNK_SIZE]))
+
+
+def _expire_faces(db: Session) -> None:
+    # Set-based writes bypass the identity map; reload loaded faces/clusters on next access.
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, (Face, FaceCluster)):
+            db.expire(obj)
+
+
+def cluster_event_faces(
+    db: Session,
+    *,
+    event_id: str,
+    eps: float,
+    min_samples: int,
+    engine: str = CLUSTER_ENGINE_DBSCAN,
+    neighbors: int = 32,
+) -> int:
+    db.flush()
+    rows = db.execute(
+        select(Face.id, Face.photo_id, Face.embedding)
+        .where(Face.event_id == event_id)
+        .order_by(Face.photo_id, Face.face_index)
+    ).all()
     db.execute(delete(FaceCluster).where(FaceCluster.event_id == event_id))
-    if not faces:
+    db.execute(
+        update(Face.__table__)
+        .where(Face.__table__.c.event_id == event_id)
+        .values(cluster_label=None, clustered=True)
+    )
+    _expire_faces(db)
+    if len(rows) < max(1, min_samples):
         db.flush()
         return 0
 
-    vectors = np.asarray([face.embedding for face in faces], dtype=np.float32)
-    if vectors.shape[0] < min_samples:
-        for face in faces:
-            face.cluster_label = None
-            db.add(face)
+    vectors = np.asarray([row.embedding for row in rows], dtype=np.float32)
+    labels = cluster_labels(vectors, eps=eps, min_samples=min_samples, engine=engine, neighbors=neighbors)
+    write_cluster_labels(db, [(row.id, int(label)) for row, label in zip(rows, labels.tolist()) if label >= 0])
+    summaries = summarize_clusters(labels, vectors, [row.photo_id for row in rows])
+    insert_clusters(db, event_id, summaries)
+    db.flush()
+    return len(summaries)
+
+
+def cluster_drift(db: Session, event: Event) -> tuple[float, int]:
+    total = int(db.execute(select(func.count(Face.id)).where(Face.event_id == event.id)).scalar_one() or 0)
+    pending = int(
+        db.execute(
+            select(func.count(Face.id)).where(Face.event_id == event.id, Face.clustered.is_(False))
+        ).scalar_one()
+        or 0
+    )
+    baseline = int(event.cluster_baseline_faces or 0)
+    incremental = int(event.cluster_incremental_faces or 0)
+    if baseline <= 0:
+        return float("inf"), pending
+    removed = max(0, baseline + incremental - (total - pending))
+    return float(incremental + pending + removed) / float(baseline), pending
+
+
+def update_event_clusters(
+    db: Session,
+    *,
+    event_id: str,
+    eps: float,
+    min_samples: int,
+    drift_ratio: float,
+    full: bool = False,
+    engine: str = CLUSTER_ENGINE_DBSCAN,
+    neighbors: int = 32,
+) -> ClusteringResult:
+    event = db.get(Event, event_id)
+    if event is None:
+        return ClusteringResult(cluster_count=0, mode=CLUSTER_MODE_FULL)
+    drift, pending = cluster_drift(db, event)
+    if full or drift > float(drift_ratio):
+        count = cluster_event_faces(
+            db, event_id=event_id, eps=eps, min_samples=min_samples, engine=engine, neighbors=neighbors
+        )
+        event.cluster_baseline_faces = int(
+            db.execute(select(func.count(Face.id)).where(Face.event_id == event_id)).scalar_one() or 0
+        )
+        event.cluster_incremental_faces = 0
+        db.add(event)
         db.flush()
-        return 0
+        return ClusteringResult(cluster_count=count, mode=CLUSTER_MODE_FULL, drift=drift)
+
+    result = _cluster_incrementally(
+        db,
+        event_id=event_id,
+        eps=float(eps),
+        min_samples=int(min_samples),
+        engine=engine,
+        neighbors=neighbors,
+    )
+    result.drift = drift
+    event.cluster_incremental_faces = int(event.cluster_incremental_faces or 0) + pending
+    db.add(event)
+    db.flush()
+    return result
 
-    labels = DBSCAN(eps=float(eps), min_samples=int(min_samples), metric="cosine").fit_predict(vectors)
-    per_cluster: dict[int, list[Face]] = {}
 
-    for idx, face in enumerate(faces):
-        label = int(labels[idx])
-        if label < 0:
-            face.cluster_label = None
-        else:
-            face.cluster_label = label
-            per_cluster.setdefault(label, []).append(face)
+def _cluster_incrementally(
+    db: Session,
+    *,
+    event_id: str,
+    eps: float,
+    min_samples: int,
+    engine: str,
+    neighbors: int,
+) -> ClusteringResult:
+    result = ClusteringResult(cluster_count=0, mode=CLUSTER_MODE_INCREMENTAL)
+    clusters = {
+        int(row.cluster_label): row
+        for row in db.execute(select(FaceCluster).where(FaceCluster.event_id == event_id)).scalars().all()
+    }
+    live_counts = dict(
+        db.execute(
+            select(Face.cluster_label, func.count(Face.id))
+            .where(Face.event_id == event_id, Face.clustered.is_(True), Face.cluster_label.is_not(None))
+            .group_by(Face.cluster_label)
+        ).all()
+    )
+    # Clusters that lost faces to refreshed or pruned photos need their stats rebuilt.
+    touched = {label for label, row in clusters.items() if int(live_counts.get(label, 0)) != int(row.face_count)}
+
+    pending = db.execute(
+        select(Face).where(Face.event_id == event_id, Face.clustered.is_(False)).order_by(Face.photo_id, Face.face_index)
+    ).scalars().all()
+    labels = sorted(clusters)
+    centroids = (
+        _unit_rows(np.asarray([clusters[label].centroid for label in labels], dtype=np.float32)) if labels else None
+    )
+
+    bridges: list[tuple[int, int]] = []
+    if pending and centroids is not None:
+        sims = _unit_rows(np.asarray([face.embedding for face in pending], dtype=np.float32)) @ centroids.T
+        best = np.argmax(sims, axis=1)
+        best_distance = 1.0 - sims[np.arange(len(pending)), best]
+        for row_idx, (face, idx, distance) in enumerate(zip(pending, best.tolist(), best_distance.tolist())):
+            if distance <= eps:
+                face.cluster_label = labels[idx]
+                touched.add(labels[idx])
+                result.assigned += 1
+                # A face within reach of several clusters chains them, as it would in DBSCAN.
+                for other in np.flatnonzero(1.0 - sims[row_idx] <= eps).tolist():
+                    if other != idx:
+                        bridges.append((labels[idx], labels[other]))
+            else:
+                face.cluster_label = None
+    for face in pending:
+        face.clustered = True
         db.add(face)
+    db.flush()
 
-    for cluster_label, cluster_faces in per_cluster.items():
-        centroid = normalize(np.mean(np.asarray([f.embedding for f in cluster_faces], dtype=np.float32), axis=0))
-        by_photo = Counter([f.photo_id for f in cluster_faces])
-        cover_photo_id = by_photo.most_common(1)[0][0] if by_photo else None
-        cluster = FaceCluster(
-            event_id=event_id,
-            cluster_label=int(cluster_label),
-            centroid=centroid.astype(np.float32).tolist(),
-            face_count=len(cluster_faces),
-            cover_photo_id=cover_photo_id,
+    # Unmatched new faces are clustered together with the existing noise only.
+    next_label = (max(labels) + 1) if labels else 0
+    local = db.execute(
+        select(Face)
+        .where(Face.event_id == event_id, Face.cluster_label.is_(None))
+        .order_by(Face.photo_id, Face.face_index)
+    ).scalars().all()
+    if len(local) >= min_samples:
+        local_vectors = np.asarray([face.embedding for face in local], dtype=np.float32)
+        local_labels = cluster_labels(
+            local_vectors, eps=eps, min_samples=min_samples, engine=engine, neighbors=neighbors
         )
-        db.add(cluster)
+        for local_label in sorted(set(local_labels.tolist()) - {-1}):
+            members = [face for face, value in zip(local, local_labels.tolist()) if value == local_label]
+            centroid = normalize(np.mean(np.asarray([f.embedding for f in members], dtype=np.float32), axis=0))
+            label = next_label
+            if centroids is not None:
+                sims = centroids @ centroid
+                idx = int(np.argmax(sims))
+                if 1.0 - float(sims[idx]) <= eps:
+                    label = labels[idx]
+            if label == next_label:
+                next_label += 1
+                result.created += 1
+            for face in members:
+                face.cluster_label = label
+                db.add(face)
+            touched.add(label)
+    db.flush()
 
+    members_by_label = _members_by_label(db, event_id, touched)
+    for label in sorted(members_by_label):
+        members = members_by_label[label]
+        if len(members) < 2 * min_samples or len(members) > CLUSTER_SPLIT_MAX_FACES:
+            continue
+        sub_labels = cluster_labels(
+            np.asarray([face.embedding for face in members], dtype=np.float32),
+            eps=eps,
+            min_samples=min_samples,
+            engine=engine,
+            neighbors=neighbors,
+        )
+        groups = Counter(value for value in sub_labels.tolist() if value >= 0)
+        if len(groups) < 2:
+            continue
+        keep = groups.most_common(1)[0][0]
+        relabel = {value: next_label + offset for offset, value in enumerate(sorted(set(groups) - {keep}))}
+        next_label += len(relabel)
+        result.split += len(relabel)
+        for face, value in zip(members, sub_labels.tolist()):
+            if value == keep:
+                continue
+            face.cluster_label = relabel.get(value)
+            db.add(face)
+            if face.cluster_label is not None:
+                touched.add(face.cluster_label)
     db.flush()
-    return len(per_cluster)
 
+    result.merged = _merge_close_clusters(
+        db, event_id=event_id, touched=touched, bridges=bridges, eps=eps * CLUSTER_MERGE_FACTOR
+    )
+
+    db.execute(delete(FaceCluster).where(FaceCluster.event_id == event_id, FaceCluster.cluster_label.in_(touched)))
+    db.flush()
+    if touched:
+        rows = db.execute(
+            select(Face.photo_id, Face.embedding, Face.cluster_label)
+            .where(Face.event_id == event_id, Face.cluster_label.in_(touched))
+            .order_by(Face.photo_id, Face.face_index)
+        ).all()
+        if rows:
+            insert_clusters(
+                db,
+                event_id,
+                summarize_clusters(
+                    np.asarray([row.cluster_label for row in rows]),
+                    np.asarray([row.embedding for row in rows], dtype=np.float32),
+                    [row.photo_id for row in rows],
+                ),
+            )
+    _expire_faces(db)
+    db.flush()
+    result.cluster_count = int(
+        db.execute(select(func.count(FaceCluster.id)).where(FaceCluster.event_id == event_id)).scalar_one() or 0
+    )
+    return result
+
+
+def _members_by_label(db: Session, event_id: str, labels: set[int]) -> dict[int, list[Face]]:
+    if not labels:
+        return {}
+    members: dict[int, list[Face]] = {}
+    rows = db.execute(
+        select(Face)
+        .where(Face.event_id == event_id, Face.cluster_label.in_(labels))
+        .order_by(Face.photo_id, Face.face_index)
+    ).scalars()
+    for face in rows:
+        members.setdefault(int(face.cluster_label), []).append(face)
+    return members
+
+
+def _merge_close_clusters(
+    db: Session,
+    *,
+    event_id: str,
+    touched: set[int],
+    bridges: list[tuple[int, int]],
+    eps: float,
+) -> int:
+    members = _members_by_label(db, event_id, touched)
+    others = {
+        int(row.cluster_label): row
+        for row in db.execute(
+            select(FaceCluster).where(FaceCluster.event_id == event_id, FaceCluster.cluster_label.not_in(touched))
+        ).scalars()
+    }
+    sizes = {label: len(faces) for label, faces in members.items()}
+    sizes.update({label: int(row.face_count) for label, row in others.items()})
+    vectors = {
+        label: normalize(np.mean(np.asarray([f.embedding for f in faces], dtype=np.float32), axis=0))
+        for label, faces in members.items()
+    }
+    vectors.update({label: normalize(np.asarray(row.centroid, dtype=np.float32)) for label, row in others.items()})
+    if len(vectors) < 2:
+        return 0
+
+    labels = sorted(vectors)
+    matrix = np.stack([vectors[label] for label in labels])
+    parent = {label: label for label in labels}
+
+    def root(label: int) -> int:
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    pairs = [pair for pair in bridges if pair[0] in parent and pair[1] in parent]
+    for row_idx, label in enumerate(labels):
+        if label not in members:
+            continue
+        sims = matrix @ matrix[row_idx]
+        pairs.extend((label, labels[col_idx]) for col_idx in np.flatnonzero(1.0 - sims <= eps).tolist())
+
+    merged = 0
+    for label, other in pairs:
+        left, right = root(label), root(other)
+        if left == right:
+            continue
+        # The larger cluster keeps its label so stored guest results stay meaningful.
+        keep, drop = (left, right) if sizes[left] >= sizes[right] else (right, left)
+        parent[drop] = keep
+        sizes[keep] += sizes[drop]
+        merged += 1
+
+    if not merged:
+        return 0
+    for label in labels:
+        target = root(label)
+        if target == label:
+            continue
+        touched.update({label, target})
+        faces = members.get(label)
+        if faces is None:
+            faces = db.execute(
+                select(Face).where(Face.event_id == event_id, Face.cluster_label == label)
+            ).scalars().all()
+        for face in faces:
+            face.cluster_label = target
+            db.add(face)
+    db.flush()
+    return merged
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import Event
+from app.services.matching import EMBEDDING_PRECISION_FLOAT32, EventEmbeddingIndex, load_event_embedding_index
+
+
+class EmbeddingIndexCache:
+    def __init__(self, max_bytes: int, precision: str = EMBEDDING_PRECISION_FLOAT32) -> None:
+        self.max_bytes = max(0, int(max_bytes))
+        self.precision = precision
+        self._entries: OrderedDict[str, tuple[int, EventEmbeddingIndex]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def current_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, event_id: str, version: int) -> EventEmbeddingIndex | None:
+        with self._lock:
+            entry = self._entries.get(event_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            cached_version, index = entry
+            if cached_version != int(version):
+                self._drop(event_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(event_id)
+            self.hits += 1
+            return index
+
+    def put(self, event_id: str, version: int, index: EventEmbeddingIndex) -> None:
+        with self._lock:
+            self._drop(event_id)
+            if index.nbytes > self.max_bytes:
+                return
+            self._entries[event_id] = (int(version), index)
+            self._bytes += index.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+
+    def get_or_load(self, db: Session, *, event_id: str, version: int) -> EventEmbeddingIndex:
+        index = self.get(event_id, version)
+        if index is not None:
+            return index
+        index = load_event_embedding_index(db, event_id, precision=self.precision)
+        self.put(event_id, version, index)
+        return index
+
+    def invalidate(self, event_id: str) -> None:
+        with self._lock:
+            self._drop(event_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _drop(self, event_id: str) -> None:
+        entry = self._entries.pop(event_id, None)
+        if entry is not None:
+            self._bytes -= entry[1].nbytes
+
+
+@lru_cache(maxsize=1)
+def get_embedding_index_cache() -> EmbeddingIndexCache:
+    settings = get_settings()
+    return EmbeddingIndexCache(
+        max_bytes=int(settings.match_index_cache_mb) * 1024 * 1024,
+        precision=settings.embedding_precision,
+    )
+
+
+def bump_embedding_version(db: Session, event_id: str) -> None:
+    # Stored on the event row so every worker process sees the same stamp.
+    db.execute(
+        update(Event)
+        .where(Event.id == event_id)
+        .values(embedding_version=Event.embedding_version + 1, updated_at=Event.updated_at)
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+try:
+    import psycopg
+except Exception:  # pragma: no cover
+    psycopg = None
+
+logger = logging.getLogger(__name__)
+
+JOB_CHANNEL = "grabpic_jobs"
+# The worker poll interval used before enqueues could wake it.
+LOCAL_POLL_SECONDS = 1.0
+
+
+class LocalJobSignal:
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._seen = 0
+
+    def notify(self) -> None:
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        # Signals raised while the worker was busy are remembered, so a wait that
+        # starts after an enqueue returns at once instead of missing it.
+        with self._condition:
+            woke = self._condition.wait_for(lambda: self._generation != self._seen, timeout=max(0.0, timeout))
+            self._seen = self._generation
+            return woke
+
+    def close(self) -> None:
+        pass
+
+
+class PollingJobWaiter:
+    def __init__(self, signal: LocalJobSignal, interval: float) -> None:
+        self.signal = signal
+        self.interval = interval
+
+    def wait(self, timeout: float) -> bool:
+        # Same-process enqueues still wake at once; the cap covers the API running elsewhere.
+        return self.signal.wait(min(max(0.0, timeout), self.interval))
+
+    def close(self) -> None:
+        pass
+
+
+class PostgresJobListener:
+    def __init__(self, conninfo: str) -> None:
+        self.conninfo = conninfo
+        self._conn = None
+
+    def wait(self, timeout: float) -> bool:
+        try:
+            conn = self._connect()
+            # Notifications queue on the connection between waits; drain them all.
+            woke = bool(list(conn.notifies(timeout=max(0.0, timeout), stop_after=1)))
+            if woke:
+                list(conn.notifies(timeout=0))
+            return woke
+        except Exception as exc:
+            logger.warning("Job listener connection lost, polling instead: %s", exc)
+            self.close()
+            time.sleep(max(0.0, timeout))
+            return False
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg.connect(self.conninfo, autocommit=True)
+            self._conn.execute(f"LISTEN {JOB_CHANNEL}")
+        return self._conn
+
+
+@lru_cache(maxsize=1)
+def local_job_signal() -> LocalJobSignal:
+    return LocalJobSignal()
+
+
+def signal_job_enqueued(db: Session, job_type: str) -> None:
+    if db.get_bind().dialect.name == "postgresql":
+        # NOTIFY is transactional: listeners only wake once the job row is committed.
+        db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": JOB_CHANNEL, "payload": job_type})
+        return
+    event.listen(db, "after_commit", lambda _session: local_job_signal().notify(), once=True)
+
+
+def job_waiter(engine: Engine) -> PollingJobWaiter | PostgresJobListener:
+    url = engine.url
+    if url.get_backend_name() == "postgresql" and url.get_driver_name() == "psycopg" and psycopg is not None:
+        return PostgresJobListener(url.set(drivername="postgresql").render_as_string(hide_password=False))
+    logger.warning(
+        "No LISTEN/NOTIFY for %s; jobs enqueued by other processes are picked up within %.0fs",
+        url.drivername,
+        LOCAL_POLL_SECONDS,
+    )
+    return PollingJobWaiter(local_job_signal(), LOCAL_POLL_SECONDS)
@@ -1,22 +1,49 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
+import logging
+import threading
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import select
+from sqlalchemy import or_, select, update
 from sqlalchemy.orm import Session
 
-from app.models import Job
+from app.models import Event, GuestQuery, Job
+from app.services.job_signals import signal_job_enqueued
+
+logger = logging.getLogger(__name__)
 
 JOB_SYNC_EVENT = "sync_event"
 JOB_CLUSTER_EVENT = "cluster_event"
 JOB_MATCH_GUEST = "match_guest"
+JOB_SYNC_SHARD = "sync_shard"
+JOB_SYNC_FINALIZE = "sync_finalize"
 
 JOB_STATUS_QUEUED = "queued"
 JOB_STATUS_RUNNING = "running"
+JOB_STATUS_WAITING = "waiting"
 JOB_STATUS_CANCEL_REQUESTED = "cancel_requested"
 JOB_STATUS_CANCELED = "canceled"
 JOB_STATUS_COMPLETED = "completed"
 JOB_STATUS_FAILED = "failed"
+JOB_LEASED_STATUSES = (JOB_STATUS_RUNNING, JOB_STATUS_CANCEL_REQUESTED)
+
+# Lower runs first: a guest waiting on a selfie should never queue behind a sync.
+JOB_PRIORITIES = {
+    JOB_MATCH_GUEST: 0,
+    JOB_CLUSTER_EVENT: 5,
+    JOB_SYNC_FINALIZE: 5,
+    JOB_SYNC_EVENT: 10,
+    JOB_SYNC_SHARD: 10,
+}
+JOB_PRIORITY_DEFAULT = 10
+
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+LANE_JOB_TYPES = {
+    LANE_INTERACTIVE: (JOB_MATCH_GUEST,),
+    LANE_BATCH: (JOB_SYNC_EVENT, JOB_SYNC_SHARD, JOB_SYNC_FINALIZE, JOB_CLUSTER_EVENT),
+}
 
 
 def utc_now() -> datetime:
@@ -31,23 +58,41 @@ def create_job(
     query_id: str | None = None,
     payload: dict | None = None,
     stage: str = "queued",
+    priority: int | None = None,
+    status: str = JOB_STATUS_QUEUED,
 ) -> Job:
     job = Job(
         job_type=job_type,
         event_id=event_id,
         query_id=query_id,
         payload=payload or {},
-        status=JOB_STATUS_QUEUED,
+        status=status,
         stage=stage,
         progress_percent=0.0,
+        priority=JOB_PRIORITIES.get(job_type, JOB_PRIORITY_DEFAULT) if priority is None else int(priority),
     )
     db.add(job)
     db.flush()
+    if status == JOB_STATUS_QUEUED:
+        signal_job_enqueued(db, job_type)
     return job
 
 
-def acquire_next_job(db: Session) -> Job | None:
-    stmt = select(Job).where(Job.status == JOB_STATUS_QUEUED).order_by(Job.created_at.asc()).limit(1)
+def lane_job_types(lanes: str) -> tuple[str, ...] | None:
+    names = [item.strip().lower() for item in str(lanes or "").split(",") if item.strip()]
+    if not names or "all" in names:
+        return None
+    unknown = [name for name in names if name not in LANE_JOB_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown worker lane(s): {', '.join(unknown)}")
+    return tuple(job_type for name in names for job_type in LANE_JOB_TYPES[name])
+
+
+def acquire_next_job(db: Session, job_types: tuple[str, ...] | None = None) -> Job | None:
+    stmt = select(Job).where(Job.status == JOB_STATUS_QUEUED, or_(Job.run_after.is_(None), Job.run_after <= utc_now()))
+    if job_types is not None:
+        stmt = stmt.where(Job.job_type.in_(job_types))
+    stmt = stmt.order_by(Job.priority.asc(), Job.created_at.asc()).limit(1)
     try:
         stmt = stmt.with_for_update(skip_locked=True)
     except Exception:
@@ -60,9 +105,168 @@ def acquire_next_job(db: Session) -> Job | None:
     job.locked_at = utc_now()
     job.attempts = int(job.attempts or 0) + 1
     job.stage = "running"
+    job.run_after = None
     return job
 
 
+def renew_job_lease(db: Session, job_id: str) -> bool:
+    result = db.execute(
+        update(Job).where(Job.id == job_id, Job.status.in_(JOB_LEASED_STATUSES)).values(locked_at=utc_now())
+    )
+    return bool(result.rowcount)
+
+
+class JobHeartbeat:
+    def __init__(self, session_factory: Callable[[], Session], job_id: str, interval_seconds: float) -> None:
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self.interval_seconds = max(1.0, float(interval_seconds))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-heartbeat-{job_id}", daemon=True)
+
+    def __enter__(self) -> "JobHeartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self._stop.set()
+        self._thread.join(timeout=self.interval_seconds)
+
+    def _run(self) -> None:
+        # Uses its own session so lease renewals commit independently of the
+        # job's long-running transaction.
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                with self.session_factory() as db:
+                    renewed = renew_job_lease(db, self.job_id)
+                    db.commit()
+                if not renewed:
+                    return
+            except Exception as exc:
+                logger.warning("Heartbeat for job %s failed: %s", self.job_id, exc)
+
+
+def requeue_expired_jobs(
+    db: Session,
+    *,
+    lease_seconds: float,
+    max_attempts: int,
+    backoff_seconds: float,
+) -> list[Job]:
+    now = utc_now()
+    stmt = select(Job).where(
+        Job.status.in_(JOB_LEASED_STATUSES),
+        Job.locked_at.is_not(None),
+        Job.locked_at < now - timedelta(seconds=max(1.0, float(lease_seconds))),
+    )
+    try:
+        stmt = stmt.with_for_update(skip_locked=True)
+    except Exception:
+        pass
+    reclaimed = db.execute(stmt).scalars().all()
+    for job in reclaimed:
+        attempts = int(job.attempts or 0)
+        if job.status == JOB_STATUS_CANCEL_REQUESTED:
+            mark_job_canceled(db, job, reason="Canceled by admin")
+            _settle_job_owner(db, job, event_status="canceled", query_error="Canceled by admin")
+        elif attempts >= max(1, int(max_attempts)):
+            mark_job_failed(db, job, f"Worker lease expired after {attempts} attempt(s)")
+            if job.job_type == JOB_SYNC_SHARD:
+                roll_up_sync_shard(db, job, {"failed_shards": 1})
+            else:
+                _settle_job_owner(db, job, event_status="failed", query_error=job.error_text)
+        else:
+            # Exponential backoff keeps a job that keeps killing its worker from
+            # monopolising the queue; syncs resume from their content stamps.
+            delay = max(0.0, float(backoff_seconds)) * (2 ** max(0, attempts - 1))
+            job.status = JOB_STATUS_QUEUED
+            job.stage = "requeued_after_lease_expiry"
+            job.locked_at = None
+            job.run_after = now + timedelta(seconds=delay)
+            job.updated_at = now
+            upsert_job_payload(job, {"reclaimed_attempts": attempts})
+            db.add(job)
+        logger.warning("Reclaimed job %s (%s) after lease expiry: %s", job.id, job.job_type, job.status)
+    return reclaimed
+
+
+def roll_up_sync_shard(db: Session, shard: Job, counts: dict[str, int]) -> Job | None:
+    parent_id = str((shard.payload or {}).get("parent_job_id") or "")
+    db.flush()
+    # Row lock on the parent serialises shards finishing on different workers.
+    stmt = select(Job).where(Job.id == parent_id).execution_options(populate_existing=True)
+    try:
+        stmt = stmt.with_for_update()
+    except Exception:
+        pass
+    parent = db.execute(stmt).scalar_one_or_none()
+    if parent is None:
+        return None
+    payload = dict(parent.payload or {})
+    for key, value in counts.items():
+        payload[key] = int(payload.get(key) or 0) + int(value)
+    payload["shards_completed"] = int(payload.get("shards_completed") or 0) + 1
+    parent.payload = payload
+    parent.updated_at = utc_now()
+    db.add(parent)
+    if parent.status == JOB_STATUS_WAITING:
+        total = max(1, int(payload.get("total_listed") or 0))
+        completed = int(payload.get("completed") or 0)
+        parent.progress_percent = max(2.0, min(95.0, completed / total * 100.0))
+        parent.stage = f"processing image {completed}/{total}"
+
+    finalize = db.get(Job, str(payload.get("finalize_job_id") or ""))
+    if finalize is None or finalize.status != JOB_STATUS_WAITING:
+        return finalize
+    if payload["shards_completed"] >= int(payload.get("shards_total") or 0):
+        if parent.status == JOB_STATUS_WAITING:
+            finalize.status = JOB_STATUS_QUEUED
+            finalize.stage = "queued"
+            db.add(finalize)
+            signal_job_enqueued(db, finalize.job_type)
+        else:
+            mark_job_canceled(db, finalize, reason=f"Parent sync job is {parent.status}")
+    return finalize
+
+
+def settle_sync_parent(db: Session, finalize: Job, *, event_status: str, reason: str) -> None:
+    # The parent waits on its finalize; if that never completes, settle the parent
+    # so the event stops counting as busy and cleanup can drop its listing.
+    parent = db.get(Job, str((finalize.payload or {}).get("parent_job_id") or ""))
+    if parent is None or parent.status != JOB_STATUS_WAITING:
+        return
+    if event_status == "canceled":
+        mark_job_canceled(db, parent, reason=reason)
+    else:
+        mark_job_failed(db, parent, f"Sync finalize failed: {reason}")
+    event = db.get(Event, parent.event_id) if parent.event_id else None
+    if event:
+        event.status = event_status
+        db.add(event)
+
+
+def _settle_job_owner(db: Session, job: Job, *, event_status: str, query_error: str) -> None:
+    if job.job_type == JOB_SYNC_FINALIZE:
+        settle_sync_parent(db, job, event_status=event_status, reason=query_error)
+        return
+    if job.job_type in (JOB_SYNC_EVENT, JOB_CLUSTER_EVENT) and job.event_id:
+        event = db.get(Event, job.event_id)
+        if event:
+            event.status = event_status
+            db.add(event)
+    if job.query_id:
+        query = db.get(GuestQuery, job.query_id)
+        if query:
+            query.status = "failed"
+            query.error_text = query_error
+            if event_status == "canceled":
+                query.message = "Matching was canceled by admin."
+            else:
+                query.message = "Failed to process selfie"
+            query.completed_at = utc_now()
+            db.add(query)
+
+
 def mark_job_progress(db: Session, job: Job, *, progress_percent: float, stage: str) -> None:
     job.progress_percent = float(max(0.0, min(100.0, progress_percent)))
     job.stage = stage
@@ -1,17 +1,44 @@
 from __future__ import annotations
 
+import logging
+import re
+import threading
 from collections import defaultdict
-from dataclasses import dataclass
+from collections.abc import Callable
+from dataclasses import dataclass, field
 
 import numpy as np
-from sqlalchemy import delete, select
+from sqlalchemy import Float, bindparam, cast, delete, or_, select, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
 
 from app.models import Face, FaceCluster, GuestQuery, GuestResult, Photo
 
+try:
+    from pgvector.sqlalchemy import HALFVEC
+except Exception:  # pragma: no cover
+    HALFVEC = None
+
+logger = logging.getLogger(__name__)
+
 COSINE_MAP_FLOOR = 0.15
 COSINE_MAP_SPAN = 0.37
 
+MATCH_ENGINE_NUMPY = "numpy"
+MATCH_ENGINE_PGVECTOR = "pgvector"
+MATCH_ENGINE_CLUSTER = "cluster"
+
+EMBEDDING_PRECISION_FLOAT32 = "float32"
+EMBEDDING_PRECISION_FLOAT16 = "float16"
+EMBEDDING_PRECISION_INT8 = "int8"
+QUANTIZED_SCORE_CHUNK = 16384
+# Score slack (percent points) before an audit counts a pruned miss; covers
+# float16/int8 cached indexes that are compared without exact re-ranking.
+PRUNE_AUDIT_TOLERANCE = 0.25
+
+ITERATIVE_SCAN_MIN_VERSION = (0, 8, 0)
+_iterative_scan_supported: bool | None = None
+
 
 def cosine_similarity(vec_a: list[float], vec_b: list[float]) -> float:
     a = np.asarray(vec_a, dtype=np.float32)
@@ -58,6 +85,326 @@ class RankedPhotoMatch:
     rank: int
 
 
+@dataclass
+class EventEmbeddingIndex:
+    photo_ids: list[str]
+    photo_offsets: np.ndarray
+    matrix: np.ndarray
+    face_ids: list[str] = field(default_factory=list)
+    scales: np.ndarray | None = None
+    precision: str = EMBEDDING_PRECISION_FLOAT32
+
+    @property
+    def size(self) -> int:
+        return int(self.matrix.shape[0])
+
+    @property
+    def dimension(self) -> int:
+        return int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0
+
+    @property
+    def nbytes(self) -> int:
+        scale_bytes = int(self.scales.nbytes) if self.scales is not None else 0
+        return int(self.matrix.nbytes + self.photo_offsets.nbytes + scale_bytes)
+
+
+ExactEmbeddingLookup = Callable[[list[str]], dict[str, list[float]]]
+
+
+def build_embedding_index(
+    rows: list[tuple[str, list[float]]],
+    *,
+    face_ids: list[str] | None = None,
+    precision: str = EMBEDDING_PRECISION_FLOAT32,
+) -> EventEmbeddingIndex:
+    if not rows:
+        return EventEmbeddingIndex(
+            photo_ids=[],
+            photo_offsets=np.zeros(0, dtype=np.int64),
+            matrix=np.zeros((0, 0), dtype=np.float32),
+            precision=precision,
+        )
+
+    # Group rows by photo so the per-photo max is a single reduceat over
+    # contiguous segments instead of a dict walk.
+    order = sorted(range(len(rows)), key=lambda idx: str(rows[idx][0]))
+    photo_ids: list[str] = []
+    offsets: list[int] = []
+    for position, row_idx in enumerate(order):
+        key = str(rows[row_idx][0])
+        if not photo_ids or photo_ids[-1] != key:
+            photo_ids.append(key)
+            offsets.append(position)
+
+    matrix = np.ascontiguousarray(np.asarray([rows[idx][1] for idx in order], dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    quantized, scales = quantize_matrix(matrix, precision)
+    return EventEmbeddingIndex(
+        photo_ids=photo_ids,
+        photo_offsets=np.asarray(offsets, dtype=np.int64),
+        matrix=quantized,
+        face_ids=[str(face_ids[idx]) for idx in order] if face_ids is not None else [],
+        scales=scales,
+        precision=precision,
+    )
+
+
+def quantize_matrix(matrix: np.ndarray, precision: str) -> tuple[np.ndarray, np.ndarray | None]:
+    if precision == EMBEDDING_PRECISION_FLOAT16:
+        return matrix.astype(np.float16), None
+    if precision == EMBEDDING_PRECISION_INT8:
+        peaks = np.abs(matrix).max(axis=1) if matrix.size else np.zeros(matrix.shape[0], dtype=np.float32)
+        scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+        quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales
+    return matrix, None
+
+
+def load_event_embedding_index(
+    db: Session,
+    event_id: str,
+    *,
+    precision: str = EMBEDDING_PRECISION_FLOAT32,
+) -> EventEmbeddingIndex:
+    rows = db.execute(select(Face.id, Face.photo_id, Face.embedding).where(Face.event_id == event_id)).all()
+    return build_embedding_index(
+        [(str(photo_id), embedding) for _face_id, photo_id, embedding in rows],
+        face_ids=[str(face_id) for face_id, _photo_id, _embedding in rows],
+        precision=precision,
+    )
+
+
+def load_exact_embeddings(db: Session, face_ids: list[str]) -> dict[str, list[float]]:
+    if not face_ids:
+        return {}
+    rows = db.execute(select(Face.id, Face.embedding).where(Face.id.in_(face_ids))).all()
+    return {str(face_id): embedding for face_id, embedding in rows}
+
+
+def score_photos(
+    index: EventEmbeddingIndex,
+    selfie_embedding: list[float],
+    *,
+    exact_lookup: ExactEmbeddingLookup | None = None,
+    rerank_candidates: int = 300,
+) -> list[tuple[str, float]]:
+    if index.size == 0:
+        return []
+    query = _query_vector(selfie_embedding, index.dimension)
+    if query is None:
+        return [(photo_id, 0.0) for photo_id in index.photo_ids]
+
+    cosines = _approximate_cosines(index, query)
+    if index.precision != EMBEDDING_PRECISION_FLOAT32 and exact_lookup is not None and index.face_ids:
+        _rerank_exact(index, query, cosines, exact_lookup, rerank_candidates)
+    best_cosine = np.maximum.reduceat(cosines, index.photo_offsets).astype(np.float64)
+    percents = np.clip((best_cosine - COSINE_MAP_FLOOR) / COSINE_MAP_SPAN * 100.0, 0.0, 100.0)
+    order = np.argsort(-percents, kind="stable")
+    return [(index.photo_ids[int(i)], float(percents[int(i)])) for i in order]
+
+
+def _approximate_cosines(index: EventEmbeddingIndex, query: np.ndarray) -> np.ndarray:
+    if index.precision == EMBEDDING_PRECISION_FLOAT32:
+        return index.matrix @ query
+    # Upcast in bounded chunks: float16/int8 have no BLAS kernels and a full
+    # float32 copy would undo the memory saving.
+    cosines = np.empty(index.size, dtype=np.float32)
+    for start in range(0, index.size, QUANTIZED_SCORE_CHUNK):
+        stop = min(index.size, start + QUANTIZED_SCORE_CHUNK)
+        cosines[start:stop] = index.matrix[start:stop].astype(np.float32) @ query
+    if index.scales is not None:
+        cosines *= index.scales
+    return cosines
+
+
+def _rerank_exact(
+    index: EventEmbeddingIndex,
+    query: np.ndarray,
+    cosines: np.ndarray,
+    exact_lookup: ExactEmbeddingLookup,
+    rerank_candidates: int,
+) -> None:
+    count = min(index.size, max(1, int(rerank_candidates)))
+    top = np.argpartition(-cosines, count - 1)[:count] if count < index.size else np.arange(index.size)
+    exact = exact_lookup([index.face_ids[int(i)] for i in top])
+    for row in top:
+        embedding = exact.get(index.face_ids[int(row)])
+        if embedding is None:
+            continue
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        if norm > 0 and vec.size == query.size:
+            cosines[int(row)] = float(np.dot(vec, query) / norm)
+
+
+def resolve_match_engine(db: Session, requested: str) -> str:
+    engine = str(requested or "").strip().lower()
+    if engine == MATCH_ENGINE_PGVECTOR and db.get_bind().dialect.name == "postgresql":
+        return MATCH_ENGINE_PGVECTOR
+    if engine == MATCH_ENGINE_CLUSTER:
+        return MATCH_ENGINE_CLUSTER
+    return MATCH_ENGINE_NUMPY
+
+
+@dataclass
+class ClusterPruneStats:
+    audited: int = 0
+    missed: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def miss_rate(self) -> float:
+        return self.missed / self.audited if self.audited else 0.0
+
+    def record(self, missed: bool) -> None:
+        with self._lock:
+            self.audited += 1
+            self.missed += int(missed)
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            return {"audited": self.audited, "missed": self.missed, "miss_rate": self.miss_rate}
+
+
+cluster_prune_stats = ClusterPruneStats()
+
+
+def select_candidate_clusters(
+    centroids: np.ndarray,
+    labels: list[int],
+    query: np.ndarray,
+    *,
+    top_k: int,
+    margin: float,
+) -> list[int]:
+    if not labels:
+        return []
+    norms = np.linalg.norm(centroids, axis=1)
+    scores = (centroids @ query) / np.maximum(norms, 1e-12)
+    order = np.argsort(-scores, kind="stable")
+    # Centroids sit inside their clusters, so a member can outscore its centroid;
+    # the margin keeps every cluster whose centroid is close to the best one.
+    keep = scores >= float(scores[order[0]]) - max(0.0, float(margin))
+    keep[order[: max(1, int(top_k))]] = True
+    return [labels[int(i)] for i in order if keep[int(i)]]
+
+
+def search_photos_by_cluster(
+    db: Session,
+    *,
+    event_id: str,
+    selfie_embedding: list[float],
+    top_k: int,
+    margin: float,
+) -> list[tuple[str, float]] | None:
+    clusters = db.execute(
+        select(FaceCluster.cluster_label, FaceCluster.centroid).where(FaceCluster.event_id == event_id)
+    ).all()
+    if not clusters:
+        return None
+    centroids = np.asarray([centroid for _label, centroid in clusters], dtype=np.float32)
+    query = _query_vector(selfie_embedding, centroids.shape[1])
+    if query is None:
+        return None
+    labels = select_candidate_clusters(
+        centroids, [int(label) for label, _centroid in clusters], query, top_k=top_k, margin=margin
+    )
+    # Noise and not-yet-clustered faces have no centroid to prune them by.
+    rows = db.execute(
+        select(Face.photo_id, Face.embedding).where(
+            Face.event_id == event_id,
+            or_(Face.cluster_label.in_(labels), Face.cluster_label.is_(None)),
+        )
+    ).all()
+    return score_photos(build_embedding_index([(str(photo_id), embedding) for photo_id, embedding in rows]), selfie_embedding)
+
+
+def audit_cluster_pruning(
+    index: EventEmbeddingIndex,
+    selfie_embedding: list[float],
+    candidates: list[tuple[str, float]],
+    stats: ClusterPruneStats = cluster_prune_stats,
+) -> bool:
+    exhaustive = score_photos(index, selfie_embedding)
+    if not exhaustive:
+        return False
+    best_pruned = candidates[0][1] if candidates else 0.0
+    missed = exhaustive[0][1] > best_pruned + PRUNE_AUDIT_TOLERANCE
+    stats.record(missed)
+    return missed
+
+
+def search_photos_pgvector(
+    db: Session,
+    *,
+    event_id: str,
+    selfie_embedding: list[float],
+    top_k: int,
+    ef_search: int = 0,
+    precision: str = EMBEDDING_PRECISION_FLOAT32,
+) -> list[tuple[str, float]] | None:
+    # Without iterative scans the event filter is applied after the HNSW walk,
+    # so small events lose most of their matches; None sends the caller to the
+    # exact per-event scan instead.
+    if not _enable_iterative_scan(db):
+        return None
+    if ef_search > 0:
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+
+    query_vector = bindparam("query_vector", value=selfie_embedding, type_=Face.embedding.type)
+    distance = Face.embedding.op("<=>", return_type=Float)(query_vector)
+    order_distance = distance
+    if precision != EMBEDDING_PRECISION_FLOAT32 and HALFVEC is not None:
+        # Walk the half-precision HNSW index, then score the returned rows
+        # against the float32 column in the same statement.
+        dim = int(Face.embedding.type.dimension)
+        order_distance = cast(Face.embedding, HALFVEC(dim)).op("<=>", return_type=Float)(cast(query_vector, HALFVEC(dim)))
+    rows = db.execute(
+        select(Face.photo_id, distance.label("distance"))
+        .where(Face.event_id == event_id)
+        .order_by(order_distance)
+        .limit(max(1, int(top_k)))
+    ).all()
+
+    best_percent_by_photo: dict[str, float] = {}
+    for photo_id, cosine_distance in rows:
+        percent = cosine_to_percent(1.0 - float(cosine_distance))
+        key = str(photo_id)
+        if percent > best_percent_by_photo.get(key, -1.0):
+            best_percent_by_photo[key] = percent
+    return sorted(best_percent_by_photo.items(), key=lambda item: item[1], reverse=True)
+
+
+def _enable_iterative_scan(db: Session) -> bool:
+    # Decided from the installed extension version: without the pgvector library
+    # loaded, Postgres accepts SET hnsw.iterative_scan as a placeholder GUC, so
+    # a successful SET proves nothing on pgvector < 0.8.
+    global _iterative_scan_supported
+    if _iterative_scan_supported is None:
+        version = _pgvector_version(db)
+        _iterative_scan_supported = version is not None and version >= ITERATIVE_SCAN_MIN_VERSION
+        if not _iterative_scan_supported:
+            logger.warning(
+                "pgvector %s lacks hnsw.iterative_scan (needs 0.8.0+); pgvector matching uses the exact scan",
+                ".".join(map(str, version)) if version else "version unknown",
+            )
+    if not _iterative_scan_supported:
+        return False
+    db.execute(text("SET LOCAL hnsw.iterative_scan = relaxed_order"))
+    return True
+
+
+def _pgvector_version(db: Session) -> tuple[int, ...] | None:
+    try:
+        with db.begin_nested():
+            raw = db.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar_one_or_none()
+    except DBAPIError:
+        return None
+    parts = [int(part) for part in re.findall(r"\d+", str(raw or ""))[:3]]
+    return tuple(parts + [0] * (3 - len(parts))) if parts else None
+
+
 def collect_ranked_photo_matches(
     db: Session,
     *,
@@ -68,19 +415,70 @@ def collect_ranked_photo_matches(
     relax_drop: float,
     relax_min_threshold: float,
     max_results: int = 120,
+    index: EventEmbeddingIndex | None = None,
+    engine: str = MATCH_ENGINE_NUMPY,
+    ann_top_k: int = 2000,
+    ann_ef_search: int = 0,
+    precision: str = EMBEDDING_PRECISION_FLOAT32,
+    rerank_candidates: int = 300,
+    cluster_top_k: int = 8,
+    cluster_margin: float = 0.08,
 ) -> tuple[list[RankedPhotoMatch], float, bool]:
-    rows = db.execute(select(Face.photo_id, Face.embedding).where(Face.event_id == event_id)).all()
-    if not rows:
+    resolved = resolve_match_engine(db, engine)
+    candidates = None
+    if resolved == MATCH_ENGINE_CLUSTER:
+        candidates = search_photos_by_cluster(
+            db,
+            event_id=event_id,
+            selfie_embedding=selfie_embedding,
+            top_k=cluster_top_k,
+            margin=cluster_margin,
+        )
+        if candidates is not None and index is not None:
+            # A full index is only passed in for sampled audits of the pruning step.
+            audit_cluster_pruning(index, selfie_embedding, candidates)
+    if resolved == MATCH_ENGINE_PGVECTOR:
+        candidates = search_photos_pgvector(
+            db,
+            event_id=event_id,
+            selfie_embedding=selfie_embedding,
+            top_k=ann_top_k,
+            ef_search=ann_ef_search,
+            precision=precision,
+        )
+    if candidates is None:
+        # Events that were never clustered, or a pgvector without iterative
+        # scans, fall back to the exhaustive scan.
+        if index is None:
+            index = load_event_embedding_index(db, event_id, precision=precision)
+        candidates = score_photos(
+            index,
+            selfie_embedding,
+            exact_lookup=lambda face_ids: load_exact_embeddings(db, face_ids),
+            rerank_candidates=rerank_candidates,
+        )
+    if not candidates:
         return [], float(threshold_percent), False
 
-    best_percent_by_photo: dict[str, float] = defaultdict(float)
-    for photo_id, embedding in rows:
-        cosine = cosine_similarity(selfie_embedding, embedding)
-        percent = cosine_to_percent(cosine)
-        if percent > best_percent_by_photo[photo_id]:
-            best_percent_by_photo[photo_id] = percent
+    return rank_photo_candidates(
+        candidates,
+        threshold_percent=threshold_percent,
+        top_margin=top_margin,
+        relax_drop=relax_drop,
+        relax_min_threshold=relax_min_threshold,
+        max_results=max_results,
+    )
+
 
-    candidates = sorted(best_percent_by_photo.items(), key=lambda item: item[1], reverse=True)
+def rank_photo_candidates(
+    candidates: list[tuple[str, float]],
+    *,
+    threshold_percent: float,
+    top_margin: float,
+    relax_drop: float,
+    relax_min_threshold: float,
+    max_results: int = 120,
+) -> tuple[list[RankedPhotoMatch], float, bool]:
     strict = _select_with_threshold(candidates, threshold=float(threshold_percent), top_margin=float(top_margin))
     adaptive_used = False
     used_threshold = float(threshold_percent)
@@ -171,6 +569,17 @@ def store_guest_results(
     return results
 
 
+def _query_vector(selfie_embedding: list[float], dimension: int) -> np.ndarray | None:
+    query = np.asarray(selfie_embedding, dtype=np.float32).reshape(-1)
+    if query.size != dimension:
+        # Tolerate vectors written before an embedding dimension change.
+        query = np.pad(query, (0, max(0, dimension - query.size)))[:dimension]
+    norm = float(np.linalg.norm(query))
+    if norm <= 0:
+        return None
+    return query / norm
+
+
 def _select_with_threshold(
     ordered_candidates: list[tuple[str, float]],
     *,
@@ -2,6 +2,8 @@ from __future__ import annotations
 
 from pathlib import Path
 
+import cv2
+import numpy as np
 from PIL import Image
 
 from app.config import Settings
@@ -25,6 +27,29 @@ def save_thumbnail(
     return str(output_file.relative_to(settings.storage_root_path)).replace("\\", "/")
 
 
+def save_thumbnail_pixels(
+    settings: Settings,
+    event_id: str,
+    drive_file_id: str,
+    pixels: np.ndarray,
+    max_size: int,
+) -> str:
+    output_dir = settings.thumbnail_dir / event_id
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_file = output_dir / f"{_safe_name(drive_file_id)}.jpg"
+
+    height, width = pixels.shape[:2]
+    scale = min(1.0, float(max_size) / float(max(height, width)))
+    if scale < 1.0:
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        pixels = cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)
+    # Pillow unpacks BGR rows straight from the NumPy buffer, skipping an RGB conversion copy.
+    pixels = np.ascontiguousarray(pixels)
+    image = Image.frombuffer("RGB", (pixels.shape[1], pixels.shape[0]), pixels, "raw", "BGR", 0, 1)
+    image.save(output_file, format="JPEG", quality=84, optimize=True)
+    return str(output_file.relative_to(settings.storage_root_path)).replace("\\", "/")
+
+
 def save_selfie(settings: Settings, query_id: str, file_name: str, payload: bytes) -> str:
     ext = Path(file_name or "selfie.jpg").suffix.lower()
     if ext not in {".jpg", ".jpeg", ".png", ".webp"}:
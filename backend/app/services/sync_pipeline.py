@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+_DONE = object()
+_POLL_SECONDS = 0.2
+
+
+# Decides when the sync loop commits: after ``every`` items or ``interval``
+# seconds, whichever comes first, so progress stays smooth without a
+# transaction per photo.
+class ProgressThrottle:
+    def __init__(self, *, every: int, interval_seconds: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.every = max(1, int(every))
+        self.interval_seconds = max(0.0, float(interval_seconds))
+        self.clock = clock
+        self.pending = 0
+        self._last = clock()
+
+    def tick(self) -> bool:
+        self.pending += 1
+        return self.pending >= self.every or self.clock() - self._last >= self.interval_seconds
+
+    def reset(self) -> None:
+        self.pending = 0
+        self._last = self.clock()
+
+
+@dataclass
+class PipelineResult:
+    item: Any
+    value: Any = None
+    error: Exception | None = None
+
+
+# Drains ``items`` on its own thread into an unbounded buffer, so a slow
+# consumer never pauses the producer: the Drive listing keeps paging while the
+# first files are downloaded and analysed. ``close`` stops it after the item
+# in flight.
+class Prefetch:
+    def __init__(self, items: Iterable[Any], *, name: str = "sync-prefetch") -> None:
+        self._buffer: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._drain, args=(items,), name=name, daemon=True)
+        self._thread.start()
+
+    def __iter__(self) -> "Prefetch":
+        return self
+
+    def __next__(self) -> Any:
+        if self._done:
+            raise StopIteration
+        result = self._buffer.get()
+        if result is _DONE:
+            self._done = True
+            raise StopIteration
+        if result.error is not None:
+            self._done = True
+            raise result.error
+        return result.item
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def _drain(self, items: Iterable[Any]) -> None:
+        try:
+            for item in items:
+                if self._stop.is_set():
+                    break
+                self._buffer.put(PipelineResult(item=item))
+        except Exception as exc:
+            self._buffer.put(PipelineResult(item=None, error=exc))
+        finally:
+            self._buffer.put(_DONE)
+
+
+# Download -> process stages over bounded queues. ``run`` yields results in
+# completion order on the caller's thread, which stays the single DB writer.
+class SyncPipeline:
+    def __init__(
+        self,
+        *,
+        download: Callable[[Any], bytes],
+        process: Callable[[Any, bytes], Any],
+        download_workers: int,
+        process_workers: int,
+        queue_size: int,
+    ) -> None:
+        self.download = download
+        self.process = process
+        self.download_workers = max(1, int(download_workers))
+        self.process_workers = max(1, int(process_workers))
+        self.queue_size = max(1, int(queue_size))
+        self._cancel = threading.Event()
+
+    @property
+    def canceled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def run(self, items: Iterable[Any]) -> Iterator[PipelineResult]:
+        pending: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        downloaded: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        results: queue.Queue = queue.Queue()
+        counters = {"download": self.download_workers, "process": self.process_workers}
+        lock = threading.Lock()
+
+        def finish(stage: str, downstream: queue.Queue, sentinels: int) -> None:
+            with lock:
+                counters[stage] -= 1
+                last = counters[stage] == 0
+            if last:
+                for _ in range(sentinels):
+                    self._put(downstream, _DONE)
+
+        def feed() -> None:
+            try:
+                for item in items:
+                    if self._cancel.is_set() or not self._put(pending, item):
+                        break
+            except Exception as exc:
+                results.put(PipelineResult(item=None, error=exc))
+            finally:
+                for _ in range(self.download_workers):
+                    self._put(pending, _DONE)
+
+        def download_stage() -> None:
+            while True:
+                item = self._get(pending)
+                if item is _DONE:
+                    break
+                if self._cancel.is_set():
+                    continue
+                try:
+                    payload = (item, self.download(item), None)
+                except Exception as exc:
+                    payload = (item, None, exc)
+                self._put(downloaded, payload)
+            finish("download", downloaded, self.process_workers)
+
+        def process_stage() -> None:
+            while True:
+                entry = self._get(downloaded)
+                if entry is _DONE:
+                    break
+                item, image_bytes, error = entry
+                if self._cancel.is_set():
+                    continue
+                if error is not None:
+                    results.put(PipelineResult(item=item, error=error))
+                    continue
+                try:
+                    results.put(PipelineResult(item=item, value=self.process(item, image_bytes)))
+                except Exception as exc:
+                    results.put(PipelineResult(item=item, error=exc))
+            finish("process", results, 1)
+
+        threads = [threading.Thread(target=feed, name="sync-feed", daemon=True)]
+        threads += [
+            threading.Thread(target=download_stage, name=f"sync-download-{idx}", daemon=True)
+            for idx in range(self.download_workers)
+        ]
+        threads += [
+            threading.Thread(target=process_stage, name=f"sync-process-{idx}", daemon=True)
+            for idx in range(self.process_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                result = self._get(results)
+                if result is _DONE:
+                    break
+                if result.item is None and result.error is not None:
+                    raise result.error
+                yield result
+        finally:
+            # Stages poll the cancel flag, so an early exit by the consumer
+            # never leaves them blocked; in-flight downloads finish on their own.
+            self._cancel.set()
+            for thread in threads:
+                thread.join(timeout=_POLL_SECONDS)
+
+    def _get(self, source: queue.Queue) -> Any:
+        while True:
+            try:
+                return source.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if self._cancel.is_set():
+                    return _DONE
+
+    def _put(self, target: queue.Queue, value: Any) -> bool:
+        while not self._cancel.is_set():
+            try:
+                target.put(value, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
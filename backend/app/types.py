@@ -5,6 +5,8 @@ from typing import Any
 from sqlalchemy import JSON
 from sqlalchemy.types import TypeDecorator
 
+from app.config import get_settings
+
 try:
     from pgvector.sqlalchemy import Vector
 except Exception:  # pragma: no cover
@@ -15,9 +17,9 @@ class EmbeddingVector(TypeDecorator):
     impl = JSON
     cache_ok = True
 
-    def __init__(self, dimension: int = 512) -> None:
+    def __init__(self, dimension: int | None = None) -> None:
         super().__init__()
-        self.dimension = int(dimension)
+        self.dimension = int(dimension if dimension is not None else get_settings().face_embedding_dim)
 
     def load_dialect_impl(self, dialect):  # type: ignore[override]
         if dialect.name == "postgresql" and Vector is not None:
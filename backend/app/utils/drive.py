@@ -1,15 +1,55 @@
 from __future__ import annotations
 
-from collections import deque
+import importlib.util
+import io
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from typing import Any
 from urllib.parse import quote, urlparse
 
 import httpx
+from PIL import Image
+
+from app.utils.rate_limit import AdaptiveRateLimiter, HostRateLimiters, RetryPolicy, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
 
 
 DRIVE_LIST_URL = "https://www.googleapis.com/drive/v3/files"
 DRIVE_MEDIA_URL = "https://www.googleapis.com/drive/v3/files/{file_id}"
 DRIVE_FOLDER_MIME = "application/vnd.google-apps.folder"
+# Tried in order; {file_id} and {api_key} are URL-quoted before substitution.
+DRIVE_DOWNLOAD_URLS = (
+    DRIVE_MEDIA_URL + "?alt=media&key={api_key}",
+    "https://drive.usercontent.google.com/download?id={file_id}&export=download&confirm=t",
+    "https://drive.google.com/uc?export=download&id={file_id}",
+)
+# Previews capped at 2200px; only used when no original route serves a file.
+DRIVE_PREVIEW_URLS = (
+    "https://drive.google.com/thumbnail?id={file_id}&sz=w2200",
+    "https://lh3.googleusercontent.com/d/{file_id}=w2200",
+)
+# Server-side renditions bounded to {side} on the long edge; Drive never upscales them.
+DRIVE_RENDITION_URLS = (
+    "https://lh3.googleusercontent.com/d/{file_id}=s{side}",
+    "https://drive.google.com/thumbnail?id={file_id}&sz=w{side}-h{side}",
+)
+DOWNLOAD_HEADERS = {"User-Agent": "GrabPic/1.0", "Accept": "image/*,*/*;q=0.8"}
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 320
+RETRYABLE_STATUSES = frozenset({500, 502, 503, 504})
+# Quota errors from the API (403/429 JSON reasons) and Google's anti-bot
+# interstitial, which can arrive as a 403, a 429 or even a 200 HTML page.
+RATE_LIMIT_REASONS = ("ratelimitexceeded", "userratelimitexceeded")
+ANTI_BOT_MARKERS = ("automated queries", "we're sorry", "sorry...", "unusual traffic")
+DRIVE_THROTTLED = "throttled"
+DRIVE_BLOCKED = "blocked"
+DRIVE_UNAVAILABLE = "unavailable"
 
 
 def extract_drive_folder_id(input_value: str) -> str | None:
@@ -44,83 +84,377 @@ def build_content_stamp(file_item: dict[str, Any]) -> str:
     return f"{modified}|{size}|{name}"
 
 
-def list_public_drive_images(api_key: str, folder_id: str, max_images: int, timeout: float = 30.0) -> list[dict[str, Any]]:
+def list_public_drive_images(
+    api_key: str,
+    folder_id: str,
+    max_images: int,
+    timeout: float = 30.0,
+    *,
+    workers: int = 4,
+    modified_after: str | None = None,
+    limiters: HostRateLimiters | None = None,
+    retry: RetryPolicy | None = None,
+) -> list[dict[str, Any]]:
+    return list(
+        iter_public_drive_images(
+            api_key,
+            folder_id,
+            max_images,
+            timeout,
+            workers=workers,
+            modified_after=modified_after,
+            limiters=limiters,
+            retry=retry,
+        )
+    )
+
+
+def iter_public_drive_images(
+    api_key: str,
+    folder_id: str,
+    max_images: int,
+    timeout: float = 30.0,
+    *,
+    workers: int = 4,
+    modified_after: str | None = None,
+    limiters: HostRateLimiters | None = None,
+    retry: RetryPolicy | None = None,
+) -> Iterator[dict[str, Any]]:
     unlimited = max_images <= 0
-    output: list[dict[str, Any]] = []
-    visited: set[str] = set()
-    pending: deque[str] = deque([folder_id])
+    retry = retry or RetryPolicy()
+    visited: set[str] = {folder_id}
+    yielded = 0
 
     with httpx.Client(timeout=timeout, follow_redirects=True, headers={"User-Agent": "GrabPic/1.0"}) as client:
-        while pending and (unlimited or len(output) < max_images):
-            current = pending.popleft()
-            if not current or current in visited:
-                continue
-            visited.add(current)
-
-            next_page: str | None = None
-            while unlimited or len(output) < max_images:
-                page_size = 200 if unlimited else min(200, max(20, max_images - len(output)))
-                params = {
-                    "q": (
-                        f"'{current}' in parents and trashed = false and "
-                        f"(mimeType contains 'image/' or mimeType = '{DRIVE_FOLDER_MIME}')"
-                    ),
-                    "pageSize": str(page_size),
-                    "fields": "nextPageToken, files(id,name,mimeType,webViewLink,modifiedTime,size)",
-                    "supportsAllDrives": "true",
-                    "includeItemsFromAllDrives": "true",
-                    "key": api_key,
-                }
-                if next_page:
-                    params["pageToken"] = next_page
-
-                response = client.get(DRIVE_LIST_URL, params=params)
-                if response.status_code != 200:
-                    raise RuntimeError(f"Drive list API failed ({response.status_code}): {response.text[:220]}")
-                payload = response.json()
-
-                for item in payload.get("files", []):
-                    file_id = str(item.get("id") or "")
-                    mime_type = str(item.get("mimeType") or "")
-                    if not file_id:
-                        continue
-                    if mime_type == DRIVE_FOLDER_MIME:
-                        if file_id not in visited:
-                            pending.append(file_id)
-                        continue
-                    if mime_type.startswith("image/"):
-                        output.append(item)
-                        if not unlimited and len(output) >= max_images:
-                            break
-
-                next_page = payload.get("nextPageToken")
-                if not next_page:
-                    break
-
-    return output if unlimited else output[:max_images]
+        pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="drive-list")
 
+        def submit(folder: str, page_token: str | None) -> Future:
+            page_size = 200 if unlimited else min(200, max(20, max_images - yielded))
+            return pool.submit(
+                _list_folder_page,
+                client,
+                api_key,
+                folder,
+                page_token,
+                page_size,
+                modified_after=modified_after,
+                limiters=limiters,
+                retry=retry,
+            )
 
-def download_public_drive_image(api_key: str, file_id: str, timeout: float = 60.0) -> bytes:
-    candidate_urls = [
-        f"{DRIVE_MEDIA_URL.format(file_id=quote(file_id))}?alt=media&key={quote(api_key)}",
-        f"https://drive.usercontent.google.com/download?id={quote(file_id)}&export=download&confirm=t",
-        f"https://drive.google.com/uc?export=download&id={quote(file_id)}",
-        f"https://drive.google.com/thumbnail?id={quote(file_id)}&sz=w2200",
-        f"https://lh3.googleusercontent.com/d/{quote(file_id)}=w2200",
-    ]
-    headers = {"User-Agent": "GrabPic/1.0", "Accept": "image/*,*/*;q=0.8"}
-    with httpx.Client(timeout=timeout, follow_redirects=True, headers=headers) as client:
-        for url in candidate_urls:
-            response = client.get(url)
-            if response.status_code != 200:
-                continue
-            content = response.content
-            content_type = str(response.headers.get("content-type") or "").lower()
-            if _looks_like_html(content, content_type):
+        # Pages of one folder are chained by their tokens, but sibling folders are
+        # listed side by side and files are handed out as each page lands.
+        pending: set[Future] = {submit(folder_id, None)} if folder_id else set()
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    folder, payload = future.result()
+                    next_page = payload.get("nextPageToken")
+                    if next_page:
+                        pending.add(submit(folder, next_page))
+                    for item in payload.get("files", []):
+                        file_id = str(item.get("id") or "")
+                        mime_type = str(item.get("mimeType") or "")
+                        if not file_id:
+                            continue
+                        if mime_type == DRIVE_FOLDER_MIME:
+                            if file_id not in visited:
+                                visited.add(file_id)
+                                pending.add(submit(file_id, None))
+                            continue
+                        if mime_type.startswith("image/"):
+                            yield item
+                            yielded += 1
+                            if not unlimited and yielded >= max_images:
+                                return
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _list_folder_page(
+    client: httpx.Client,
+    api_key: str,
+    folder_id: str,
+    page_token: str | None,
+    page_size: int,
+    *,
+    modified_after: str | None,
+    limiters: HostRateLimiters | None,
+    retry: RetryPolicy,
+) -> tuple[str, dict[str, Any]]:
+    images = "mimeType contains 'image/'"
+    if modified_after:
+        # Subfolders are always walked (their own modifiedTime does not move
+        # when files inside change); only images are filtered by the watermark.
+        # Uploads and copies can keep an old modifiedTime but get a fresh createdTime.
+        changed = f"(modifiedTime > '{modified_after}' or createdTime > '{modified_after}')"
+        images = f"({images} and {changed})"
+    params = {
+        "q": f"'{folder_id}' in parents and trashed = false and ({images} or mimeType = '{DRIVE_FOLDER_MIME}')",
+        "pageSize": str(page_size),
+        "fields": (
+            "nextPageToken, files(id,name,mimeType,webViewLink,modifiedTime,createdTime,size,"
+            "imageMediaMetadata(width,height))"
+        ),
+        "supportsAllDrives": "true",
+        "includeItemsFromAllDrives": "true",
+        "key": api_key,
+    }
+    if page_token:
+        params["pageToken"] = page_token
+    return folder_id, _get_listing_page(client, params, limiters=limiters, retry=retry)
+
+
+def _get_listing_page(
+    client: httpx.Client,
+    params: dict[str, str],
+    *,
+    limiters: HostRateLimiters | None,
+    retry: RetryPolicy,
+) -> dict[str, Any]:
+    limiter = limiters.for_host(urlparse(DRIVE_LIST_URL).netloc) if limiters else None
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire()
+        retry_after = None
+        try:
+            response = client.get(DRIVE_LIST_URL, params=params)
+        except httpx.TransportError as exc:
+            signal, error = DRIVE_UNAVAILABLE, f"Drive list API request failed: {exc}"
+        else:
+            if response.status_code == 200:
+                if limiter:
+                    limiter.on_success()
+                return response.json()
+            signal = _throttle_signal(response.status_code, response.content)
+            retry_after = parse_retry_after(response.headers.get("retry-after"))
+            error = f"Drive list API failed ({response.status_code}): {response.text[:220]}"
+        _note_throttle(limiter, DRIVE_LIST_URL, signal, retry_after)
+        # There is no other host to list from, so anti-bot blocks are retried too.
+        if signal is None or attempt >= retry.max_retries:
+            raise RuntimeError(error)
+        time.sleep(retry.delay(attempt, retry_after))
+        attempt += 1
+
+
+class DriveDownloader:
+    def __init__(
+        self,
+        api_key: str,
+        *,
+        timeout: float = 60.0,
+        max_connections: int = 8,
+        http2: bool = True,
+        url_templates: Sequence[str] = DRIVE_DOWNLOAD_URLS,
+        preview_templates: Sequence[str] = DRIVE_PREVIEW_URLS,
+        rendition_templates: Sequence[str] = DRIVE_RENDITION_URLS,
+        limiters: HostRateLimiters | None = None,
+        retry: RetryPolicy | None = None,
+    ) -> None:
+        self.api_key = api_key
+        self.url_templates = tuple(url_templates)
+        self.preview_templates = tuple(preview_templates)
+        self.rendition_templates = tuple(rendition_templates)
+        self.limiters = limiters
+        self.retry = retry or RetryPolicy()
+        self.http2 = bool(http2 and HTTP2_AVAILABLE)
+        limit = max(1, int(max_connections))
+        # One pooled client per process: keep-alive (and HTTP/2 multiplexing when
+        # h2 is installed) saves a TLS handshake per photo.
+        self.client = httpx.Client(
+            timeout=timeout,
+            follow_redirects=True,
+            headers=DOWNLOAD_HEADERS,
+            http2=self.http2,
+            limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+        )
+        self._preferred: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __enter__(self) -> "DriveDownloader":
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.client.close()
+
+    def preferred_strategy(self, scope: str, *, rendition: bool = False) -> int | None:
+        with self._lock:
+            return self._preferred.get((scope, "rendition" if rendition else "original"))
+
+    def download(self, file_id: str, *, scope: str = "", originals_only: bool = False) -> bytes:
+        content = self._first_available(self.url_templates, "original", scope, file_id=file_id)
+        # Previews are remembered separately, so a file that only a preview could
+        # serve never moves the event's later downloads off the original routes.
+        if content is None and not originals_only:
+            content = self._first_available(self.preview_templates, "preview", scope, file_id=file_id)
+        if content is None:
+            raise RuntimeError(f"Could not download image for Drive file {file_id}")
+        return content
+
+    def download_rendition(self, file_id: str, side: int, *, scope: str = "", min_side: int = 0) -> bytes | None:
+        # None means no rendition was usable; callers fall back to the original.
+        return self._first_available(
+            self.rendition_templates,
+            "rendition",
+            scope,
+            file_id=file_id,
+            side=int(side),
+            accept=lambda content: image_long_side(content) >= min_side,
+        )
+
+    def _first_available(
+        self,
+        templates: tuple[str, ...],
+        kind: str,
+        scope: str,
+        *,
+        file_id: str,
+        side: int = 0,
+        accept: Callable[[bytes], bool] | None = None,
+    ) -> bytes | None:
+        key = (scope, kind)
+        with self._lock:
+            preferred = self._preferred.get(key)
+        order = list(range(len(templates)))
+        if preferred is not None:
+            # Files in one event are served the same way, so lead with what worked last.
+            order.remove(preferred)
+            order.insert(0, preferred)
+        for index in order:
+            url = templates[index].format(file_id=quote(file_id), api_key=quote(self.api_key), side=side)
+            content = self._fetch_with_retry(url)
+            if content is None or (accept is not None and not accept(content)):
                 continue
-            if _looks_like_image_bytes(content, content_type):
+            if preferred != index:
+                with self._lock:
+                    self._preferred[key] = index
+            return content
+        return None
+
+    def _fetch_with_retry(self, url: str) -> bytes | None:
+        limiter = self.limiters.for_host(urlparse(url).netloc) if self.limiters else None
+        attempt = 0
+        while True:
+            if limiter:
+                limiter.acquire()
+            try:
+                content, signal, retry_after = self._fetch(url)
+            except httpx.TransportError:
+                content, signal, retry_after = None, DRIVE_UNAVAILABLE, None
+            except httpx.HTTPError:
+                return None
+            if content is not None:
+                if limiter:
+                    limiter.on_success()
                 return content
-    raise RuntimeError(f"Could not download image for Drive file {file_id}")
+            _note_throttle(limiter, url, signal, retry_after)
+            # An anti-bot page will not clear within a retry; the next strategy's
+            # host usually still serves the file.
+            if signal not in (DRIVE_THROTTLED, DRIVE_UNAVAILABLE) or attempt >= self.retry.max_retries:
+                return None
+            time.sleep(self.retry.delay(attempt, retry_after))
+            attempt += 1
+
+    def _fetch(self, url: str) -> tuple[bytes | None, str | None, float | None]:
+        buffer = self._buffer()
+        size = 0
+        with self.client.stream("GET", url) as response:
+            content_type = str(response.headers.get("content-type") or "").lower()
+            expected = int(response.headers.get("content-length") or 0)
+            if response.status_code != 200 or "text/html" in content_type:
+                signal = _throttle_signal(response.status_code, _read_head(response))
+                return None, signal, parse_retry_after(response.headers.get("retry-after"))
+            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                end = size + len(chunk)
+                if end > len(buffer):
+                    buffer.extend(bytes(max(end, expected) - len(buffer)))
+                buffer[size:end] = chunk
+                # Drive answers quota and virus-scan pages with HTML; stop reading
+                # as soon as the prefix gives that away.
+                if size < SNIFF_BYTES <= end and _looks_like_html(bytes(buffer[:SNIFF_BYTES]), content_type):
+                    _discard(response, expected - end)
+                    return None, _throttle_signal(200, bytes(buffer[:end])), None
+                size = end
+        content = bytes(memoryview(buffer)[:size])
+        if _looks_like_html(content, content_type):
+            return None, _throttle_signal(200, content), None
+        if not _looks_like_image_bytes(content, content_type):
+            return None, None, None
+        return content, None, None
+
+    def _buffer(self) -> bytearray:
+        # Per-thread scratch buffer that only grows, so steady-state downloads
+        # fill existing memory instead of re-growing a body chunk by chunk.
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = bytearray()
+        return buffer
+
+
+def _discard(response: httpx.Response, remaining: int) -> None:
+    # Draining a short error body keeps the pooled connection reusable; large or
+    # unknown-length bodies are cheaper to drop with the connection.
+    if 0 < remaining <= DOWNLOAD_CHUNK_SIZE:
+        for _chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+            pass
+
+
+def _read_head(response: httpx.Response) -> bytes:
+    # Enough of an error body to classify it; bodies that fit are drained whole
+    # so the pooled connection stays reusable.
+    head = bytearray()
+    for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+        head.extend(chunk)
+        if len(head) >= DOWNLOAD_CHUNK_SIZE:
+            break
+    return bytes(head)
+
+
+def _throttle_signal(status_code: int, body: bytes) -> str | None:
+    text = (body or b"")[:DOWNLOAD_CHUNK_SIZE].decode("utf-8", errors="ignore").lower()
+    if status_code in (200, 403, 429) and any(marker in text for marker in ANTI_BOT_MARKERS):
+        return DRIVE_BLOCKED
+    if status_code == 429 or (status_code == 403 and any(reason in text for reason in RATE_LIMIT_REASONS)):
+        return DRIVE_THROTTLED
+    if status_code in RETRYABLE_STATUSES:
+        return DRIVE_UNAVAILABLE
+    return None
+
+
+def _note_throttle(
+    limiter: AdaptiveRateLimiter | None, url: str, signal: str | None, retry_after: float | None
+) -> None:
+    if limiter is None or signal not in (DRIVE_THROTTLED, DRIVE_BLOCKED):
+        return
+    limiter.on_throttle(retry_after)
+    logger.info("Drive host %s %s; pacing at %.2f req/s", urlparse(url).netloc, signal, limiter.rate)
+
+
+def download_public_drive_image(api_key: str, file_id: str, timeout: float = 60.0) -> bytes:
+    with DriveDownloader(api_key, timeout=timeout, max_connections=1) as downloader:
+        return downloader.download(file_id)
+
+
+def image_long_side(content: bytes) -> int:
+    try:
+        with Image.open(io.BytesIO(content)) as header:
+            return max(header.size)
+    except Exception:
+        return 0
+
+
+def original_long_side(file_item: dict[str, Any]) -> int:
+    metadata = file_item.get("imageMediaMetadata") or {}
+    try:
+        return max(int(metadata.get("width") or 0), int(metadata.get("height") or 0))
+    except (TypeError, ValueError):
+        return 0
 
 
 def _looks_like_drive_id(value: str) -> bool:
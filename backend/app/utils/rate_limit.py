@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+EFFECTIVE_RATE_WINDOW_SECONDS = 10.0
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_retries: int = 4
+    base_seconds: float = 0.5
+    max_seconds: float = 30.0
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        # Full jitter keeps workers that were throttled together from retrying in lockstep.
+        backoff = random.uniform(0.0, min(self.max_seconds, self.base_seconds * (2 ** max(0, attempt))))
+        if retry_after is not None:
+            return min(self.max_seconds, max(float(retry_after), backoff))
+        return backoff
+
+
+def parse_retry_after(value: str | None, *, now: datetime | None = None) -> float | None:
+    raw = str(value or "").strip()
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(raw)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - (now or datetime.now(timezone.utc))).total_seconds())
+
+
+class AdaptiveRateLimiter:
+    def __init__(
+        self,
+        *,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.min_rate = max(0.01, float(min_rate))
+        self.max_rate = max(self.min_rate, float(max_rate))
+        self.rate = min(self.max_rate, max(self.min_rate, float(rate)))
+        self.increase = max(0.0, float(increase))
+        self.decrease = min(1.0, max(0.01, float(decrease)))
+        self.clock = clock
+        self.sleep = sleep
+        self.requests = 0
+        self.throttled = 0
+        self._tokens = max(1.0, self.rate)
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._last_decrease = float("-inf")
+        self._recent: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._refill(now)
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    self.requests += 1
+                    self._recent.append(now)
+                    return
+                else:
+                    wait = (1.0 - self._tokens) / self.rate
+            self.sleep(wait)
+
+    def on_success(self) -> None:
+        # Additive increase of roughly ``increase`` req/s per second of clean traffic.
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / max(1.0, self.rate))
+
+    def on_throttle(self, retry_after: float | None = None) -> None:
+        with self._lock:
+            now = self.clock()
+            self.throttled += 1
+            # Requests already in flight report the same overload; back off once per
+            # round trip instead of collapsing the rate for each of them.
+            if now - self._last_decrease >= 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+            self._tokens = 0.0
+            if retry_after is not None:
+                self._blocked_until = max(self._blocked_until, now + float(retry_after))
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            now = self.clock()
+            self._trim(now)
+            return {
+                "rate_limit": round(self.rate, 3),
+                "effective_rate": round(len(self._recent) / EFFECTIVE_RATE_WINDOW_SECONDS, 3),
+                "requests": self.requests,
+                "throttle_events": self.throttled,
+            }
+
+    def _refill(self, now: float) -> None:
+        # Burst capacity of one second's worth of requests.
+        capacity = max(1.0, self.rate)
+        self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        while self._recent and now - self._recent[0] > EFFECTIVE_RATE_WINDOW_SECONDS:
+            self._recent.popleft()
+
+
+class HostRateLimiters:
+    def __init__(self, factory: Callable[[], AdaptiveRateLimiter]) -> None:
+        self.factory = factory
+        self._limiters: dict[str, AdaptiveRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def for_host(self, host: str) -> AdaptiveRateLimiter:
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = self.factory()
+            return limiter
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {host: limiter.snapshot() for host, limiter in sorted(limiters.items())}
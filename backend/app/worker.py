@@ -1,99 +1,158 @@
 from __future__ import annotations
 
 import logging
+import random
 import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import closing
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
+from itertools import islice
 
-from sqlalchemy import delete, func, select
+import cv2
+from sqlalchemy import delete, func, insert, select
 from sqlalchemy.orm import Session
 
 from app.config import Settings, get_settings
-from app.db import SessionLocal
-from app.ml.face_engine import FaceEngine
-from app.models import Event, Face, FaceCluster, GuestQuery, GuestResult, Job, Photo
-from app.services.clustering import cluster_event_faces
+from app.db import SessionLocal, engine as db_engine, verify_embedding_dimension
+from app.ml.face_engine import FaceEmbedding, FaceEngine, FaceEnginePool, full_resolution_retry_side
+from app.models import Event, Face, FaceCluster, GuestQuery, GuestResult, Job, Photo, SyncListingFile
+from app.services.clustering import update_event_clusters
+from app.services.embedding_cache import bump_embedding_version, get_embedding_index_cache
+from app.services.job_signals import job_waiter
 from app.services.jobs import (
     JOB_CLUSTER_EVENT,
     JOB_MATCH_GUEST,
     JOB_STATUS_QUEUED,
     JOB_STATUS_RUNNING,
+    JOB_STATUS_WAITING,
     JOB_SYNC_EVENT,
+    JOB_SYNC_FINALIZE,
+    JOB_SYNC_SHARD,
     JOB_STATUS_CANCELED,
     JOB_STATUS_CANCEL_REQUESTED,
+    JOB_STATUS_COMPLETED,
+    JOB_STATUS_FAILED,
+    JobHeartbeat,
     acquire_next_job,
     create_job,
+    lane_job_types,
     mark_job_canceled,
     mark_job_completed,
     mark_job_failed,
     mark_job_progress,
+    requeue_expired_jobs,
+    roll_up_sync_shard,
+    settle_sync_parent,
     upsert_job_payload,
 )
 from app.services.matching import (
+    MATCH_ENGINE_CLUSTER,
+    MATCH_ENGINE_NUMPY,
+    cluster_prune_stats,
     collect_ranked_photo_matches,
+    resolve_match_engine,
     store_guest_results_from_ranked,
 )
-from app.services.storage import delete_if_exists, save_thumbnail, to_absolute_path
-from app.utils.drive import build_content_stamp, download_public_drive_image, list_public_drive_images
+from app.services.storage import delete_if_exists, save_thumbnail, save_thumbnail_pixels, to_absolute_path
+from app.services.sync_pipeline import Prefetch, ProgressThrottle, SyncPipeline
+from app.utils.drive import (
+    DriveDownloader,
+    build_content_stamp,
+    iter_public_drive_images,
+    original_long_side,
+)
+from app.utils.rate_limit import AdaptiveRateLimiter, HostRateLimiters, RetryPolicy
 
 logger = logging.getLogger("grabpic.worker")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
 
+CLEANUP_INTERVAL_SECONDS = 60
+LISTING_INSERT_CHUNK = 5000
+
+_engine_pool: FaceEnginePool | None = None
+_drive_downloader: DriveDownloader | None = None
+_drive_limiters: HostRateLimiters | None = None
+
 
 def run_forever() -> None:
     settings = get_settings()
+    with SessionLocal() as db:
+        verify_embedding_dimension(db, settings.face_embedding_dim)
+    if settings.sync_inference_worker_count > 1:
+        # Process-wide: sync parallelism comes from the engine pool, so keep
+        # OpenCV's own thread pool from oversubscribing the cores.
+        cv2.setNumThreads(1)
     face_engine = FaceEngine(settings)
-    logger.info("Worker started")
-    idle_ticks = 0
+    waiter = job_waiter(db_engine)
+    # Subscribe before the first claim so an enqueue in between is not missed.
+    waiter.wait(0)
+    job_types = lane_job_types(settings.worker_lanes)
+    logger.info("Worker started (lanes: %s)", settings.worker_lanes or "all")
+    last_cleanup = time.monotonic()
 
     while True:
-        job_id = _claim_next_job()
+        # Checked before every claim, not only when idle: a pool that always has
+        # work is exactly where dead workers' leases need reclaiming.
+        if time.monotonic() - last_cleanup >= CLEANUP_INTERVAL_SECONDS:
+            _run_cleanup(settings)
+            last_cleanup = time.monotonic()
+        job_id = _claim_next_job(job_types)
         if not job_id:
-            idle_ticks += 1
-            if idle_ticks % max(1, int(60 / max(1, settings.job_idle_sleep_seconds))) == 0:
-                _run_cleanup(settings)
-            time.sleep(max(1, settings.job_idle_sleep_seconds))
+            waiter.wait(max(1, settings.job_listen_timeout_seconds))
             continue
 
-        idle_ticks = 0
         try:
             with SessionLocal() as db:
                 job = db.get(Job, job_id)
                 if not job:
                     continue
-                _dispatch_job(db=db, job=job, settings=settings, face_engine=face_engine)
-                db.commit()
+                with JobHeartbeat(SessionLocal, job_id, settings.job_heartbeat_seconds):
+                    _dispatch_job(db=db, job=job, settings=settings, face_engine=face_engine)
+                    db.commit()
         except Exception as exc:
             logger.exception("Job %s failed: %s", job_id, exc)
             with SessionLocal() as db:
                 job = db.get(Job, job_id)
                 if not job:
                     continue
-                if job.status in {JOB_STATUS_CANCELED, JOB_STATUS_CANCEL_REQUESTED}:
-                    mark_job_canceled(db, job, reason="Canceled by admin")
-                    if job.query_id:
-                        query = db.get(GuestQuery, job.query_id)
-                        if query:
-                            query.status = "failed"
-                            query.error_text = "Canceled by admin"
-                            query.message = "Matching was canceled by admin."
-                            db.add(query)
-                    db.commit()
-                    continue
-                mark_job_failed(db, job, str(exc))
-                if job.query_id:
-                    query = db.get(GuestQuery, job.query_id)
-                    if query:
-                        query.status = "failed"
-                        query.error_text = str(exc)
-                        query.message = "Failed to process selfie"
-                        db.add(query)
+                canceled = _record_job_failure(db, job, exc)
                 db.commit()
-            time.sleep(max(1, settings.job_poll_interval_seconds))
+            if not canceled:
+                time.sleep(max(1, settings.job_poll_interval_seconds))
+
+
+def _record_job_failure(db: Session, job: Job, exc: Exception) -> bool:
+    if job.status in {JOB_STATUS_CANCELED, JOB_STATUS_CANCEL_REQUESTED}:
+        mark_job_canceled(db, job, reason="Canceled by admin")
+        if job.job_type == JOB_SYNC_FINALIZE:
+            settle_sync_parent(db, job, event_status="canceled", reason="Canceled by admin")
+        if job.query_id:
+            query = db.get(GuestQuery, job.query_id)
+            if query:
+                query.status = "failed"
+                query.error_text = "Canceled by admin"
+                query.message = "Matching was canceled by admin."
+                db.add(query)
+        return True
+    mark_job_failed(db, job, str(exc))
+    if job.job_type == JOB_SYNC_SHARD:
+        roll_up_sync_shard(db, job, {"failed_shards": 1})
+    elif job.job_type == JOB_SYNC_FINALIZE:
+        settle_sync_parent(db, job, event_status="failed", reason=str(exc))
+    if job.query_id:
+        query = db.get(GuestQuery, job.query_id)
+        if query:
+            query.status = "failed"
+            query.error_text = str(exc)
+            query.message = "Failed to process selfie"
+            db.add(query)
+    return False
 
 
-def _claim_next_job() -> str | None:
+def _claim_next_job(job_types: tuple[str, ...] | None = None) -> str | None:
     with SessionLocal() as db:
-        job = acquire_next_job(db)
+        job = acquire_next_job(db, job_types)
         if not job:
             db.commit()
             return None
@@ -106,6 +165,12 @@ def _dispatch_job(db: Session, job: Job, settings: Settings, face_engine: FaceEn
     if job.job_type == JOB_SYNC_EVENT:
         _process_sync_event(db=db, job=job, settings=settings, face_engine=face_engine)
         return
+    if job.job_type == JOB_SYNC_SHARD:
+        _process_sync_shard(db=db, job=job, settings=settings, face_engine=face_engine)
+        return
+    if job.job_type == JOB_SYNC_FINALIZE:
+        _process_sync_finalize(db=db, job=job)
+        return
     if job.job_type == JOB_CLUSTER_EVENT:
         _process_cluster_event(db=db, job=job, settings=settings)
         return
@@ -152,21 +217,70 @@ def _process_sync_event(db: Session, job: Job, settings: Settings, face_engine:
     if _is_cancel_requested(db, job.id):
         _cancel_sync_or_cluster_job(db=db, job=job, event=event)
         return
-    files = list_public_drive_images(
-        api_key=settings.google_drive_api_key,
-        folder_id=event.drive_folder_id,
-        max_images=settings.max_sync_images,
-    )
-    files = [item for item in files if str(item.get("id") or "").strip()]
-    total = len(files)
-    if total == 0:
+    existing_rows = db.execute(
+        select(Photo.id, Photo.drive_file_id, Photo.content_stamp).where(Photo.event_id == event.id)
+    ).all()
+    existing_index: dict[str, tuple[str, str]] = {
+        str(drive_file_id): (str(photo_id), str(content_stamp or ""))
+        for photo_id, drive_file_id, content_stamp in existing_rows
+        if str(drive_file_id or "").strip()
+    }
+
+    modified_after = _incremental_listing_since(event=event, job=job, settings=settings)
+    full_listing = modified_after is None
+    upsert_job_payload(job, {"listing_mode": "full" if full_listing else "incremental"})
+
+    # Files stream from the listing straight into the download pipeline. Up to
+    # one shard's worth is processed here; the listing keeps draining on its own
+    # thread meanwhile, and whatever it turns up beyond that is fanned out to
+    # shards once it is complete.
+    listing = SyncListing()
+    shard_size = int(settings.sync_shard_size)
+    job_id = job.id
+    with closing(
+        Prefetch(
+            listing.refresh_entries(
+                iter_public_drive_images(
+                    api_key=settings.google_drive_api_key,
+                    folder_id=event.drive_folder_id,
+                    max_images=settings.max_sync_images,
+                    workers=settings.drive_list_workers,
+                    modified_after=modified_after,
+                    limiters=_get_drive_rate_limiters(settings),
+                    retry=_drive_retry_policy(settings),
+                ),
+                existing_index,
+            ),
+            name="sync-listing",
+        )
+    ) as entries:
+        outcome = _sync_files(
+            db,
+            job=job,
+            event=event,
+            settings=settings,
+            face_engine=face_engine,
+            entries=islice(entries, shard_size) if shard_size > 0 else entries,
+            listing=listing,
+            is_canceled=lambda: _is_cancel_requested(db, job_id),
+        )
+        if outcome.canceled:
+            _cancel_sync_or_cluster_job(db=db, job=outcome.job, event=outcome.event)
+            return
+        remaining = list(entries)
+    job, event = outcome.job, outcome.event
+
+    if listing.listed == 0:
         event.status = "ready"
+        if full_listing:
+            event.full_synced_at = datetime.now(timezone.utc)
         mark_job_completed(
             db,
             job,
-            stage="completed_no_images",
+            stage="completed_no_images" if full_listing else "completed_no_changes",
             payload={
                 "phase": "completed",
+                "listing_mode": "full" if full_listing else "incremental",
                 "total_listed": 0,
                 "completed": 0,
                 "processed": 0,
@@ -179,172 +293,280 @@ def _process_sync_event(db: Session, job: Job, settings: Settings, face_engine:
         db.add(event)
         return
 
-    existing_rows = db.execute(
-        select(Photo.id, Photo.drive_file_id, Photo.content_stamp).where(Photo.event_id == event.id)
-    ).all()
-    existing_index: dict[str, tuple[str, str]] = {
-        str(drive_file_id): (str(photo_id), str(content_stamp or ""))
-        for photo_id, drive_file_id, content_stamp in existing_rows
-        if str(drive_file_id or "").strip()
+    counts = {
+        "total_listed": listing.listed,
+        "processed": listing.reused + outcome.refreshed,
+        "matched_faces": outcome.matched_faces,
+        "refreshed_files": outcome.refreshed,
+        "reused_files": listing.reused,
+        "refresh_queue_total": listing.queued,
+        "failures": outcome.failures,
+        "rendition_files": outcome.renditions,
+        "original_fallback_files": outcome.original_fallbacks,
     }
-
-    refresh_queue: list[tuple[dict, str, str | None]] = []
-    seen_ids: set[str] = set()
-    reused = 0
-    for file_item in files:
-        file_id = str(file_item.get("id") or "")
-        if not file_id:
-            continue
-        seen_ids.add(file_id)
-        stamp = build_content_stamp(file_item)
-        existing = existing_index.get(file_id)
-        if existing and existing[1] == stamp:
-            reused += 1
-            continue
-        refresh_queue.append((file_item, stamp, existing[0] if existing else None))
-
-    refreshed = 0
-    failures = 0
-    processed = reused
-    matched_faces = 0
-    if reused > 0:
-        resumed_percent = max(2.0, min(95.0, (reused / total) * 100.0))
-        mark_job_progress(db, job, progress_percent=resumed_percent, stage=f"resuming from {reused}/{total}")
-        upsert_job_payload(
-            job,
-            {
-                "phase": "processing",
-                "total_listed": total,
-                "completed": reused,
-                "processed": processed,
-                "matched_faces": matched_faces,
-                "refreshed_files": refreshed,
-                "reused_files": reused,
-                "refresh_queue_total": len(refresh_queue),
-                "failures": failures,
-            },
+    if remaining:
+        _fan_out_sync(
+            db,
+            job=job,
+            event=event,
+            refresh_queue=remaining,
+            listing=listing,
+            full_listing=full_listing,
+            counts=counts,
+            shard_size=shard_size,
         )
-        db.commit()
-        event = db.get(Event, event.id)
-        job = db.get(Job, job.id)
-        if not event or not job:
-            raise RuntimeError("Event or job missing after sync resume commit")
-
-    for refresh_idx, (file_item, stamp, existing_photo_id) in enumerate(refresh_queue, start=1):
-        if _is_cancel_requested(db, job.id):
-            _cancel_sync_or_cluster_job(db=db, job=job, event=event)
-            return
-        file_id = str(file_item.get("id") or "")
-        if not file_id:
-            continue
-        try:
-            photo = db.get(Photo, existing_photo_id) if existing_photo_id else None
-            image_bytes = download_public_drive_image(api_key=settings.google_drive_api_key, file_id=file_id)
-            thumb_path = save_thumbnail(
-                settings=settings,
-                event_id=event.id,
-                drive_file_id=file_id,
-                image_bytes=image_bytes,
-                max_size=settings.thumbnail_max_size,
+        return
+    _finish_sync(
+        db,
+        job=job,
+        event=event,
+        seen_ids=listing.seen_ids,
+        counts=counts,
+        full_listing=full_listing,
+        watermark=listing.newest_modified,
+        extra={"drive_rates": _get_drive_rate_limiters(settings).snapshot()},
+    )
+
+
+def _incremental_listing_since(*, event: Event, job: Job, settings: Settings) -> str | None:
+    # Only scheduled refreshes list deltas. Manual resyncs, first syncs and the
+    # periodic safety rescan list everything, because a delta listing cannot see
+    # deletions or files moved in without a newer modifiedTime.
+    rescan_hours = float(settings.sync_full_rescan_hours)
+    if (job.payload or {}).get("trigger") != "auto_refresh" or rescan_hours <= 0:
+        return None
+    if not event.drive_modified_watermark or event.full_synced_at is None:
+        return None
+    full_synced_at = event.full_synced_at
+    if full_synced_at.tzinfo is None:
+        full_synced_at = full_synced_at.replace(tzinfo=timezone.utc)
+    if datetime.now(timezone.utc) - full_synced_at >= timedelta(hours=rescan_hours):
+        return None
+    try:
+        watermark = datetime.fromisoformat(event.drive_modified_watermark.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    # Overlap absorbs Drive's eventual consistency; re-listed files are reused by content stamp.
+    since = watermark - timedelta(seconds=max(0, int(settings.sync_watermark_overlap_seconds)))
+    return since.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@dataclass
+class SyncOutcome:
+    job: Job
+    event: Event
+    refreshed: int = 0
+    failures: int = 0
+    matched_faces: int = 0
+    renditions: int = 0
+    original_fallbacks: int = 0
+    canceled: bool = False
+
+
+@dataclass
+class SyncListing:
+    listed: int = 0
+    reused: int = 0
+    queued: int = 0
+    complete: bool = False
+    newest_modified: str = ""
+    seen_ids: set[str] = field(default_factory=set)
+
+    def refresh_entries(
+        self, files: Iterable[dict], existing_index: dict[str, tuple[str, str]]
+    ) -> Iterator[tuple[dict, str, str | None]]:
+        # Runs on the listing's prefetch thread; the sync loop only reads the counters.
+        for file_item in files:
+            file_id = str(file_item.get("id") or "").strip()
+            if not file_id or file_id in self.seen_ids:
+                continue
+            self.seen_ids.add(file_id)
+            self.listed += 1
+            # Drive's RFC 3339 timestamps share one format, so they order as strings.
+            # The delta query matches either timestamp, so the watermark tracks both.
+            self.newest_modified = max(
+                self.newest_modified,
+                str(file_item.get("modifiedTime") or ""),
+                str(file_item.get("createdTime") or ""),
             )
-            if not photo:
-                photo = Photo(
-                    event_id=event.id,
-                    drive_file_id=file_id,
-                    file_name=str(file_item.get("name") or file_id),
-                    mime_type=str(file_item.get("mimeType") or "image/jpeg"),
-                    web_view_link=str(file_item.get("webViewLink") or f"https://drive.google.com/file/d/{file_id}/view"),
-                    preview_url=f"https://drive.google.com/thumbnail?id={file_id}&sz=w1200",
-                    download_url=f"https://drive.google.com/uc?export=download&id={file_id}",
-                    thumbnail_path=thumb_path,
-                    content_stamp=stamp,
-                    status="ok",
-                )
-                db.add(photo)
-                db.flush()
-            else:
-                photo.file_name = str(file_item.get("name") or photo.file_name)
-                photo.mime_type = str(file_item.get("mimeType") or photo.mime_type)
-                photo.web_view_link = str(file_item.get("webViewLink") or photo.web_view_link)
-                photo.preview_url = f"https://drive.google.com/thumbnail?id={file_id}&sz=w1200"
-                photo.download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-                photo.thumbnail_path = thumb_path
-                photo.content_stamp = stamp
-                photo.status = "ok"
-                db.add(photo)
-                db.execute(delete(Face).where(Face.photo_id == photo.id))
-
-            faces = face_engine.embed_faces(image_bytes=image_bytes, max_faces=20)
-            for face_idx, face in enumerate(faces):
-                bx, by, bw, bh = face.bbox
-                db.add(
-                    Face(
-                        event_id=event.id,
-                        photo_id=photo.id,
-                        face_index=face_idx,
-                        embedding=face.embedding,
-                        area_ratio=float(face.area_ratio),
-                        det_confidence=float(face.det_confidence),
-                        sharpness=float(face.sharpness),
-                        bbox_x=float(bx),
-                        bbox_y=float(by),
-                        bbox_w=float(bw),
-                        bbox_h=float(bh),
-                        cluster_label=None,
-                    )
-                )
-            # Flush each image's writes so validation/DB errors are handled
-            # in this iteration, not deferred to a later commit.
-            db.flush()
-            matched_faces += len(faces)
-            refreshed += 1
-            processed += 1
-        except Exception as exc:
-            failures += 1
-            logger.warning("Skipping Drive file %s due to error: %s", file_id, exc)
-            db.rollback()
-            event = db.get(Event, event.id)
-            job = db.get(Job, job.id)
-            if not event or not job:
-                raise RuntimeError("Event or job missing after sync rollback")
-
-        overall_completed = reused + refresh_idx
-        percent = max(2.0, min(95.0, (overall_completed / total) * 100.0))
-        mark_job_progress(db, job, progress_percent=percent, stage=f"processing image {overall_completed}/{total}")
+            stamp = build_content_stamp(file_item)
+            existing = existing_index.get(file_id)
+            if existing and existing[1] == stamp:
+                self.reused += 1
+                continue
+            self.queued += 1
+            yield file_item, stamp, existing[0] if existing else None
+        self.complete = True
+
+
+def _sync_files(
+    db: Session,
+    *,
+    job: Job,
+    event: Event,
+    settings: Settings,
+    face_engine: FaceEngine,
+    entries: Iterable[tuple[dict, str, str | None]],
+    listing: SyncListing,
+    is_canceled: Callable[[], bool],
+) -> SyncOutcome:
+    outcome = SyncOutcome(job=job, event=event)
+    batch_changed = False
+    event_id = event.id
+    engine_pool = _get_engine_pool(settings, face_engine)
+    downloader = _get_drive_downloader(settings)
+    pipeline = SyncPipeline(
+        download=lambda entry: _download_sync_image(downloader, entry[0], settings=settings, scope=event_id),
+        process=lambda entry, fetched: _analyze_drive_file(
+            settings=settings,
+            engine_pool=engine_pool,
+            downloader=downloader,
+            event_id=event_id,
+            file_item=entry[0],
+            fetched=fetched,
+        ),
+        download_workers=settings.sync_download_workers,
+        process_workers=settings.sync_inference_worker_count,
+        queue_size=settings.sync_queue_size,
+    )
+    throttle = ProgressThrottle(
+        every=settings.sync_progress_every,
+        interval_seconds=settings.sync_progress_interval_seconds,
+    )
+
+    def commit_progress(file_item: dict, file_id: str) -> None:
+        nonlocal batch_changed
+        if batch_changed:
+            bump_embedding_version(db, event.id)
+            batch_changed = False
+        total = max(1, listing.listed)
+        completed = listing.reused + outcome.refreshed + outcome.failures
+        percent = max(2.0, min(95.0, (completed / total) * 100.0))
+        mark_job_progress(db, job, progress_percent=percent, stage=f"processing image {completed}/{listing.listed}")
         upsert_job_payload(
             job,
             {
-                "phase": "processing",
-                "total_listed": total,
-                "completed": overall_completed,
-                "processed": processed,
-                "matched_faces": matched_faces,
-                "refreshed_files": refreshed,
-                "reused_files": reused,
-                "refresh_queue_total": len(refresh_queue),
-                "failures": failures,
+                "phase": "processing" if listing.complete else "listing",
+                "total_listed": listing.listed,
+                "completed": completed,
+                "processed": listing.reused + outcome.refreshed,
+                "matched_faces": outcome.matched_faces,
+                "refreshed_files": outcome.refreshed,
+                "reused_files": listing.reused,
+                "refresh_queue_total": listing.queued,
+                "failures": outcome.failures,
+                "rendition_files": outcome.renditions,
+                "original_fallback_files": outcome.original_fallbacks,
                 "current_file_id": file_id,
                 "current_file_name": str(file_item.get("name") or file_id),
+                "drive_rates": _get_drive_rate_limiters(settings).snapshot(),
             },
         )
         db.commit()
-        event = db.get(Event, event.id)
-        job = db.get(Job, job.id)
-        if not event or not job:
-            raise RuntimeError("Event or job missing after sync progress commit")
-
-    current_photos = db.execute(select(Photo).where(Photo.event_id == event.id)).scalars().all()
-    for photo in current_photos:
-        if photo.drive_file_id in seen_ids:
-            continue
-        db.execute(delete(Face).where(Face.photo_id == photo.id))
-        db.execute(delete(GuestResult).where(GuestResult.photo_id == photo.id))
-        db.delete(photo)
+        throttle.reset()
+
+    file_item: dict = {}
+    file_id = ""
+    with closing(pipeline.run(entries)) as results:
+        for result in results:
+            file_item, stamp, existing_photo_id = result.item
+            file_id = str(file_item.get("id") or "")
+            try:
+                if result.error is not None:
+                    raise result.error
+                analyzed: AnalyzedImage = result.value
+                # One savepoint per image: a bad row rolls back only that image,
+                # not the rest of the batch waiting for the next commit.
+                with db.begin_nested():
+                    photo = db.get(Photo, existing_photo_id) if existing_photo_id else None
+                    if not photo:
+                        photo = Photo(
+                            event_id=event.id,
+                            drive_file_id=file_id,
+                            file_name=str(file_item.get("name") or file_id),
+                            mime_type=str(file_item.get("mimeType") or "image/jpeg"),
+                            web_view_link=str(
+                                file_item.get("webViewLink") or f"https://drive.google.com/file/d/{file_id}/view"
+                            ),
+                            preview_url=f"https://drive.google.com/thumbnail?id={file_id}&sz=w1200",
+                            download_url=f"https://drive.google.com/uc?export=download&id={file_id}",
+                            thumbnail_path=analyzed.thumbnail_path,
+                            content_stamp=stamp,
+                            status="ok",
+                        )
+                        db.add(photo)
+                        db.flush()
+                    else:
+                        photo.file_name = str(file_item.get("name") or photo.file_name)
+                        photo.mime_type = str(file_item.get("mimeType") or photo.mime_type)
+                        photo.web_view_link = str(file_item.get("webViewLink") or photo.web_view_link)
+                        photo.preview_url = f"https://drive.google.com/thumbnail?id={file_id}&sz=w1200"
+                        photo.download_url = f"https://drive.google.com/uc?export=download&id={file_id}"
+                        photo.thumbnail_path = analyzed.thumbnail_path
+                        photo.content_stamp = stamp
+                        photo.status = "ok"
+                        db.add(photo)
+                        db.execute(delete(Face).where(Face.photo_id == photo.id))
+
+                    db.add_all(_face_rows(event_id=event.id, photo_id=photo.id, faces=analyzed.faces))
+                outcome.matched_faces += len(analyzed.faces)
+                outcome.refreshed += 1
+                outcome.renditions += int(analyzed.rendition)
+                outcome.original_fallbacks += int(analyzed.original_fallback)
+                batch_changed = True
+            except Exception as exc:
+                outcome.failures += 1
+                logger.warning("Skipping Drive file %s due to error: %s", file_id, exc)
+
+            if not throttle.tick():
+                continue
+            commit_progress(file_item, file_id)
+            if is_canceled():
+                pipeline.cancel()
+                outcome.canceled = True
+                return outcome
+    if throttle.pending:
+        commit_progress(file_item, file_id)
+    return outcome
+
+
+def _finish_sync(
+    db: Session,
+    *,
+    job: Job,
+    event: Event,
+    seen_ids: set[str],
+    counts: dict,
+    full_listing: bool = True,
+    watermark: str = "",
+    extra: dict | None = None,
+) -> None:
+    pruned = 0
+    # A delta listing only names changed files, so it can never prove a photo is gone.
+    if full_listing:
+        current_photos = db.execute(select(Photo).where(Photo.event_id == event.id)).scalars().all()
+        for photo in current_photos:
+            if photo.drive_file_id in seen_ids:
+                continue
+            db.execute(delete(Face).where(Face.photo_id == photo.id))
+            db.execute(delete(GuestResult).where(GuestResult.photo_id == photo.id))
+            db.delete(photo)
+            pruned += 1
+        if pruned > 0:
+            bump_embedding_version(db, event.id)
 
     existing_cluster_count = int(
         db.execute(select(func.count(FaceCluster.id)).where(FaceCluster.event_id == event.id)).scalar_one() or 0
     )
-    should_recluster = refreshed > 0 or failures > 0 or existing_cluster_count == 0
+    failed = int(counts.get("failures") or 0) + int((extra or {}).get("failed_shards") or 0)
+    # Files that failed in a delta listing are retried by holding the watermark
+    # back; after a full listing they wait for the next periodic rescan instead,
+    # so one unreadable file cannot pin an event to full listings.
+    if full_listing or failed == 0:
+        event.drive_modified_watermark = max(event.drive_modified_watermark or "", watermark) or None
+    if full_listing:
+        event.full_synced_at = datetime.now(timezone.utc)
+    should_recluster = int(counts.get("refreshed_files") or 0) > 0 or failed > 0 or existing_cluster_count == 0
     if should_recluster:
         event.status = "processing_clusters"
         db.add(event)
@@ -353,7 +575,11 @@ def _process_sync_event(db: Session, job: Job, settings: Settings, face_engine:
             db,
             job_type=JOB_CLUSTER_EVENT,
             event_id=event.id,
-            payload={"trigger": "after_sync", "source_job_id": job.id},
+            payload={
+                "trigger": "after_sync",
+                "source_job_id": job.id,
+                "full": bool((job.payload or {}).get("full_recluster")),
+            },
             stage="queued_for_clustering",
         )
     else:
@@ -366,19 +592,386 @@ def _process_sync_event(db: Session, job: Job, settings: Settings, face_engine:
         stage="sync_completed" if should_recluster else "sync_completed_reused",
         payload={
             "phase": "completed",
-            "total_listed": total,
-            "completed": total,
-            "processed": processed,
-            "matched_faces": matched_faces,
-            "refreshed_files": refreshed,
-            "reused_files": reused,
-            "refresh_queue_total": len(refresh_queue),
-            "failures": failures,
+            **counts,
+            "completed": int(counts.get("total_listed") or 0),
             "cluster_reused": not should_recluster,
+            "listing_mode": "full" if full_listing else "incremental",
+            "pruned_photos": pruned,
+            **(extra or {}),
+        },
+    )
+
+
+def _fan_out_sync(
+    db: Session,
+    *,
+    job: Job,
+    event: Event,
+    refresh_queue: list[tuple[dict, str, str | None]],
+    listing: SyncListing,
+    full_listing: bool,
+    counts: dict,
+    shard_size: int,
+) -> None:
+    # The listing is stored once under the parent job: shards read their slice of
+    # the queue by position and the finalizer prunes against every listed id.
+    # Keeping it out of job payloads keeps those rows small for 100k-file folders.
+    queued = {
+        str(item.get("id") or ""): (index, item, stamp, photo_id)
+        for index, (item, stamp, photo_id) in enumerate(refresh_queue)
+    }
+    rows = []
+    for file_id in sorted(listing.seen_ids):
+        index, item, stamp, photo_id = queued.get(file_id, (None, None, "", None))
+        rows.append(
+            {
+                "job_id": job.id,
+                "drive_file_id": file_id,
+                "queue_index": index,
+                "content_stamp": stamp,
+                "photo_id": photo_id,
+                "file": item,
+            }
+        )
+    for start in range(0, len(rows), LISTING_INSERT_CHUNK):
+        db.execute(insert(SyncListingFile), rows[start : start + LISTING_INSERT_CHUNK])
+
+    # The finalizer waits until the last shard rolls up, then prunes against the
+    # full listing and queues clustering once for the whole sync.
+    finalize = create_job(
+        db,
+        job_type=JOB_SYNC_FINALIZE,
+        event_id=event.id,
+        payload={
+            "parent_job_id": job.id,
+            "full_listing": full_listing,
+            "watermark": listing.newest_modified,
+        },
+        stage="waiting_for_shards",
+        status=JOB_STATUS_WAITING,
+    )
+    bounds = [
+        (start, min(start + shard_size, len(refresh_queue))) for start in range(0, len(refresh_queue), shard_size)
+    ]
+    for index, (start, stop) in enumerate(bounds):
+        create_job(
+            db,
+            job_type=JOB_SYNC_SHARD,
+            event_id=event.id,
+            payload={"parent_job_id": job.id, "shard_index": index, "start": start, "stop": stop},
+            stage="queued_shard",
+        )
+    total = max(1, int(counts["total_listed"]))
+    completed = int(counts["processed"]) + int(counts["failures"])
+    job.status = JOB_STATUS_WAITING
+    mark_job_progress(
+        db,
+        job,
+        progress_percent=max(2.0, min(95.0, (completed / total) * 100.0)),
+        stage=f"processing {len(bounds)} shard(s)",
+    )
+    upsert_job_payload(
+        job,
+        {
+            "phase": "processing",
+            **counts,
+            "completed": completed,
+            "shards_total": len(bounds),
+            "shards_completed": 0,
+            "failed_shards": 0,
+            "finalize_job_id": finalize.id,
         },
     )
 
 
+def _process_sync_shard(db: Session, job: Job, settings: Settings, face_engine: FaceEngine) -> None:
+    payload = dict(job.payload or {})
+    parent = db.get(Job, str(payload.get("parent_job_id") or ""))
+    event = db.get(Event, job.event_id) if job.event_id else None
+    if not parent or not event:
+        mark_job_failed(db, job, "sync_shard job missing parent job or event")
+        if parent:
+            roll_up_sync_shard(db, job, {"failed_shards": 1})
+        return
+
+    job_id, parent_id = job.id, parent.id
+    listed = db.execute(
+        select(SyncListingFile.file, SyncListingFile.content_stamp, SyncListingFile.photo_id)
+        .where(
+            SyncListingFile.job_id == parent_id,
+            SyncListingFile.queue_index >= int(payload.get("start") or 0),
+            SyncListingFile.queue_index < int(payload.get("stop") or 0),
+        )
+        .order_by(SyncListingFile.queue_index)
+    ).all()
+    entries = [(dict(item or {}), str(stamp or ""), photo_id) for item, stamp, photo_id in listed]
+    # A reclaimed shard skips files an earlier attempt already stored.
+    stored = dict(
+        db.execute(
+            select(Photo.drive_file_id, Photo.content_stamp).where(
+                Photo.event_id == event.id,
+                Photo.drive_file_id.in_([str(item.get("id") or "") for item, _stamp, _photo_id in entries]),
+            )
+        ).all()
+    )
+    pending = [entry for entry in entries if stored.get(str(entry[0].get("id") or "")) != entry[1]]
+    skipped = len(entries) - len(pending)
+    if _is_shard_canceled(db, job_id, parent_id):
+        mark_job_canceled(db, job, reason="Parent sync job was canceled")
+        roll_up_sync_shard(db, job, {})
+        return
+
+    outcome = _sync_files(
+        db,
+        job=job,
+        event=event,
+        settings=settings,
+        face_engine=face_engine,
+        entries=pending,
+        listing=SyncListing(listed=len(entries), reused=skipped, queued=len(pending), complete=True),
+        is_canceled=lambda: _is_shard_canceled(db, job_id, parent_id),
+    )
+    job = outcome.job
+    counts = {
+        "completed": len(entries),
+        "processed": skipped + outcome.refreshed,
+        "matched_faces": outcome.matched_faces,
+        "refreshed_files": outcome.refreshed,
+        "failures": outcome.failures,
+        "rendition_files": outcome.renditions,
+        "original_fallback_files": outcome.original_fallbacks,
+    }
+    if outcome.canceled:
+        mark_job_canceled(db, job, reason="Parent sync job was canceled")
+        roll_up_sync_shard(db, job, {})
+        return
+    mark_job_completed(
+        db,
+        job,
+        stage="shard_completed",
+        payload={
+            "parent_job_id": parent_id,
+            "shard_index": payload.get("shard_index"),
+            "start": payload.get("start"),
+            "stop": payload.get("stop"),
+            **counts,
+        },
+    )
+    roll_up_sync_shard(db, job, counts)
+
+
+def _is_shard_canceled(db: Session, shard_id: str, parent_id: str) -> bool:
+    statuses = db.execute(select(Job.status).where(Job.id.in_([shard_id, parent_id]))).scalars().all()
+    return any(value in {JOB_STATUS_CANCELED, JOB_STATUS_CANCEL_REQUESTED} for value in statuses)
+
+
+def _process_sync_finalize(db: Session, job: Job) -> None:
+    payload = dict(job.payload or {})
+    parent = db.get(Job, str(payload.get("parent_job_id") or ""))
+    event = db.get(Event, job.event_id) if job.event_id else None
+    if not parent or not event:
+        mark_job_failed(db, job, "sync_finalize job missing parent job or event")
+        return
+    if parent.status != JOB_STATUS_WAITING:
+        db.execute(delete(SyncListingFile).where(SyncListingFile.job_id == parent.id))
+        mark_job_canceled(db, job, reason=f"Parent sync job is {parent.status}")
+        return
+
+    seen_ids = set(
+        db.execute(select(SyncListingFile.drive_file_id).where(SyncListingFile.job_id == parent.id)).scalars()
+    )
+    rolled_up = dict(parent.payload or {})
+    counts = {
+        key: int(rolled_up.get(key) or 0)
+        for key in (
+            "total_listed",
+            "processed",
+            "matched_faces",
+            "refreshed_files",
+            "reused_files",
+            "refresh_queue_total",
+            "failures",
+            "rendition_files",
+            "original_fallback_files",
+        )
+    }
+    _finish_sync(
+        db,
+        job=parent,
+        event=event,
+        seen_ids=seen_ids,
+        counts=counts,
+        full_listing=bool(payload.get("full_listing", True)),
+        watermark=str(payload.get("watermark") or ""),
+        extra={
+            "shards_total": int(rolled_up.get("shards_total") or 0),
+            "failed_shards": int(rolled_up.get("failed_shards") or 0),
+        },
+    )
+    db.execute(delete(SyncListingFile).where(SyncListingFile.job_id == parent.id))
+    mark_job_completed(db, job, stage="finalize_completed", payload={"parent_job_id": parent.id})
+
+
+@dataclass
+class AnalyzedImage:
+    thumbnail_path: str
+    faces: list[FaceEmbedding]
+    small_faces: int = 0
+    rendition: bool = False
+    original_fallback: bool = False
+
+
+def _get_engine_pool(settings: Settings, face_engine: FaceEngine) -> FaceEnginePool:
+    global _engine_pool
+    if _engine_pool is None:
+        _engine_pool = FaceEnginePool(settings, primary=face_engine)
+    return _engine_pool
+
+
+def _get_drive_downloader(settings: Settings) -> DriveDownloader:
+    global _drive_downloader
+    if _drive_downloader is None or _drive_downloader.api_key != settings.google_drive_api_key:
+        if _drive_downloader is not None:
+            _drive_downloader.close()
+        _drive_downloader = DriveDownloader(
+            settings.google_drive_api_key,
+            max_connections=settings.sync_download_workers,
+            http2=settings.drive_http2,
+            limiters=_get_drive_rate_limiters(settings),
+            retry=_drive_retry_policy(settings),
+        )
+    return _drive_downloader
+
+
+def _get_drive_rate_limiters(settings: Settings) -> HostRateLimiters:
+    # Shared by listing and every download thread so one host's 429s slow the
+    # whole process down instead of each thread discovering them separately.
+    global _drive_limiters
+    if _drive_limiters is None:
+        _drive_limiters = HostRateLimiters(
+            lambda: AdaptiveRateLimiter(
+                rate=settings.drive_rate_per_host,
+                min_rate=settings.drive_rate_min,
+                max_rate=settings.drive_rate_max,
+            )
+        )
+    return _drive_limiters
+
+
+def _drive_retry_policy(settings: Settings) -> RetryPolicy:
+    return RetryPolicy(
+        max_retries=max(0, settings.drive_max_retries),
+        base_seconds=settings.drive_backoff_base_seconds,
+        max_seconds=settings.drive_backoff_max_seconds,
+    )
+
+
+def _download_sync_image(
+    downloader: DriveDownloader, file_item: dict, *, settings: Settings, scope: str
+) -> tuple[bytes, bool]:
+    file_id = str(file_item.get("id") or "")
+    if settings.drive_download_mode == "rendition":
+        side = settings.drive_rendition_max_side
+        original = original_long_side(file_item)
+        # Without Drive's size metadata a short rendition could be a capped one,
+        # so only a full-size rendition is trusted.
+        content = downloader.download_rendition(
+            file_id, side, scope=scope, min_side=min(side, original) if original else side
+        )
+        if content is not None:
+            return content, True
+    return downloader.download(file_id, scope=scope), False
+
+
+def _analyze_drive_file(
+    *,
+    settings: Settings,
+    engine_pool: FaceEnginePool,
+    downloader: DriveDownloader,
+    event_id: str,
+    file_item: dict,
+    fetched: tuple[bytes, bool],
+) -> AnalyzedImage:
+    file_id = str(file_item.get("id") or "")
+    image_bytes, rendition = fetched
+    analyzed = _analyze_sync_image(
+        settings=settings, engine_pool=engine_pool, event_id=event_id, file_id=file_id, image_bytes=image_bytes
+    )
+    if not rendition:
+        return analyzed
+    analyzed.rendition = True
+    original = original_long_side(file_item)
+    retry_side = full_resolution_retry_side(settings.face_resize_max_side)
+    if analyzed.faces or not analyzed.small_faces or (original and original <= retry_side):
+        return analyzed
+    # The detector saw faces too small to keep at rendition scale; the original's
+    # full-resolution pass can still resolve them. Previews would be no sharper.
+    try:
+        image_bytes = downloader.download(file_id, scope=event_id, originals_only=True)
+    except RuntimeError as exc:
+        logger.info("Keeping rendition of Drive file %s; original unavailable: %s", file_id, exc)
+        return analyzed
+    retried = _analyze_sync_image(
+        settings=settings, engine_pool=engine_pool, event_id=event_id, file_id=file_id, image_bytes=image_bytes
+    )
+    retried.original_fallback = True
+    return retried
+
+
+def _analyze_sync_image(
+    *,
+    settings: Settings,
+    engine_pool: FaceEnginePool,
+    event_id: str,
+    file_id: str,
+    image_bytes: bytes,
+) -> AnalyzedImage:
+    with engine_pool.lease() as engine:
+        # One reduced-resolution decode feeds both the thumbnail and the detector.
+        decoded = engine.decode_image(image_bytes)
+        if decoded is None:
+            thumb_path = save_thumbnail(
+                settings=settings,
+                event_id=event_id,
+                drive_file_id=file_id,
+                image_bytes=image_bytes,
+                max_size=settings.thumbnail_max_size,
+            )
+            return AnalyzedImage(thumbnail_path=thumb_path, faces=[])
+        thumb_path = save_thumbnail_pixels(
+            settings=settings,
+            event_id=event_id,
+            drive_file_id=file_id,
+            pixels=decoded.pixels,
+            max_size=settings.thumbnail_max_size,
+        )
+        result = engine.analyze_faces_batch([decoded], max_faces=20)[0]
+    return AnalyzedImage(thumbnail_path=thumb_path, faces=result.faces, small_faces=result.small_faces)
+
+
+def _face_rows(*, event_id: str, photo_id: str, faces: list[FaceEmbedding]) -> list[Face]:
+    rows: list[Face] = []
+    for face_idx, face in enumerate(faces):
+        bx, by, bw, bh = face.bbox
+        rows.append(
+            Face(
+                event_id=event_id,
+                photo_id=photo_id,
+                face_index=face_idx,
+                embedding=face.embedding,
+                area_ratio=float(face.area_ratio),
+                det_confidence=float(face.det_confidence),
+                sharpness=float(face.sharpness),
+                bbox_x=float(bx),
+                bbox_y=float(by),
+                bbox_w=float(bw),
+                bbox_h=float(bh),
+                cluster_label=None,
+            )
+        )
+    return rows
+
+
 def _process_cluster_event(db: Session, job: Job, settings: Settings) -> None:
     if not job.event_id:
         mark_job_failed(db, job, "cluster_event job missing event_id")
@@ -392,19 +985,33 @@ def _process_cluster_event(db: Session, job: Job, settings: Settings) -> None:
         return
     mark_job_progress(db, job, progress_percent=96.0, stage="clustering_faces")
     upsert_job_payload(job, {"phase": "clustering"})
-    cluster_count = cluster_event_faces(
+    result = update_event_clusters(
         db,
         event_id=event.id,
         eps=settings.cluster_eps,
         min_samples=settings.cluster_min_samples,
+        drift_ratio=settings.cluster_drift_ratio,
+        full=bool((job.payload or {}).get("full")),
+        engine=settings.cluster_engine,
+        neighbors=settings.cluster_graph_neighbors,
     )
+    bump_embedding_version(db, event.id)
     event.status = "ready"
     db.add(event)
     mark_job_completed(
         db,
         job,
         stage="clustering_completed",
-        payload={"phase": "completed", "cluster_count": cluster_count},
+        payload={
+            "phase": "completed",
+            "cluster_count": result.cluster_count,
+            "mode": result.mode,
+            "assigned_faces": result.assigned,
+            "created_clusters": result.created,
+            "merged_clusters": result.merged,
+            "split_clusters": result.split,
+            "drift": None if result.drift == float("inf") else round(result.drift, 4),
+        },
     )
 
 
@@ -474,9 +1081,24 @@ def _process_match_guest(db: Session, job: Job, settings: Settings, face_engine:
         _cancel_match_job(db=db, job=job, query=query)
         return
 
+    engine = resolve_match_engine(db, settings.match_engine)
+    index = None
+    audited = engine == MATCH_ENGINE_CLUSTER and random.random() < float(settings.match_cluster_audit_rate)
+    if engine == MATCH_ENGINE_NUMPY or audited:
+        # A hot event is served from the process-local index until a sync or
+        # cluster job bumps the event's embedding version.
+        index = get_embedding_index_cache().get_or_load(db, event_id=event.id, version=int(event.embedding_version or 0))
     ranked_matches, used_threshold, adaptive_used = collect_ranked_photo_matches(
         db,
         event_id=event.id,
+        index=index,
+        engine=engine,
+        ann_top_k=settings.match_ann_top_k,
+        ann_ef_search=settings.match_ann_ef_search,
+        precision=settings.embedding_precision,
+        rerank_candidates=settings.match_rerank_candidates,
+        cluster_top_k=settings.match_cluster_top_k,
+        cluster_margin=settings.match_cluster_margin,
         selfie_embedding=selfie_embedding,
         threshold_percent=settings.face_similarity_threshold_percent,
         top_margin=settings.face_top_margin,
@@ -484,6 +1106,8 @@ def _process_match_guest(db: Session, job: Job, settings: Settings, face_engine:
         relax_min_threshold=settings.face_auto_relax_min_threshold,
         max_results=160,
     )
+    if audited:
+        upsert_job_payload(job, {"cluster_prune_audit": cluster_prune_stats.snapshot()})
     if not ranked_matches:
         query.status = "completed"
         query.cluster_id = None
@@ -597,7 +1221,7 @@ def _enqueue_auto_sync_jobs(db: Session, settings: Settings) -> int:
             .where(
                 Job.event_id == event.id,
                 Job.job_type.in_([JOB_SYNC_EVENT, JOB_CLUSTER_EVENT]),
-                Job.status.in_([JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_CANCEL_REQUESTED]),
+                Job.status.in_([JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_WAITING, JOB_STATUS_CANCEL_REQUESTED]),
             )
             .limit(1)
         ).scalar_one_or_none()
@@ -650,12 +1274,29 @@ def _run_cleanup(settings: Settings) -> None:
             query.selfie_path = ""
             db.add(query)
 
+        reclaimed = requeue_expired_jobs(
+            db,
+            lease_seconds=settings.job_lease_seconds,
+            max_attempts=settings.job_max_attempts,
+            backoff_seconds=settings.job_retry_backoff_seconds,
+        )
+        if reclaimed:
+            logger.info("Reclaimed %s job(s) with expired leases", len(reclaimed))
+
+        _delete_finished_listings(db)
+
         queued = _enqueue_auto_sync_jobs(db, settings)
         if queued > 0:
             logger.info("Auto-sync queued %s event(s)", queued)
         db.commit()
 
 
+def _delete_finished_listings(db: Session) -> None:
+    # Listings of syncs that ended without a finalize run (cancel, failure).
+    finished = select(Job.id).where(Job.status.in_([JOB_STATUS_CANCELED, JOB_STATUS_COMPLETED, JOB_STATUS_FAILED]))
+    db.execute(delete(SyncListingFile).where(SyncListingFile.job_id.in_(finished)))
+
+
 def _is_cancel_requested(db: Session, job_id: str) -> bool:
     state = db.execute(select(Job.status).where(Job.id == job_id).limit(1)).scalar_one_or_none()
     return state == JOB_STATUS_CANCEL_REQUESTED
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+from app.services import clustering
+from app.services.clustering import CLUSTER_ENGINE_DBSCAN, CLUSTER_ENGINE_GRAPH, cluster_labels
+
+
+def _synthetic_faces(faces: int, identities: int, dimension: int, noise: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((identities, dimension)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    owners = rng.integers(0, identities, size=faces)
+    vectors = centers[owners] + noise * rng.standard_normal((faces, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _run(vectors: np.ndarray, engine: str, args: argparse.Namespace) -> tuple[np.ndarray, float, float]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    labels = cluster_labels(
+        vectors, eps=args.eps, min_samples=args.min_samples, engine=engine, neighbors=args.neighbors
+    )
+    elapsed = time.perf_counter() - started
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return labels, elapsed, peak / (1024 * 1024)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Dense cosine DBSCAN vs sparse neighbor-graph clustering")
+    parser.add_argument("--sizes", default="10000,50000,200000")
+    parser.add_argument("--identities-per-1k", type=int, default=20)
+    parser.add_argument("--dimension", type=int, default=128)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--eps", type=float, default=0.32)
+    parser.add_argument("--min-samples", type=int, default=2)
+    parser.add_argument("--neighbors", type=int, default=32)
+    parser.add_argument(
+        "--dense-max-faces",
+        type=int,
+        default=50_000,
+        help="Skip dense DBSCAN above this size; its neighborhoods grow quadratically",
+    )
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    ann = "hnswlib" if clustering.hnswlib is not None else "brute kNN (install hnswlib for large sets)"
+    print(f"graph neighbors={args.neighbors} via {ann}; peak MB is tracemalloc (numpy/scipy allocations)")
+    print(f"{'faces':>8}  {'engine':<8}{'seconds':>10}{'peak MB':>10}{'clusters':>10}{'ARI':>8}")
+    for size in [int(item) for item in args.sizes.split(",") if item.strip()]:
+        identities = max(1, size * args.identities_per_1k // 1000)
+        vectors = _synthetic_faces(size, identities, args.dimension, args.noise, args.seed)
+        reference: np.ndarray | None = None
+        for engine in (CLUSTER_ENGINE_DBSCAN, CLUSTER_ENGINE_GRAPH):
+            if engine == CLUSTER_ENGINE_DBSCAN and size > args.dense_max_faces:
+                print(f"{size:>8}  {engine:<8}{'skipped':>10}")
+                continue
+            labels, seconds, peak_mb = _run(vectors, engine, args)
+            clusters = len(set(labels.tolist()) - {-1})
+            agreement = f"{adjusted_rand_score(reference, labels):.4f}" if reference is not None else "-"
+            print(f"{size:>8}  {engine:<8}{seconds:>10.2f}{peak_mb:>10.1f}{clusters:>10}{agreement:>8}")
+            if engine == CLUSTER_ENGINE_DBSCAN:
+                reference = labels
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.config import Settings
+from app.ml.backends import BACKEND_ONNXRUNTIME, BACKEND_OPENCV, load_inference_backend
+from app.ml.face_engine import SFACE_MODEL_FILE, YUNET_MODEL_FILE
+
+
+def _timed(fn, repeats: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) * 1000.0 / repeats
+
+
+def _load_image(path: str | None, side: int) -> np.ndarray:
+    if path:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise SystemExit(f"Could not read {path}")
+    else:
+        image = np.random.default_rng(0).integers(0, 255, size=(side * 3 // 4, side, 3), dtype=np.uint8)
+    long_side = max(image.shape[:2])
+    if long_side > side:
+        scale = side / long_side
+        image = cv2.resize(image, (int(image.shape[1] * scale), int(image.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="YuNet/SFace latency per inference backend")
+    parser.add_argument("--image", default=None, help="Photo to run; a synthetic frame is used when omitted")
+    parser.add_argument("--side", type=int, default=2200, help="Long side after resize (FACE_RESIZE_MAX_SIDE)")
+    parser.add_argument("--crops", type=int, default=32, help="Aligned faces per embedding batch")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    parser.add_argument("--graph-optimization", default="all")
+    parser.add_argument("--model-dir", default=None)
+    args = parser.parse_args()
+
+    base = Settings()
+    model_dir = Path(args.model_dir).expanduser() if args.model_dir else base.face_model_cache_dir_path
+    yunet_path, sface_path = model_dir / YUNET_MODEL_FILE, model_dir / SFACE_MODEL_FILE
+    if not yunet_path.exists() or not sface_path.exists():
+        raise SystemExit(f"YuNet/SFace models not found in {model_dir}; run the worker once to download them")
+
+    image = _load_image(args.image, args.side)
+    crops = [
+        np.random.default_rng(idx).integers(0, 255, size=(112, 112, 3), dtype=np.uint8) for idx in range(args.crops)
+    ]
+    print(
+        f"image={image.shape[1]}x{image.shape[0]} crops={args.crops} repeats={args.repeats} "
+        f"intra={args.intra_op_threads} inter={args.inter_op_threads} opt={args.graph_optimization}"
+    )
+    print(f"{'backend':<14}{'detect ms':>12}{'embed ms':>12}{'ms/face':>10}{'faces':>8}")
+    for name in (BACKEND_OPENCV, BACKEND_ONNXRUNTIME):
+        settings = Settings(
+            FACE_INFERENCE_BACKEND=name,
+            ORT_INTRA_OP_THREADS=args.intra_op_threads,
+            ORT_INTER_OP_THREADS=args.inter_op_threads,
+            ORT_GRAPH_OPTIMIZATION_LEVEL=args.graph_optimization,
+        )
+        backend = load_inference_backend(settings, yunet_path, sface_path)
+        if backend.name != name:
+            print(f"{name:<14}{'unavailable':>12}")
+            continue
+        faces = backend.detect(image)
+        detect_ms = _timed(lambda: backend.detect(image), args.repeats)
+        embed_ms = _timed(lambda: backend.embed(crops), args.repeats)
+        found = 0 if faces is None else len(faces)
+        print(f"{name:<14}{detect_ms:>12.2f}{embed_ms:>12.2f}{embed_ms / max(1, args.crops):>10.3f}{found:>8}")
+
+
+if __name__ == "__main__":
+    main()
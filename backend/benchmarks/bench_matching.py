@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import argparse
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from app.services.matching import build_embedding_index, cosine_similarity, cosine_to_percent, score_photos
+
+
+def _synthetic_rows(faces: int, dimension: int, faces_per_photo: int, seed: int) -> list[tuple[str, list[float]]]:
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((faces, dimension)).astype(np.float32)
+    return [(f"photo-{idx // faces_per_photo:06d}", vectors[idx].tolist()) for idx in range(faces)]
+
+
+def _loop_scores(rows: list[tuple[str, list[float]]], selfie: list[float]) -> dict[str, float]:
+    best: dict[str, float] = defaultdict(float)
+    for photo_id, embedding in rows:
+        percent = cosine_to_percent(cosine_similarity(selfie, embedding))
+        if percent > best[photo_id]:
+            best[photo_id] = percent
+    return best
+
+
+def _timed(fn, repeats: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / max(1, repeats)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare per-row cosine loop with matrix search for guest matching")
+    parser.add_argument("--faces", type=int, default=40_000)
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--faces-per-photo", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rows = _synthetic_rows(args.faces, args.dimension, args.faces_per_photo, args.seed)
+    selfie = np.random.default_rng(args.seed + 1).standard_normal(args.dimension).astype(np.float32).tolist()
+
+    build_started = time.perf_counter()
+    index = build_embedding_index(rows)
+    build_seconds = time.perf_counter() - build_started
+
+    loop_seconds = _timed(lambda: _loop_scores(rows, selfie), args.repeats)
+    matrix_seconds = _timed(lambda: score_photos(index, selfie), args.repeats)
+
+    expected = _loop_scores(rows, selfie)
+    actual = dict(score_photos(index, selfie))
+    max_error = max(abs(expected[photo_id] - actual[photo_id]) for photo_id in expected)
+
+    print(f"faces={args.faces} dim={args.dimension} photos={len(index.photo_ids)}")
+    print(f"index build:   {build_seconds * 1000:9.1f} ms ({index.nbytes / 1e6:.1f} MB)")
+    print(f"python loop:   {loop_seconds * 1000:9.1f} ms/query")
+    print(f"matrix search: {matrix_seconds * 1000:9.1f} ms/query")
+    print(f"speedup:       {loop_seconds / max(matrix_seconds, 1e-9):9.1f}x (max percent diff {max_error:.2e})")
+
+
+if __name__ == "__main__":
+    main()
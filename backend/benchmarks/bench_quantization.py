@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+
+from app.services.matching import (
+    EMBEDDING_PRECISION_FLOAT16,
+    EMBEDDING_PRECISION_FLOAT32,
+    EMBEDDING_PRECISION_INT8,
+    build_embedding_index,
+    rank_photo_candidates,
+    score_photos,
+)
+
+
+def _synthetic_event(
+    identities: int, faces: int, dimension: int, noise: float, seed: int
+) -> tuple[np.ndarray, list[tuple[str, list[float]]], list[str]]:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((identities, dimension)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    owners = rng.integers(0, identities, size=faces)
+    vectors = centers[owners] + noise * rng.standard_normal((faces, dimension)).astype(np.float32)
+    rows = [(f"photo-{idx // 3:06d}", vectors[idx].tolist()) for idx in range(faces)]
+    face_ids = [f"face-{idx:07d}" for idx in range(faces)]
+    return centers, rows, face_ids
+
+
+def _decisions(candidates: list[tuple[str, float]]) -> set[str]:
+    ranked, _threshold, _adaptive = rank_photo_candidates(
+        candidates,
+        threshold_percent=90.0,
+        top_margin=8.0,
+        relax_drop=8.0,
+        relax_min_threshold=78.0,
+        max_results=160,
+    )
+    return {item.photo_id for item in ranked}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recall of quantized match indexes against the float32 path")
+    parser.add_argument("--faces", type=int, default=40_000)
+    parser.add_argument("--identities", type=int, default=400)
+    parser.add_argument("--dimension", type=int, default=128)
+    parser.add_argument("--noise", type=float, default=0.06)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--rerank", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    centers, rows, face_ids = _synthetic_event(args.identities, args.faces, args.dimension, args.noise, args.seed)
+    exact_by_face = {face_id: row[1] for face_id, row in zip(face_ids, rows)}
+
+    def lookup(ids: list[str]) -> dict[str, list[float]]:
+        return {face_id: exact_by_face[face_id] for face_id in ids}
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [
+        (centers[int(rng.integers(0, args.identities))] + args.noise * rng.standard_normal(args.dimension)).tolist()
+        for _ in range(args.queries)
+    ]
+
+    baseline = build_embedding_index(rows, face_ids=face_ids)
+    reference = [score_photos(baseline, query) for query in queries]
+    print(f"faces={args.faces} dim={args.dimension} queries={args.queries} top_k={args.top_k}")
+    print(f"{'mode':<18}{'index MB':>10}{'ms/query':>10}{'recall@k':>10}{'decisions':>11}")
+
+    modes = [
+        (EMBEDDING_PRECISION_FLOAT32, 0),
+        (EMBEDDING_PRECISION_FLOAT16, 0),
+        (EMBEDDING_PRECISION_FLOAT16, args.rerank),
+        (EMBEDDING_PRECISION_INT8, 0),
+        (EMBEDDING_PRECISION_INT8, args.rerank),
+    ]
+    for precision, rerank in modes:
+        index = build_embedding_index(rows, face_ids=face_ids, precision=precision)
+        recall_total = 0.0
+        agree = 0
+        started = time.perf_counter()
+        results = [
+            score_photos(index, query, exact_lookup=lookup if rerank else None, rerank_candidates=max(1, rerank))
+            for query in queries
+        ]
+        elapsed = (time.perf_counter() - started) / max(1, len(queries))
+        for expected, actual in zip(reference, results):
+            expected_top = {photo_id for photo_id, _ in expected[: args.top_k]}
+            actual_top = {photo_id for photo_id, _ in actual[: args.top_k]}
+            recall_total += len(expected_top & actual_top) / max(1, len(expected_top))
+            agree += int(_decisions(expected) == _decisions(actual))
+        label = precision + (f"+rerank{rerank}" if rerank else "")
+        print(
+            f"{label:<18}{index.nbytes / 1e6:>10.2f}{elapsed * 1000:>10.1f}"
+            f"{recall_total / len(queries):>10.4f}{agree / len(queries):>11.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import os
-from collections.abc import Generator
+import threading
+from collections.abc import Callable, Generator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
@@ -13,6 +16,7 @@ from sqlalchemy.pool import StaticPool
 from app.config import Settings, get_settings, reload_settings
 from app.db import Base, get_db
 from app.main import create_app
+from app.ml.face_engine import SFACE_MODEL_FILE, YUNET_MODEL_FILE
 
 
 @pytest.fixture()
@@ -71,3 +75,101 @@ def client(db_engine, test_settings: Settings) -> Generator[TestClient, None, No
 
     with TestClient(app) as test_client:
         yield test_client
+
+
+@pytest.fixture()
+def fake_face_models(tmp_path: Path) -> tuple[Path, Path]:
+    # Tiny graphs with the YuNet/SFace input and output contracts, so both
+    # backends can be compared without downloading the real weights.
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    nodes, weights, outputs = [], [], []
+    for stride in (8, 16, 32):
+        nodes.append(
+            helper.make_node("AveragePool", ["input"], [f"pool_{stride}"], kernel_shape=[stride, stride], strides=[stride, stride])
+        )
+        for kind, channels in (("cls", 1), ("obj", 1), ("bbox", 4), ("kps", 10)):
+            name = f"{kind}_{stride}"
+            weights += [
+                numpy_helper.from_array((rng.standard_normal((channels, 3, 1, 1)) * 0.02).astype(np.float32), f"w_{name}"),
+                numpy_helper.from_array((rng.standard_normal(channels) * 0.5).astype(np.float32), f"b_{name}"),
+                numpy_helper.from_array(np.array([1, -1, channels], dtype=np.int64), f"shape_{name}"),
+            ]
+            head = name if kind in ("bbox", "kps") else f"{name}_logits"
+            nodes += [
+                helper.make_node("Conv", [f"pool_{stride}", f"w_{name}", f"b_{name}"], [f"conv_{name}"], kernel_shape=[1, 1]),
+                helper.make_node("Transpose", [f"conv_{name}"], [f"nhwc_{name}"], perm=[0, 2, 3, 1]),
+                helper.make_node("Reshape", [f"nhwc_{name}", f"shape_{name}"], [head]),
+            ]
+            if head != name:
+                nodes.append(helper.make_node("Sigmoid", [head], [name]))
+            outputs.append(helper.make_tensor_value_info(name, TensorProto.FLOAT, [1, f"anchors_{stride}", channels]))
+    yunet = helper.make_graph(
+        nodes, "yunet", [helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, 3, "h", "w"])], outputs, weights
+    )
+
+    sface = helper.make_graph(
+        [
+            helper.make_node("Conv", ["data", "conv_w"], ["conv"], kernel_shape=[8, 8], strides=[8, 8]),
+            helper.make_node("Flatten", ["conv"], ["flat"], axis=1),
+            helper.make_node("MatMul", ["flat", "fc_w"], ["fc1"]),
+        ],
+        "sface",
+        [helper.make_tensor_value_info("data", TensorProto.FLOAT, ["n", 3, 112, 112])],
+        [helper.make_tensor_value_info("fc1", TensorProto.FLOAT, ["n", 128])],
+        [
+            numpy_helper.from_array((rng.standard_normal((8, 3, 8, 8)) * 0.01).astype(np.float32), "conv_w"),
+            numpy_helper.from_array((rng.standard_normal((8 * 14 * 14, 128)) * 0.05).astype(np.float32), "fc_w"),
+        ],
+    )
+    model_dir = tmp_path / "models"
+    model_dir.mkdir()
+    paths = (model_dir / YUNET_MODEL_FILE, model_dir / SFACE_MODEL_FILE)
+    for graph, path in zip((yunet, sface), paths):
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+        model.ir_version = 8
+        onnx.save(model, str(path))
+    return paths
+
+
+class DriveStandIn:
+    def __init__(self) -> None:
+        self.hits: list[tuple[str, int]] = []
+        self.respond: Callable[[str], tuple[int, dict[str, str], bytes]] = lambda _path: (404, {}, b"")
+        self.url = ""
+
+
+@pytest.fixture()
+def drive_server() -> Generator[DriveStandIn, None, None]:
+    # Local HTTP/1.1 stand-in for Drive; tests set ``respond`` per path and read
+    # ``hits`` as (path, client port) to see which URLs and connections were used.
+    stand_in = DriveStandIn()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:  # noqa: N802
+            stand_in.hits.append((self.path, self.client_address[1]))
+            status_code, headers, body = stand_in.respond(self.path)
+            self.send_response(status_code)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stand_in.url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        yield stand_in
+    finally:
+        server.shutdown()
+        server.server_close()
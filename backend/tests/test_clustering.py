@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import numpy as np
+from sqlalchemy import select
+
+from app.models import Event, Face, FaceCluster, Photo
+from app.services.clustering import (
+    CLUSTER_MODE_FULL,
+    CLUSTER_MODE_INCREMENTAL,
+    summarize_clusters,
+    update_event_clusters,
+)
+from app.services.matching import (
+    ClusterPruneStats,
+    audit_cluster_pruning,
+    load_event_embedding_index,
+    score_photos,
+    search_photos_by_cluster,
+)
+
+EPS = 0.32
+MIN_SAMPLES = 2
+
+
+def _identities(count: int, dimension: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((count, dimension)).astype(np.float32)
+    return centers / np.linalg.norm(centers, axis=1, keepdims=True)
+
+
+def _add_faces(db, event: Event, vectors: np.ndarray, prefix: str) -> list[Face]:
+    faces: list[Face] = []
+    for idx, vector in enumerate(vectors):
+        photo = Photo(
+            event_id=event.id,
+            drive_file_id=f"{prefix}-{idx}",
+            file_name=f"{prefix}-{idx}.jpg",
+            mime_type="image/jpeg",
+            web_view_link="",
+            preview_url="",
+            download_url="",
+            thumbnail_path="",
+            content_stamp="s",
+        )
+        db.add(photo)
+        db.flush()
+        face = Face(event_id=event.id, photo_id=photo.id, face_index=0, embedding=vector.tolist())
+        db.add(face)
+        faces.append(face)
+    db.flush()
+    return faces
+
+
+def _samples(centers: np.ndarray, owners: list[int], noise: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    vectors = centers[owners] + noise * rng.standard_normal((len(owners), centers.shape[1])).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _cluster(db, event: Event, drift_ratio: float = 0.5, full: bool = False):
+    return update_event_clusters(
+        db, event_id=event.id, eps=EPS, min_samples=MIN_SAMPLES, drift_ratio=drift_ratio, full=full
+    )
+
+
+def test_incremental_clustering_assigns_new_faces_and_creates_clusters(db_session) -> None:
+    dimension = Face.embedding.type.dimension
+    centers = _identities(5, dimension, seed=1)
+    event = Event(name="E", slug="incremental", drive_link="x", drive_folder_id="f", guest_code_hash="g", admin_token_hash="a")
+    db_session.add(event)
+    db_session.flush()
+
+    initial = _add_faces(db_session, event, _samples(centers, [0, 1, 2, 3] * 10, 0.05, seed=2), "first")
+    first = _cluster(db_session, event)
+    assert first.mode == CLUSTER_MODE_FULL
+    assert first.cluster_count == 4
+    labels_by_identity = {owner: face.cluster_label for owner, face in zip([0, 1, 2, 3] * 10, initial)}
+
+    added_owners = [0, 1, 4, 4, 4]
+    added = _add_faces(db_session, event, _samples(centers, added_owners, 0.05, seed=3), "second")
+    second = _cluster(db_session, event)
+    assert second.mode == CLUSTER_MODE_INCREMENTAL
+    assert second.assigned == 2
+    assert second.created == 1
+    assert second.cluster_count == 5
+    assert added[0].cluster_label == labels_by_identity[0]
+    assert added[1].cluster_label == labels_by_identity[1]
+    assert len({face.cluster_label for face in added[2:]}) == 1
+    assert added[2].cluster_label not in labels_by_identity.values()
+    assert all(face.clustered for face in added)
+
+    counts = dict(
+        db_session.execute(
+            select(FaceCluster.cluster_label, FaceCluster.face_count).where(FaceCluster.event_id == event.id)
+        ).all()
+    )
+    assert counts[labels_by_identity[0]] == 11
+    assert counts[added[2].cluster_label] == 3
+
+
+def test_drift_past_threshold_runs_full_recluster(db_session) -> None:
+    dimension = Face.embedding.type.dimension
+    centers = _identities(3, dimension, seed=4)
+    event = Event(name="E", slug="drift", drive_link="x", drive_folder_id="f", guest_code_hash="g", admin_token_hash="a")
+    db_session.add(event)
+    db_session.flush()
+
+    _add_faces(db_session, event, _samples(centers, [0, 1] * 5, 0.05, seed=5), "first")
+    assert _cluster(db_session, event).mode == CLUSTER_MODE_FULL
+    assert event.cluster_baseline_faces == 10
+
+    _add_faces(db_session, event, _samples(centers, [2] * 6, 0.05, seed=6), "second")
+    result = _cluster(db_session, event, drift_ratio=0.5)
+    assert result.mode == CLUSTER_MODE_FULL
+    assert result.drift > 0.5
+    assert result.cluster_count == 3
+    assert event.cluster_baseline_faces == 16
+    assert event.cluster_incremental_faces == 0
+
+    assert _cluster(db_session, event, full=True).mode == CLUSTER_MODE_FULL
+
+
+def test_incremental_merge_joins_clusters_bridged_by_new_faces(db_session) -> None:
+    dimension = Face.embedding.type.dimension
+    base = _identities(1, dimension, seed=7)[0]
+    offset = _identities(1, dimension, seed=8)[0]
+    offset -= base * float(offset @ base)
+    offset /= np.linalg.norm(offset)
+    event = Event(name="E", slug="merge", drive_link="x", drive_folder_id="f", guest_code_hash="g", admin_token_hash="a")
+    db_session.add(event)
+    db_session.flush()
+
+    def at(angle: float, count: int) -> np.ndarray:
+        vector = np.cos(angle) * base + np.sin(angle) * offset
+        return np.repeat(vector[None, :], count, axis=0).astype(np.float32)
+
+    # Two groups ~0.9 rad apart are separate clusters; photos halfway between
+    # are within eps of both and chain them, as a full DBSCAN would.
+    left = _add_faces(db_session, event, at(0.0, 3), "left")
+    right = _add_faces(db_session, event, at(0.9, 3), "right")
+    assert _cluster(db_session, event).cluster_count == 2
+
+    bridge = _add_faces(db_session, event, at(0.45, 2), "bridge")
+    result = _cluster(db_session, event, drift_ratio=10.0)
+    assert result.mode == CLUSTER_MODE_INCREMENTAL
+    assert result.merged == 1
+    assert result.cluster_count == 1
+    assert len({face.cluster_label for face in left + right + bridge}) == 1
+
+
+def test_graph_engine_matches_dense_dbscan(monkeypatch) -> None:
+    from sklearn.metrics import adjusted_rand_score
+
+    import app.services.clustering as clustering
+
+    centers = _identities(40, 128, seed=9)
+    rng = np.random.default_rng(10)
+    owners = rng.integers(0, 40, size=1500).tolist()
+    vectors = _samples(centers, owners, 0.04, seed=11)
+    vectors = np.vstack([vectors, vectors[:5]])
+    dense = clustering.cluster_labels(vectors, eps=EPS, min_samples=MIN_SAMPLES)
+    graph = clustering.cluster_labels(vectors, eps=EPS, min_samples=MIN_SAMPLES, engine="graph", neighbors=80)
+    assert adjusted_rand_score(dense, graph) == 1.0
+    assert set(graph.tolist()) - {-1}
+
+    if clustering.hnswlib is not None:
+        monkeypatch.setattr(clustering, "GRAPH_EXACT_MAX_FACES", 0)
+        approximate = clustering.cluster_labels(vectors, eps=EPS, min_samples=MIN_SAMPLES, engine="graph", neighbors=80)
+        assert adjusted_rand_score(dense, approximate) > 0.99
+
+
+def test_summarize_clusters_matches_per_cluster_reference() -> None:
+    rng = np.random.default_rng(5)
+    vectors = rng.standard_normal((40, 16)).astype(np.float32)
+    labels = rng.integers(-1, 4, size=40)
+    photo_ids = [f"p{value}" for value in rng.integers(0, 6, size=40)]
+
+    summaries = {item["cluster_label"]: item for item in summarize_clusters(labels, vectors, photo_ids)}
+
+    assert sorted(summaries) == sorted(set(labels.tolist()) - {-1})
+    for label, summary in summaries.items():
+        rows = np.flatnonzero(labels == label)
+        centroid = vectors[rows].sum(axis=0)
+        centroid /= np.linalg.norm(centroid)
+        counts: dict[str, int] = {}
+        for row in rows:
+            counts[photo_ids[row]] = counts.get(photo_ids[row], 0) + 1
+        cover = min(counts, key=lambda photo: (-counts[photo], photo))
+        assert summary["face_count"] == len(rows)
+        assert summary["cover_photo_id"] == cover
+        assert np.allclose(summary["centroid"], centroid, atol=1e-5)
+
+
+def test_full_recluster_bulk_writes_labels_and_clusters(db_session) -> None:
+    event = Event(name="E", slug="bulk", drive_link="x", drive_folder_id="f", guest_code_hash="g", admin_token_hash="a")
+    db_session.add(event)
+    db_session.flush()
+    centers = _identities(3, Face.embedding.type.dimension, seed=21)
+    faces = _add_faces(db_session, event, _samples(centers, [0] * 5 + [1] * 5 + [2] * 5, 0.02, seed=22), "b")
+
+    result = _cluster(db_session, event, full=True)
+
+    assert result.cluster_count == 3
+    assert all(face.clustered for face in faces)
+    groups = {face.cluster_label for face in faces[:5]}, {face.cluster_label for face in faces[5:10]}
+    assert all(len(group) == 1 for group in groups) and groups[0] != groups[1]
+    clusters = db_session.execute(select(FaceCluster).where(FaceCluster.event_id == event.id)).scalars().all()
+    assert sorted(cluster.face_count for cluster in clusters) == [5, 5, 5]
+    assert all(cluster.id and cluster.created_at for cluster in clusters)
+
+
+def test_cluster_first_search_matches_exhaustive_scan(db_session) -> None:
+    dimension = Face.embedding.type.dimension
+    event = Event(name="E", slug="two-stage", drive_link="x", drive_folder_id="f", guest_code_hash="g", admin_token_hash="a")
+    db_session.add(event)
+    db_session.flush()
+    centers = _identities(6, dimension, seed=31)
+    _add_faces(db_session, event, _samples(centers, list(range(6)) * 6, 0.05, seed=32), "c")
+    _cluster(db_session, event, full=True)
+    _add_faces(db_session, event, _samples(centers, [2], 0.05, seed=33), "late")
+    selfie = _samples(centers, [2], 0.05, seed=34)[0].tolist()
+
+    exhaustive = score_photos(load_event_embedding_index(db_session, event.id), selfie)
+    pruned = search_photos_by_cluster(db_session, event_id=event.id, selfie_embedding=selfie, top_k=1, margin=0.0)
+
+    assert pruned is not None
+    assert len(pruned) == 7
+    assert sorted(pruned) == sorted(exhaustive[:7])
+    stats = ClusterPruneStats()
+    assert audit_cluster_pruning(load_event_embedding_index(db_session, event.id), selfie, pruned, stats) is False
+    assert audit_cluster_pruning(load_event_embedding_index(db_session, event.id), selfie, [], stats) is True
+    assert stats.snapshot() == {"audited": 2, "missed": 1, "miss_rate": 0.5}
+
+
+def test_cluster_first_search_needs_clusters(db_session) -> None:
+    event = Event(name="E", slug="unclustered", drive_link="x", drive_folder_id="f", guest_code_hash="g", admin_token_hash="a")
+    db_session.add(event)
+    db_session.flush()
+    selfie = _identities(1, Face.embedding.type.dimension, seed=35)[0].tolist()
+    assert search_photos_by_cluster(db_session, event_id=event.id, selfie_embedding=selfie, top_k=4, margin=0.1) is None
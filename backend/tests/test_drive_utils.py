@@ -1,6 +1,31 @@
 from __future__ import annotations
 
-from app.utils.drive import build_content_stamp, extract_drive_folder_id
+import io
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from app.utils import drive
+from app.utils.drive import (
+    DRIVE_FOLDER_MIME,
+    DriveDownloader,
+    build_content_stamp,
+    extract_drive_folder_id,
+    image_long_side,
+    iter_public_drive_images,
+    list_public_drive_images,
+    original_long_side,
+)
+from app.utils.rate_limit import AdaptiveRateLimiter, HostRateLimiters, RetryPolicy, parse_retry_after
+
+
+def _jpeg(size: int = 400) -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise((size, size), 64).convert("RGB").save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
 
 
 def test_extract_drive_folder_id_from_raw_id() -> None:
@@ -21,3 +46,264 @@ def test_build_content_stamp_stable() -> None:
     item = {"modifiedTime": "2026-01-01T12:00:00Z", "size": "1111", "name": "img.jpg"}
     assert build_content_stamp(item) == "2026-01-01T12:00:00Z|1111|img.jpg"
 
+
+def _serve_images(drive_server, image: bytes) -> list[str]:
+    def respond(path: str):
+        if path.startswith("/media/"):
+            return 403, {"Content-Type": "application/json"}, b'{"error": "quota"}'
+        if path.startswith("/scan/"):
+            return 200, {"Content-Type": "application/octet-stream"}, b"<!DOCTYPE html><html>" + b" " * 4096
+        if path.startswith("/image/"):
+            return 200, {"Content-Type": "image/jpeg"}, image
+        return 404, {}, b""
+
+    drive_server.respond = respond
+    return [f"{drive_server.url}/{prefix}/{{file_id}}?key={{api_key}}" for prefix in ("media", "scan", "image")]
+
+
+def test_downloader_remembers_strategy_and_reuses_connections(drive_server) -> None:
+    image = _jpeg()
+    templates = _serve_images(drive_server, image)
+
+    with DriveDownloader("k", url_templates=templates, http2=False) as downloader:
+        assert downloader.download("file-a", scope="event-1") == image
+        assert downloader.preferred_strategy("event-1") == 2
+        first_pass = len(drive_server.hits)
+        assert downloader.download("file-b", scope="event-1") == image
+        assert downloader.download("file-c", scope="event-2") == image
+
+    assert first_pass == 3
+    assert [path.split("/")[1] for path, _port in drive_server.hits[first_pass:]] == ["image", "media", "scan", "image"]
+    assert len({port for _path, port in drive_server.hits}) == 1
+
+
+def test_preview_fallback_never_displaces_original_routes(drive_server) -> None:
+    original, preview = _jpeg(600), _jpeg(200)
+    originals_up = False
+
+    def respond(path: str):
+        if path.startswith("/media/") and originals_up:
+            return 200, {"Content-Type": "image/jpeg"}, original
+        if path.startswith("/thumbnail/"):
+            return 200, {"Content-Type": "image/jpeg"}, preview
+        return 404, {}, b""
+
+    drive_server.respond = respond
+    templates = [f"{drive_server.url}/{prefix}/{{file_id}}" for prefix in ("media", "uc")]
+    previews = [f"{drive_server.url}/thumbnail/{{file_id}}"]
+
+    with DriveDownloader("k", url_templates=templates, preview_templates=previews, http2=False) as downloader:
+        # One transient miss on every original route falls back to the preview...
+        assert downloader.download("file-a", scope="event-1") == preview
+        assert downloader.preferred_strategy("event-1") is None
+        originals_up = True
+        # ...but the next file still goes to the original first.
+        assert downloader.download("file-b", scope="event-1") == original
+
+    assert [path for path, _port in drive_server.hits] == [
+        "/media/file-a",
+        "/uc/file-a",
+        "/thumbnail/file-a",
+        "/media/file-b",
+    ]
+
+
+def test_downloader_reuses_buffer_across_sizes(drive_server) -> None:
+    large, small = _jpeg(600), _jpeg(100)
+    templates = _serve_images(drive_server, large)
+    with DriveDownloader("k", url_templates=templates[2:], http2=False) as downloader:
+        assert downloader.download("big") == large
+        drive_server.respond = lambda _path: (200, {"Content-Type": "image/jpeg"}, small)
+        assert downloader.download("small") == small
+
+
+def test_downloader_raises_when_every_strategy_fails(drive_server) -> None:
+    templates = _serve_images(drive_server, b"")
+    with DriveDownloader("k", url_templates=templates[:2], preview_templates=[], http2=False) as downloader:
+        try:
+            downloader.download("missing")
+        except RuntimeError as exc:
+            assert "missing" in str(exc)
+        else:
+            raise AssertionError("expected RuntimeError")
+
+
+def _limiters() -> HostRateLimiters:
+    return HostRateLimiters(lambda: AdaptiveRateLimiter(rate=20, min_rate=1, max_rate=40))
+
+
+def test_downloader_honours_retry_after_and_slows_the_host(drive_server) -> None:
+    image = _jpeg()
+    replies = iter([(429, {"Retry-After": "1"}, b"slow down"), (200, {"Content-Type": "image/jpeg"}, image)])
+    drive_server.respond = lambda _path: next(replies)
+    limiters = _limiters()
+    retry = RetryPolicy(max_retries=2, base_seconds=0.01, max_seconds=2)
+
+    templates = [f"{drive_server.url}/media/{{file_id}}"]
+    with DriveDownloader("k", url_templates=templates, limiters=limiters, retry=retry) as downloader:
+        assert downloader.download("file-a") == image
+
+    assert [path for path, _port in drive_server.hits] == ["/media/file-a", "/media/file-a"]
+    stats = limiters.snapshot()[drive_server.url.removeprefix("http://")]
+    assert stats["throttle_events"] == 1
+    assert stats["requests"] == 2
+    assert stats["rate_limit"] < 20
+
+
+def test_downloader_moves_past_anti_bot_page_without_retrying(drive_server) -> None:
+    image = _jpeg()
+
+    def respond(path: str):
+        if path.startswith("/media/"):
+            return 403, {"Content-Type": "text/html"}, b"<html>Our systems have detected unusual traffic</html>"
+        return 200, {"Content-Type": "image/jpeg"}, image
+
+    drive_server.respond = respond
+    templates = [f"{drive_server.url}/media/{{file_id}}", f"{drive_server.url}/image/{{file_id}}"]
+    retry = RetryPolicy(base_seconds=0.01)
+    with DriveDownloader("k", url_templates=templates, limiters=_limiters(), retry=retry) as downloader:
+        assert downloader.download("file-a") == image
+    assert [path.split("/")[1] for path, _port in drive_server.hits] == ["media", "image"]
+
+
+def test_listing_retries_unavailable_pages(drive_server, monkeypatch) -> None:
+    listing = {"files": [{"id": "photo-1", "name": "a.jpg", "mimeType": "image/jpeg"}]}
+    replies = iter(
+        [(503, {}, b"backend error"), (200, {"Content-Type": "application/json"}, json.dumps(listing).encode())]
+    )
+    drive_server.respond = lambda _path: next(replies)
+    monkeypatch.setattr(drive, "DRIVE_LIST_URL", f"{drive_server.url}/files")
+
+    retry = RetryPolicy(base_seconds=0.01)
+    files = list_public_drive_images("k", "folder-1234567", 0, limiters=_limiters(), retry=retry)
+
+    assert [item["id"] for item in files] == ["photo-1"]
+    assert len(drive_server.hits) == 2
+
+
+def test_rate_limiter_backs_off_once_per_round_trip_and_recovers() -> None:
+    now = [0.0]
+    slept: list[float] = []
+
+    def sleep(seconds: float) -> None:
+        slept.append(seconds)
+        now[0] += seconds
+
+    limiter = AdaptiveRateLimiter(rate=8, min_rate=1, max_rate=10, clock=lambda: now[0], sleep=sleep)
+    for _ in range(8):
+        limiter.acquire()
+    assert slept == []
+
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.rate == 4
+    limiter.acquire()
+    assert sum(slept) == 0.25
+
+    for _ in range(40):
+        limiter.on_success()
+    assert 4 < limiter.rate <= 10
+    assert limiter.snapshot()["throttle_events"] == 2
+
+    limiter.on_throttle(retry_after=5)
+    limiter.acquire()
+    assert now[0] >= 5.25
+
+
+def test_parse_retry_after_accepts_seconds_and_dates() -> None:
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("") is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:05 GMT") == 0.0
+
+
+def _serve_folders(drive_server, monkeypatch, tree: dict[str, list[dict]], on_list=None) -> None:
+    def respond(path: str):
+        parent = parse_qs(urlparse(path).query)["q"][0].split("'")[1]
+        if on_list:
+            on_list(parent)
+        return 200, {"Content-Type": "application/json"}, json.dumps({"files": tree.get(parent, [])}).encode()
+
+    drive_server.respond = respond
+    monkeypatch.setattr(drive, "DRIVE_LIST_URL", f"{drive_server.url}/files")
+
+
+def _folder_tree(segments: int) -> dict[str, list[dict]]:
+    tree = {"root-folder": [{"id": "cover", "mimeType": "image/jpeg"}]}
+    for index in range(segments):
+        tree["root-folder"].append({"id": f"segment-{index}", "mimeType": DRIVE_FOLDER_MIME})
+        tree[f"segment-{index}"] = [{"id": f"photo-{index}-{n}", "mimeType": "image/jpeg"} for n in range(3)]
+    return tree
+
+
+def test_listing_walks_sibling_folders_concurrently(drive_server, monkeypatch) -> None:
+    lock = threading.Lock()
+    active, peak = [0], [0]
+
+    def on_list(_parent: str) -> None:
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.1)
+        with lock:
+            active[0] -= 1
+
+    _serve_folders(drive_server, monkeypatch, _folder_tree(6), on_list)
+    files = list_public_drive_images("k", "root-folder", 0, workers=3)
+
+    assert len(files) == 1 + 6 * 3
+    assert len({item["id"] for item in files}) == len(files)
+    assert 2 <= peak[0] <= 3
+    limited = list_public_drive_images("k", "root-folder", 5, workers=3)
+    assert len(limited) == 5 and limited[0]["id"] == "cover"
+
+
+def test_listing_streams_files_before_subfolders_finish(drive_server, monkeypatch) -> None:
+    release = threading.Event()
+
+    def on_list(parent: str) -> None:
+        if parent != "root-folder":
+            release.wait(5)
+
+    _serve_folders(drive_server, monkeypatch, _folder_tree(2), on_list)
+    listing = iter_public_drive_images("k", "root-folder", 0, workers=2)
+
+    assert next(listing)["id"] == "cover"
+    release.set()
+    assert sorted(item["id"] for item in listing) == [f"photo-{i}-{n}" for i in range(2) for n in range(3)]
+
+
+def test_delta_listing_filters_images_but_still_walks_folders(drive_server, monkeypatch) -> None:
+    queries: list[str] = []
+    _serve_folders(drive_server, monkeypatch, _folder_tree(2), lambda _parent: None)
+    respond = drive_server.respond
+
+    def recording(path: str):
+        queries.append(parse_qs(urlparse(path).query)["q"][0])
+        return respond(path)
+
+    drive_server.respond = recording
+    list_public_drive_images("k", "root-folder", 0, modified_after="2026-03-01T00:00:00Z")
+
+    assert len(queries) == 3
+    assert all(
+        "(modifiedTime > '2026-03-01T00:00:00Z' or createdTime > '2026-03-01T00:00:00Z')" in query for query in queries
+    )
+    assert all(f"mimeType = '{DRIVE_FOLDER_MIME}'" in query for query in queries)
+
+
+def test_rendition_is_sized_server_side_and_checked_for_resolution(drive_server) -> None:
+    rendition = _jpeg(600)
+    drive_server.respond = lambda _path: (200, {"Content-Type": "image/jpeg"}, rendition)
+    templates = [f"{drive_server.url}/rendition/{{file_id}}=s{{side}}"]
+
+    with DriveDownloader("k", url_templates=[], rendition_templates=templates, http2=False) as downloader:
+        assert downloader.download_rendition("file-a", 600, scope="event-1", min_side=600) == rendition
+        assert downloader.preferred_strategy("event-1", rendition=True) == 0
+        assert downloader.preferred_strategy("event-1") is None
+        assert downloader.download_rendition("file-b", 2200, min_side=2200) is None
+
+    assert [path for path, _port in drive_server.hits] == ["/rendition/file-a=s600", "/rendition/file-b=s2200"]
+    assert image_long_side(rendition) == 600
+    assert original_long_side({"imageMediaMetadata": {"width": 6000, "height": 4000}}) == 6000
+    assert original_long_side({}) == 0
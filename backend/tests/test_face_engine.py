@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from app.config import Settings
+from app.ml.backends import OnnxRuntimeBackend, OpenCVBackend, align_face
+from app.ml.face_engine import SFACE_MODEL_FILE, YUNET_MODEL_FILE, FaceEngine
+
+
+class _StubRecognizer:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def feature(self, crop: np.ndarray) -> np.ndarray:
+        self.calls += 1
+        return crop.astype(np.float32).mean(axis=(0, 1)).reshape(1, -1)
+
+
+class _StubNet:
+    def __init__(self) -> None:
+        self.batches: list[int] = []
+        self._blob: np.ndarray | None = None
+
+    def setInput(self, blob: np.ndarray) -> None:
+        self._blob = blob
+
+    def forward(self) -> np.ndarray:
+        assert self._blob is not None
+        self.batches.append(int(self._blob.shape[0]))
+        # blobFromImages swaps to RGB/NCHW; undo it so the stub matches the recognizer.
+        return self._blob[:, ::-1].mean(axis=(2, 3))
+
+
+def _engine(batch_size: int, net: _StubNet | None = None) -> tuple[FaceEngine, _StubRecognizer]:
+    recognizer = _StubRecognizer()
+    settings = Settings(FACE_EMBED_BATCH_SIZE=batch_size, FACE_EMBEDDING_DIM=3)
+    return FaceEngine(settings, backend=OpenCVBackend(object(), recognizer, net)), recognizer
+
+
+def _crops(count: int) -> list[np.ndarray]:
+    rng = np.random.default_rng(3)
+    return [rng.integers(1, 255, size=(112, 112, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def _photo(height: int = 250, width: int = 330) -> np.ndarray:
+    image = np.random.default_rng(1).integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(image, (9, 9), 3)
+
+
+def test_batched_embeddings_match_per_face_features() -> None:
+    crops = _crops(7)
+    per_face, recognizer = _engine(batch_size=4)
+    expected = per_face.embed_aligned_faces(crops)
+    assert recognizer.calls == 7
+
+    net = _StubNet()
+    batched, recognizer = _engine(batch_size=4, net=net)
+    actual = batched.embed_aligned_faces(crops)
+    assert net.batches == [4, 3]
+    assert recognizer.calls == 0
+    for left, right in zip(expected, actual):
+        assert left is not None and right is not None
+        assert np.allclose(left, right, atol=1e-5)
+
+
+def test_onnxruntime_backend_matches_opencv_on_fake_models(fake_face_models: tuple[Path, Path]) -> None:
+    pytest.importorskip("onnxruntime")
+    yunet_path, sface_path = fake_face_models
+    settings = Settings(FACE_DET_SCORE_THRESHOLD=0.5, FACE_INFERENCE_BACKEND="onnxruntime")
+    reference = OpenCVBackend.load(settings, yunet_path, sface_path)
+    candidate = OnnxRuntimeBackend.load(settings, yunet_path, sface_path)
+    image = _photo()
+
+    expected = reference.detect(image)
+    actual = candidate.detect(image)
+    assert expected is not None and actual is not None
+    assert actual.shape == expected.shape
+    assert np.allclose(actual, expected, atol=1e-3)
+
+    face = np.array([60, 40, 120, 150, 90, 90, 150, 88, 120, 120, 95, 160, 145, 158, 0.9], dtype=np.float32)
+    aligned = reference.align(image, face)
+    assert np.abs(align_face(image, face).astype(np.int16) - aligned.astype(np.int16)).max() <= 1
+
+    crops = [aligned, cv2.flip(aligned, 1), _crops(1)[0]]
+    for left, right in zip(reference.embed(crops), candidate.embed(crops)):
+        assert np.allclose(np.asarray(left).reshape(-1), right, rtol=1e-4, atol=1e-3)
+
+
+def test_onnxruntime_backend_matches_opencv_on_cached_models() -> None:
+    pytest.importorskip("onnxruntime")
+    settings = Settings()
+    cache_dir = settings.face_model_cache_dir_path
+    yunet_path, sface_path = cache_dir / YUNET_MODEL_FILE, cache_dir / SFACE_MODEL_FILE
+    if not yunet_path.exists() or not sface_path.exists():
+        pytest.skip("YuNet/SFace models are not cached locally")
+    reference = FaceEngine(Settings(FACE_INFERENCE_BACKEND="opencv"))
+    candidate = FaceEngine(Settings(FACE_INFERENCE_BACKEND="onnxruntime"))
+    assert isinstance(candidate._ensure_models_loaded(), OnnxRuntimeBackend)
+
+    image = cv2.resize(_photo(), (640, 480))
+    ok, encoded = cv2.imencode(".jpg", image)
+    assert ok
+    expected = reference.embed_faces(encoded.tobytes())
+    actual = candidate.embed_faces(encoded.tobytes())
+    assert len(actual) == len(expected)
+    for left, right in zip(expected, actual):
+        assert np.allclose(left.bbox, right.bbox, atol=1.0)
+        assert float(np.dot(left.embedding, right.embedding)) > 0.999
+
+
+class _LargeOnlyDetector:
+    def __init__(self, min_side: int) -> None:
+        self.min_side = min_side
+        self.sizes: list[tuple[int, int]] = []
+
+    def detect(self, image: np.ndarray) -> np.ndarray | None:
+        self.sizes.append(image.shape[:2])
+        if max(image.shape[:2]) < self.min_side:
+            return None
+        h, w = image.shape[:2]
+        return np.array([[w * 0.4, h * 0.4, w * 0.05, h * 0.05] + [0.0] * 10 + [0.95]], dtype=np.float32)
+
+    def align(self, image: np.ndarray, face: np.ndarray) -> np.ndarray:
+        return np.full((112, 112, 3), 128, dtype=np.uint8)
+
+    def embed(self, crops: list[np.ndarray]) -> list[np.ndarray]:
+        return [np.ones(3, dtype=np.float32) for _ in crops]
+
+
+def _encoded(image: np.ndarray, ext: str = ".jpg") -> bytes:
+    ok, encoded = cv2.imencode(ext, image)
+    assert ok
+    return encoded.tobytes()
+
+
+def test_decode_lands_just_above_inference_size() -> None:
+    photo = cv2.resize(_photo(), (4000, 3000))
+
+    def decoded_shape(max_side: int, ext: str = ".jpg") -> tuple[int, ...]:
+        decoded = FaceEngine(Settings(FACE_RESIZE_MAX_SIDE=max_side)).decode_image(_encoded(photo, ext))
+        assert decoded is not None
+        return decoded.pixels.shape[:2]
+
+    assert decoded_shape(900) == (750, 1000)
+    assert decoded_shape(1200) == (1500, 2000)
+    assert decoded_shape(2200) == (3000, 4000)
+    assert decoded_shape(900, ".png") == (3000, 4000)
+
+
+def test_no_face_at_reduced_size_retries_full_decode() -> None:
+    engine = FaceEngine(Settings(FACE_RESIZE_MAX_SIDE=900, FACE_MIN_SHARPNESS=0))
+    detector = _LargeOnlyDetector(min_side=3000)
+    engine._backend = detector  # type: ignore[assignment]
+    photo = cv2.resize(_photo(), (4000, 3000))
+
+    faces = engine.embed_faces(_encoded(photo))
+    assert detector.sizes == [(675, 900), (3000, 4000)]
+    assert len(faces) == 1
+
+
+def test_no_face_in_full_decode_is_not_detected_twice() -> None:
+    engine = FaceEngine(Settings(FACE_RESIZE_MAX_SIDE=900, FACE_MIN_SHARPNESS=0))
+    detector = _LargeOnlyDetector(min_side=3000)
+    engine._backend = detector  # type: ignore[assignment]
+    photo = cv2.resize(_photo(), (4000, 3000))
+
+    # PNGs are never decoded reduced, so a faceless one is not re-detected at full size.
+    assert engine.embed_faces(_encoded(photo, ".png")) == []
+    assert detector.sizes == [(675, 900)]
+
+
+def test_faces_only_the_full_resolution_pass_would_keep_are_reported() -> None:
+    photo = _photo(400, 400)
+    for min_ratio, small_faces in ((0.003, 1), (0.01, 0)):
+        engine = FaceEngine(Settings(FACE_RESIZE_MAX_SIDE=900, FACE_MIN_SHARPNESS=0, FACE_MIN_FACE_RATIO=min_ratio))
+        engine._backend = _LargeOnlyDetector(min_side=0)  # type: ignore[assignment]
+        # The stub face covers 0.25% of the frame.
+        (result,) = engine.analyze_faces_batch([photo])
+        assert result.faces == [] and result.small_faces == small_faces
+
+
+def test_thumbnail_from_decoded_pixels_keeps_colors(tmp_path: Path) -> None:
+    from PIL import Image
+
+    from app.services.storage import save_thumbnail_pixels
+
+    settings = Settings(storage_root=str(tmp_path))
+    pixels = np.zeros((300, 400, 3), dtype=np.uint8)
+    pixels[..., 2] = 200
+    relative = save_thumbnail_pixels(settings, "event", "file", pixels, max_size=100)
+    with Image.open(tmp_path / relative) as thumb:
+        assert thumb.size == (100, 75)
+        red, green, blue = thumb.convert("RGB").getpixel((50, 37))
+    assert red > 180 and green < 20 and blue < 20
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from app.config import Settings
+from app.ml.backends import BACKEND_ONNXRUNTIME
+from app.ml.quantization import (
+    INT8_REPORT_FILE,
+    decision_gate,
+    evaluate_int8_models,
+    int8_model_path,
+    quantize_models,
+    resolve_model_files,
+)
+
+pytest.importorskip("onnxruntime")
+
+
+def _image_dir(tmp_path: Path) -> Path:
+    image_dir = tmp_path / "photos"
+    image_dir.mkdir()
+    rng = np.random.default_rng(5)
+    for idx in range(3):
+        image = cv2.GaussianBlur(rng.integers(0, 255, size=(240, 320, 3), dtype=np.uint8), (9, 9), 3)
+        cv2.imwrite(str(image_dir / f"photo-{idx}.jpg"), image)
+    return image_dir
+
+
+def _settings(model_dir: Path, **overrides: object) -> Settings:
+    values = {"FACE_MODEL_CACHE_DIR": str(model_dir), "FACE_DET_SCORE_THRESHOLD": 0.5, "FACE_MODEL_PRECISION": "int8"}
+    values.update(overrides)
+    return Settings(**values)
+
+
+def test_int8_models_are_used_only_after_passing_the_gate(
+    tmp_path: Path, fake_face_models: tuple[Path, Path]
+) -> None:
+    yunet_path, sface_path = fake_face_models
+    settings = _settings(sface_path.parent, FACE_INT8_MIN_COSINE=0.9, FACE_INT8_MIN_AGREEMENT=0.5)
+    written = quantize_models(settings, models=("sface",))
+    assert written == [int8_model_path(sface_path)]
+    assert resolve_model_files(settings, yunet_path, sface_path) == (yunet_path, sface_path, None)
+
+    report = evaluate_int8_models(settings, _image_dir(tmp_path))
+    assert report["faces"] > 0
+    assert report["mean_cosine"] > 0.9
+    assert report["passed"] is True
+    assert resolve_model_files(settings, yunet_path, sface_path) == (
+        yunet_path,
+        int8_model_path(sface_path),
+        BACKEND_ONNXRUNTIME,
+    )
+
+    # A model swapped after evaluation is not trusted.
+    int8_model_path(sface_path).write_bytes(sface_path.read_bytes())
+    assert resolve_model_files(settings, yunet_path, sface_path)[2] is None
+
+
+def test_int8_gate_refuses_models_below_threshold(tmp_path: Path, fake_face_models: tuple[Path, Path]) -> None:
+    yunet_path, sface_path = fake_face_models
+    settings = _settings(sface_path.parent, FACE_INT8_MIN_COSINE=1.01)
+    quantize_models(settings, models=("sface",))
+    report = evaluate_int8_models(settings, _image_dir(tmp_path))
+    assert report["passed"] is False
+    assert json.loads((sface_path.parent / INT8_REPORT_FILE).read_text())["passed"] is False
+    assert resolve_model_files(settings, yunet_path, sface_path) == (yunet_path, sface_path, None)
+
+
+def _unit(rows: np.ndarray) -> np.ndarray:
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_decision_gate_fails_when_a_few_matching_pairs_flip() -> None:
+    rng = np.random.default_rng(11)
+    people = _unit(rng.normal(size=(40, 128)))
+    # Three photos of each of the first four people, one photo of everyone else.
+    expected = _unit(np.vstack([people[:4].repeat(3, axis=0), people[4:]]) + rng.normal(scale=0.01, size=(48, 128)))
+    actual = expected.copy()
+    actual[0] = _unit(people[30:31] + rng.normal(scale=0.05, size=(1, 128)))[0]
+    threshold = 0.6
+
+    unchanged = decision_gate(expected, expected, threshold, min_recall=0.99, max_false_positive_rate=0.001)
+    assert unchanged["positive_pairs"] == 12
+    assert unchanged["match_recall"] == 1.0 and unchanged["passed"] is True
+
+    flipped = decision_gate(expected, actual, threshold, min_recall=0.99, max_false_positive_rate=0.001)
+    # Agreement over all 1128 pairs would still be ~99.6%; the positives show the loss.
+    assert flipped["match_recall"] < 0.9
+    assert flipped["false_positive_rate"] > 0.0
+    assert flipped["passed"] is False
+
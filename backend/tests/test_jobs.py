@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Event, GuestQuery, Job
+from app.services.job_signals import LocalJobSignal, PollingJobWaiter, job_waiter, local_job_signal
+from app.services.jobs import (
+    JOB_CLUSTER_EVENT,
+    JOB_MATCH_GUEST,
+    JOB_STATUS_CANCELED,
+    JOB_STATUS_CANCEL_REQUESTED,
+    JOB_STATUS_FAILED,
+    JOB_STATUS_QUEUED,
+    JOB_STATUS_WAITING,
+    JOB_SYNC_EVENT,
+    JOB_SYNC_FINALIZE,
+    JOB_SYNC_SHARD,
+    JobHeartbeat,
+    acquire_next_job,
+    create_job,
+    lane_job_types,
+    requeue_expired_jobs,
+    roll_up_sync_shard,
+    utc_now,
+)
+
+
+def test_enqueue_wakes_waiter_only_after_commit(db_session) -> None:
+    waiter = local_job_signal()
+    waiter.wait(0)
+
+    create_job(db_session, job_type=JOB_SYNC_EVENT)
+    assert waiter.wait(0) is False
+    db_session.commit()
+    assert waiter.wait(0) is True
+    assert waiter.wait(0) is False
+    assert acquire_next_job(db_session) is not None
+
+
+def test_blocked_waiter_wakes_on_enqueue(db_session) -> None:
+    waiter = local_job_signal()
+    waiter.wait(0)
+    woke: list[tuple[bool, float]] = []
+
+    def wait() -> None:
+        started = time.monotonic()
+        woke.append((waiter.wait(10), time.monotonic() - started))
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    time.sleep(0.05)
+    create_job(db_session, job_type=JOB_SYNC_EVENT)
+    db_session.commit()
+    thread.join(timeout=5)
+
+    assert woke and woke[0][0] is True
+    assert woke[0][1] < 2
+
+
+def test_sqlite_engine_uses_in_process_signal(db_engine) -> None:
+    waiter = job_waiter(db_engine)
+    assert isinstance(waiter, PollingJobWaiter)
+    assert waiter.signal is local_job_signal()
+    assert LocalJobSignal().wait(0.01) is False
+
+
+def test_local_waiter_caps_wait_at_poll_interval() -> None:
+    waiter = PollingJobWaiter(LocalJobSignal(), 0.05)
+    started = time.monotonic()
+    # An enqueue from another process never reaches the in-process signal.
+    assert waiter.wait(30) is False
+    assert time.monotonic() - started < 1
+
+
+def test_claims_follow_priority_then_age(db_session) -> None:
+    syncs = [create_job(db_session, job_type=JOB_SYNC_EVENT) for _ in range(3)]
+    cluster = create_job(db_session, job_type=JOB_CLUSTER_EVENT)
+    match = create_job(db_session, job_type=JOB_MATCH_GUEST)
+    db_session.commit()
+
+    claimed = []
+    for _ in range(5):
+        claimed.append(acquire_next_job(db_session))
+        db_session.flush()
+    assert [job.id for job in claimed[:2]] == [match.id, cluster.id]
+    assert {job.id for job in claimed[2:]} == {job.id for job in syncs}
+    assert acquire_next_job(db_session) is None
+
+
+def test_interactive_lane_only_claims_match_jobs(db_session) -> None:
+    create_job(db_session, job_type=JOB_SYNC_EVENT)
+    db_session.commit()
+    interactive = lane_job_types("interactive")
+    assert acquire_next_job(db_session, interactive) is None
+
+    match = create_job(db_session, job_type=JOB_MATCH_GUEST, priority=20)
+    db_session.commit()
+    assert acquire_next_job(db_session, interactive).id == match.id
+    db_session.flush()
+    assert acquire_next_job(db_session, lane_job_types("batch")).job_type == JOB_SYNC_EVENT
+
+
+def test_lane_names_are_validated() -> None:
+    assert lane_job_types("all") is None
+    assert lane_job_types("") is None
+    assert set(lane_job_types("interactive")) == {JOB_MATCH_GUEST}
+    assert JOB_MATCH_GUEST not in lane_job_types("batch")
+    assert set(lane_job_types("interactive, batch")) >= {JOB_MATCH_GUEST, JOB_SYNC_EVENT, JOB_CLUSTER_EVENT}
+    with pytest.raises(ValueError):
+        lane_job_types("gpu")
+
+
+def _stale_sync(db_session) -> Job:
+    event = Event(name="E", slug="lease", drive_link="x", drive_folder_id="f", guest_code_hash="g", admin_token_hash="a")
+    db_session.add(event)
+    db_session.flush()
+    create_job(db_session, job_type=JOB_SYNC_EVENT, event_id=event.id)
+    db_session.commit()
+    job = acquire_next_job(db_session)
+    job.locked_at = utc_now() - timedelta(minutes=10)
+    db_session.commit()
+    return job
+
+
+def test_expired_lease_is_requeued_with_backoff(db_session) -> None:
+    job = _stale_sync(db_session)
+
+    reclaimed = requeue_expired_jobs(db_session, lease_seconds=60, max_attempts=3, backoff_seconds=30)
+    db_session.commit()
+
+    assert [item.id for item in reclaimed] == [job.id]
+    assert job.status == JOB_STATUS_QUEUED
+    assert job.payload["reclaimed_attempts"] == 1
+    assert acquire_next_job(db_session) is None
+    job.run_after = utc_now() - timedelta(seconds=1)
+    db_session.commit()
+    assert acquire_next_job(db_session).id == job.id
+    assert job.attempts == 2
+
+
+def test_expired_lease_fails_after_max_attempts(db_session) -> None:
+    job = _stale_sync(db_session)
+    job.attempts = 3
+    db_session.commit()
+
+    requeue_expired_jobs(db_session, lease_seconds=60, max_attempts=3, backoff_seconds=30)
+    db_session.commit()
+
+    assert job.status == JOB_STATUS_FAILED
+    assert db_session.get(Event, job.event_id).status == "failed"
+    assert requeue_expired_jobs(db_session, lease_seconds=60, max_attempts=3, backoff_seconds=30) == []
+
+
+def test_reaper_reports_a_canceled_match_as_canceled(db_session) -> None:
+    event = Event(name="E", slug="match", drive_link="x", drive_folder_id="f", guest_code_hash="g", admin_token_hash="a")
+    db_session.add(event)
+    db_session.flush()
+    query = GuestQuery(event_id=event.id, selfie_path="selfie.jpg", expires_at=utc_now() + timedelta(hours=1))
+    db_session.add(query)
+    db_session.flush()
+    job = create_job(db_session, job_type=JOB_MATCH_GUEST, event_id=event.id, query_id=query.id)
+    job.status = JOB_STATUS_CANCEL_REQUESTED
+    job.locked_at = utc_now() - timedelta(minutes=10)
+    db_session.commit()
+
+    requeue_expired_jobs(db_session, lease_seconds=60, max_attempts=3, backoff_seconds=30)
+    db_session.commit()
+
+    assert job.status == JOB_STATUS_CANCELED
+    assert query.status == "failed"
+    assert query.message == "Matching was canceled by admin."
+
+
+def test_heartbeat_keeps_running_job_out_of_the_reaper(db_engine, db_session) -> None:
+    job = _stale_sync(db_session)
+    stale = job.locked_at
+
+    with JobHeartbeat(sessionmaker(bind=db_engine), job.id, interval_seconds=1):
+        time.sleep(1.3)
+
+    db_session.refresh(job)
+    assert job.locked_at.replace(tzinfo=None) > stale.replace(tzinfo=None)
+    assert requeue_expired_jobs(db_session, lease_seconds=60, max_attempts=3, backoff_seconds=30) == []
+
+
+def _sharded_sync(db_session, shards: int) -> tuple[Job, Job, list[Job]]:
+    parent = create_job(db_session, job_type=JOB_SYNC_EVENT, status=JOB_STATUS_WAITING)
+    finalize = create_job(
+        db_session, job_type=JOB_SYNC_FINALIZE, payload={"parent_job_id": parent.id}, status=JOB_STATUS_WAITING
+    )
+    parent.payload = {"total_listed": 10, "completed": 2, "shards_total": shards, "finalize_job_id": finalize.id}
+    children = [
+        create_job(db_session, job_type=JOB_SYNC_SHARD, payload={"parent_job_id": parent.id}) for _ in range(shards)
+    ]
+    db_session.commit()
+    return parent, finalize, children
+
+
+def test_last_shard_rolls_up_progress_and_releases_finalizer(db_session) -> None:
+    parent, finalize, children = _sharded_sync(db_session, shards=2)
+    assert acquire_next_job(db_session, (JOB_SYNC_FINALIZE,)) is None
+
+    roll_up_sync_shard(db_session, children[0], {"completed": 4, "refreshed_files": 3, "failures": 1})
+    assert finalize.status == JOB_STATUS_WAITING
+    assert parent.progress_percent == 60.0
+    roll_up_sync_shard(db_session, children[1], {"completed": 4, "refreshed_files": 4})
+    db_session.commit()
+
+    assert parent.payload["shards_completed"] == 2
+    assert parent.payload["refreshed_files"] == 7
+    assert parent.payload["failures"] == 1
+    assert acquire_next_job(db_session, (JOB_SYNC_FINALIZE,)).id == finalize.id
+
+
+def test_canceled_parent_cancels_finalizer(db_session) -> None:
+    parent, finalize, children = _sharded_sync(db_session, shards=1)
+    parent.status = JOB_STATUS_CANCELED
+    db_session.commit()
+
+    roll_up_sync_shard(db_session, children[0], {})
+    db_session.commit()
+
+    assert finalize.status == JOB_STATUS_CANCELED
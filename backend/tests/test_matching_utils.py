@@ -1,8 +1,25 @@
 from __future__ import annotations
 
+from contextlib import nullcontext
 from types import SimpleNamespace
 
-from app.services.matching import choose_best_cluster, cosine_similarity
+import pytest
+from sqlalchemy import select
+
+from app.db import verify_embedding_dimension
+from app.models import Event, Face, Photo
+from app.services import matching
+from app.services.embedding_cache import EmbeddingIndexCache
+from app.services.matching import (
+    build_embedding_index,
+    choose_best_cluster,
+    collect_ranked_photo_matches,
+    cosine_similarity,
+    cosine_to_percent,
+    resolve_match_engine,
+    score_photos,
+    search_photos_pgvector,
+)
 
 
 def test_cosine_similarity_scores() -> None:
@@ -24,3 +41,130 @@ def test_choose_best_cluster_with_threshold() -> None:
     assert no_best is None
     assert no_confidence < 0.7
 
+
+def test_score_photos_matches_per_row_loop() -> None:
+    rows = [
+        ("p2", [0.0, 1.0, 0.0]),
+        ("p1", [1.0, 0.0, 0.0]),
+        ("p2", [0.8, 0.6, 0.0]),
+        ("p3", [0.0, 0.0, 2.0]),
+    ]
+    selfie = [0.9, 0.1, 0.0]
+    index = build_embedding_index(rows)
+    assert index.photo_ids == ["p1", "p2", "p3"]
+
+    scores = score_photos(index, selfie)
+    assert [photo_id for photo_id, _ in scores] == ["p1", "p2", "p3"]
+    for photo_id, percent in scores:
+        expected = max(cosine_to_percent(cosine_similarity(selfie, vec)) for pid, vec in rows if pid == photo_id)
+        assert abs(percent - expected) < 1e-3
+
+
+def test_embedding_index_cache_versions_and_budget() -> None:
+    index = build_embedding_index([("p1", [1.0, 0.0, 0.0]), ("p2", [0.0, 1.0, 0.0])])
+    cache = EmbeddingIndexCache(max_bytes=index.nbytes * 2)
+
+    cache.put("e1", 1, index)
+    assert cache.get("e1", 1) is index
+    assert cache.get("e1", 2) is None
+    assert cache.get("e1", 1) is None
+
+    cache.put("e1", 1, index)
+    cache.put("e2", 1, index)
+    cache.get("e1", 1)
+    cache.put("e3", 1, index)
+    assert cache.get("e2", 1) is None
+    assert cache.get("e1", 1) is index
+    assert cache.current_bytes <= cache.max_bytes
+
+
+def test_pgvector_engine_falls_back_to_numpy_on_sqlite(db_session) -> None:
+    event = Event(name="E", slug="fallback-event", drive_link="x", drive_folder_id="f", guest_code_hash="g", admin_token_hash="a")
+    db_session.add(event)
+    db_session.flush()
+    photo = Photo(
+        event_id=event.id,
+        drive_file_id="d1",
+        file_name="a.jpg",
+        mime_type="image/jpeg",
+        web_view_link="",
+        preview_url="",
+        download_url="",
+        thumbnail_path="",
+        content_stamp="s",
+    )
+    db_session.add(photo)
+    db_session.flush()
+    embedding = [1.0] + [0.0] * (Face.embedding.type.dimension - 1)
+    db_session.add(Face(event_id=event.id, photo_id=photo.id, face_index=0, embedding=embedding))
+    db_session.flush()
+
+    assert resolve_match_engine(db_session, "pgvector") == "numpy"
+    ranked, _threshold, _adaptive = collect_ranked_photo_matches(
+        db_session,
+        event_id=event.id,
+        selfie_embedding=embedding,
+        threshold_percent=90.0,
+        top_margin=8.0,
+        relax_drop=8.0,
+        relax_min_threshold=78.0,
+        engine="pgvector",
+    )
+    assert [item.photo_id for item in ranked] == [photo.id]
+
+
+def test_pgvector_search_without_iterative_scan_defers_to_exact_path(db_session, monkeypatch) -> None:
+    monkeypatch.setattr(matching, "_iterative_scan_supported", None)
+    embedding = [1.0] + [0.0] * (Face.embedding.type.dimension - 1)
+
+    # SQLite has no pg_extension catalog, so the pgvector version is unknown.
+    assert search_photos_pgvector(db_session, event_id="e", selfie_embedding=embedding, top_k=10) is None
+    assert matching._iterative_scan_supported is False
+    assert search_photos_pgvector(db_session, event_id="e", selfie_embedding=embedding, top_k=10) is None
+    assert db_session.execute(select(Event.id)).all() == []
+
+
+def test_quantized_index_reranks_with_exact_vectors() -> None:
+    rows = [("p1", [1.0, 0.2, 0.0]), ("p2", [0.1, 1.0, 0.3]), ("p3", [0.0, 0.3, 1.0])]
+    face_ids = ["f1", "f2", "f3"]
+    exact = dict(zip(face_ids, [vec for _photo_id, vec in rows]))
+    selfie = [0.9, 0.3, 0.1]
+    expected = dict(score_photos(build_embedding_index(rows), selfie))
+
+    for precision in ("float16", "int8"):
+        index = build_embedding_index(rows, face_ids=face_ids, precision=precision)
+        assert index.nbytes < build_embedding_index(rows).nbytes
+        approx = dict(score_photos(index, selfie))
+        assert all(abs(approx[key] - expected[key]) < 1.5 for key in expected)
+        reranked = dict(score_photos(index, selfie, exact_lookup=lambda ids: {i: exact[i] for i in ids}))
+        assert all(abs(reranked[key] - expected[key]) < 1e-3 for key in expected)
+
+
+def _pg_session(declared: str | None) -> SimpleNamespace:
+    result = SimpleNamespace(scalar_one_or_none=lambda: declared)
+    return SimpleNamespace(
+        get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name="postgresql")),
+        execute=lambda _statement: result,
+    )
+
+
+def test_embedding_dimension_check_rejects_mismatched_column(db_session) -> None:
+    verify_embedding_dimension(db_session, 128)
+    verify_embedding_dimension(_pg_session("vector(128)"), 128)
+    verify_embedding_dimension(_pg_session(None), 128)
+    with pytest.raises(RuntimeError, match="vector\\(512\\)"):
+        verify_embedding_dimension(_pg_session("vector(512)"), 128)
+
+
+def test_iterative_scan_is_gated_on_the_installed_pgvector_version(monkeypatch) -> None:
+    for extversion, supported in (("0.7.4", False), ("0.8.0", True), ("0.10", True), (None, False)):
+        monkeypatch.setattr(matching, "_iterative_scan_supported", None)
+        statements: list[str] = []
+
+        def execute(statement, value=extversion, log=statements) -> SimpleNamespace:
+            log.append(str(statement))
+            return SimpleNamespace(scalar_one_or_none=lambda: value)
+
+        session = SimpleNamespace(begin_nested=nullcontext, execute=execute)
+        assert matching._enable_iterative_scan(session) is supported
+        assert any("SET LOCAL hnsw.iterative_scan" in statement for statement in statements) is supported
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import threading
+from contextlib import closing
+
+import pytest
+
+from app.services.sync_pipeline import Prefetch, ProgressThrottle, SyncPipeline
+
+
+def _download(item: int) -> bytes:
+    if item == 3:
+        raise RuntimeError("download failed")
+    return b"x" * item
+
+
+def test_pipeline_yields_every_item_with_errors_attached() -> None:
+    pipeline = SyncPipeline(
+        download=_download,
+        process=lambda item, payload: len(payload),
+        download_workers=3,
+        process_workers=2,
+        queue_size=2,
+    )
+    results = list(pipeline.run(range(20)))
+    assert sorted(result.item for result in results) == list(range(20))
+    failed = [result for result in results if result.error is not None]
+    assert [result.item for result in failed] == [3]
+    assert all(result.value == result.item for result in results if result.error is None)
+
+
+def test_pipeline_stops_early_when_canceled() -> None:
+    pipeline = SyncPipeline(
+        download=_download,
+        process=lambda item, payload: len(payload),
+        download_workers=2,
+        process_workers=2,
+        queue_size=1,
+    )
+    seen = 0
+    with closing(pipeline.run(iter(range(10_000)))) as results:
+        for _result in results:
+            seen += 1
+            if seen == 5:
+                pipeline.cancel()
+                break
+    assert pipeline.canceled
+    assert seen == 5
+
+
+def test_progress_throttle_fires_on_count_or_interval() -> None:
+    now = [0.0]
+    throttle = ProgressThrottle(every=3, interval_seconds=1.0, clock=lambda: now[0])
+    assert [throttle.tick() for _ in range(3)] == [False, False, True]
+    throttle.reset()
+    assert throttle.tick() is False
+    now[0] = 1.5
+    assert throttle.tick() is True
+    throttle.reset()
+    assert throttle.pending == 0
+    assert throttle.tick() is False
+
+
+def test_prefetch_drains_the_source_while_the_consumer_is_idle() -> None:
+    drained = threading.Event()
+
+    def source():
+        yield from range(50)
+        drained.set()
+
+    items = Prefetch(source())
+    assert next(items) == 0
+    # Nothing else is consumed, yet the producer reaches the end of the source.
+    assert drained.wait(timeout=5)
+    assert list(items) == list(range(1, 50))
+
+
+def test_prefetch_raises_source_errors_in_order() -> None:
+    def source():
+        yield 1
+        raise RuntimeError("listing failed")
+
+    items = Prefetch(source())
+    assert next(items) == 1
+    with pytest.raises(RuntimeError, match="listing failed"):
+        next(items)
+    assert list(items) == []
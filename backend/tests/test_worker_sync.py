@@ -0,0 +1,445 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+import pytest
+from PIL import Image
+from sqlalchemy import func, select
+
+from app import worker
+from app.config import Settings
+from app.ml.face_engine import FaceEmbedding, FaceEngine, FaceEnginePool, ImageFaces
+from app.models import Event, Face, Job, Photo, SyncListingFile
+from app.services.jobs import (
+    JOB_CLUSTER_EVENT,
+    JOB_STATUS_COMPLETED,
+    JOB_STATUS_FAILED,
+    JOB_STATUS_QUEUED,
+    JOB_STATUS_RUNNING,
+    JOB_STATUS_WAITING,
+    JOB_SYNC_EVENT,
+    JOB_SYNC_FINALIZE,
+    JOB_SYNC_SHARD,
+    create_job,
+    requeue_expired_jobs,
+)
+
+
+def _jpeg(width: int = 64) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, 48), (10, 20, 30)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class _StubEngine(FaceEngine):
+    # Images at least this wide show a face; narrower ones only too-small detections.
+    face_min_width = 0
+    small_faces = 1
+
+    def analyze_faces_batch(self, images, max_faces: int = 12) -> list[ImageFaces]:
+        face = FaceEmbedding(
+            embedding=[1.0] + [0.0] * 127, area_ratio=0.1, det_confidence=0.9, sharpness=50.0, bbox=(1, 2, 3, 4)
+        )
+        return [
+            ImageFaces([face]) if image.pixels.shape[1] >= self.face_min_width else ImageFaces([], self.small_faces)
+            for image in images
+        ]
+
+
+class _StubDownloader:
+    def __init__(self, failing: set[str] | None = None) -> None:
+        self.failing = failing or set()
+        self.content = _jpeg()
+        self.rendition: bytes | None = None
+        self.downloads: list[str] = []
+        self.originals_only: list[bool] = []
+
+    def download(self, file_id: str, *, scope: str = "", originals_only: bool = False) -> bytes:
+        self.downloads.append(file_id)
+        self.originals_only.append(originals_only)
+        if file_id in self.failing:
+            raise RuntimeError("download failed")
+        return self.content
+
+    def download_rendition(self, file_id: str, side: int, *, scope: str = "", min_side: int = 0) -> bytes | None:
+        return self.rendition
+
+
+@pytest.fixture()
+def sync_settings(test_settings: Settings) -> Settings:
+    return test_settings.model_copy(
+        update={
+            "sync_download_workers": 1,
+            "sync_inference_workers": 1,
+            "sync_queue_size": 2,
+            "drive_download_mode": "original",
+        }
+    )
+
+
+@pytest.fixture()
+def downloader(monkeypatch: pytest.MonkeyPatch, sync_settings: Settings) -> _StubDownloader:
+    stub = _StubDownloader()
+    pool = FaceEnginePool(sync_settings, primary=_StubEngine(sync_settings))
+    monkeypatch.setattr(worker, "_get_drive_downloader", lambda settings: stub)
+    monkeypatch.setattr(worker, "_get_engine_pool", lambda settings, face_engine: pool)
+    return stub
+
+
+def _file(index: int) -> dict:
+    return {
+        "id": f"file-{index:03d}",
+        "name": f"{index}.jpg",
+        "mimeType": "image/jpeg",
+        "modifiedTime": f"2026-03-01T00:00:{index:02d}Z",
+        "size": "10",
+    }
+
+
+def _event(db_session) -> Event:
+    event = Event(
+        name="Sync", slug="sync", drive_link="x", drive_folder_id="folder", guest_code_hash="g", admin_token_hash="a"
+    )
+    db_session.add(event)
+    db_session.flush()
+    return event
+
+
+def _fan_out(db_session, event: Event, *, queued: int, listed: int, shard_size: int) -> Job:
+    parent = create_job(db_session, job_type=JOB_SYNC_EVENT, event_id=event.id)
+    listing = worker.SyncListing(listed=listed, reused=listed - queued, queued=queued, complete=True)
+    listing.seen_ids = {_file(index)["id"] for index in range(listed)}
+    listing.newest_modified = _file(listed - 1)["modifiedTime"]
+    refresh_queue = [(_file(index), f"stamp-{index}", None) for index in range(queued)]
+    worker._fan_out_sync(
+        db_session,
+        job=parent,
+        event=event,
+        refresh_queue=refresh_queue,
+        listing=listing,
+        full_listing=True,
+        counts={
+            "total_listed": listed,
+            "processed": listed - queued,
+            "matched_faces": 0,
+            "refreshed_files": 0,
+            "reused_files": listed - queued,
+            "refresh_queue_total": queued,
+            "failures": 0,
+            "rendition_files": 0,
+        },
+        shard_size=shard_size,
+    )
+    db_session.commit()
+    return parent
+
+
+def _jobs(db_session, job_type: str) -> list[Job]:
+    return db_session.execute(select(Job).where(Job.job_type == job_type).order_by(Job.created_at)).scalars().all()
+
+
+def test_fan_out_stores_listing_once_and_passes_shard_bounds(db_session) -> None:
+    event = _event(db_session)
+    parent = _fan_out(db_session, event, queued=5, listed=8, shard_size=2)
+
+    shards = sorted(_jobs(db_session, JOB_SYNC_SHARD), key=lambda job: job.payload["shard_index"])
+    assert [(job.payload["start"], job.payload["stop"]) for job in shards] == [(0, 2), (2, 4), (4, 5)]
+    assert all("files" not in job.payload for job in shards)
+    (finalize,) = _jobs(db_session, JOB_SYNC_FINALIZE)
+    assert finalize.status == JOB_STATUS_WAITING
+    assert "listed_ids" not in finalize.payload
+    assert parent.status == JOB_STATUS_WAITING
+    assert parent.payload["shards_total"] == 3
+
+    rows = db_session.execute(select(SyncListingFile).where(SyncListingFile.job_id == parent.id)).scalars().all()
+    assert len(rows) == 8
+    queued = sorted((row.queue_index, row.drive_file_id) for row in rows if row.queue_index is not None)
+    assert queued == [(index, _file(index)["id"]) for index in range(5)]
+
+
+def test_shards_and_finalize_run_from_the_stored_listing(
+    db_session, sync_settings: Settings, downloader: _StubDownloader
+) -> None:
+    event = _event(db_session)
+    gone = Photo(
+        event_id=event.id,
+        drive_file_id="deleted-in-drive",
+        file_name="gone.jpg",
+        mime_type="image/jpeg",
+        web_view_link="",
+        preview_url="",
+        download_url="",
+        thumbnail_path="",
+        content_stamp="old",
+    )
+    db_session.add(gone)
+    parent = _fan_out(db_session, event, queued=5, listed=8, shard_size=2)
+
+    for shard in _jobs(db_session, JOB_SYNC_SHARD):
+        worker._process_sync_shard(db_session, shard, sync_settings, _StubEngine(sync_settings))
+        db_session.commit()
+    assert sorted(downloader.downloads) == [_file(index)["id"] for index in range(5)]
+    (finalize,) = _jobs(db_session, JOB_SYNC_FINALIZE)
+    assert finalize.status == JOB_STATUS_QUEUED
+    assert parent.payload["shards_completed"] == 3
+    assert parent.payload["refreshed_files"] == 5
+
+    worker._process_sync_finalize(db_session, finalize)
+    db_session.commit()
+    photos = set(db_session.execute(select(Photo.drive_file_id).where(Photo.event_id == event.id)).scalars())
+    assert photos == {_file(index)["id"] for index in range(5)}
+    assert db_session.execute(select(func.count(Face.id))).scalar_one() == 5
+    assert db_session.execute(select(func.count()).select_from(SyncListingFile)).scalar_one() == 0
+    assert parent.status == JOB_STATUS_COMPLETED
+    assert parent.payload["pruned_photos"] == 1
+    assert db_session.get(Event, event.id).drive_modified_watermark == _file(7)["modifiedTime"]
+    assert len(_jobs(db_session, JOB_CLUSTER_EVENT)) == 1
+
+
+def test_failed_finalize_settles_the_parent_and_releases_the_listing(
+    db_session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    event = _event(db_session)
+    parent = _fan_out(db_session, event, queued=2, listed=3, shard_size=2)
+    (finalize,) = _jobs(db_session, JOB_SYNC_FINALIZE)
+    finalize.status = JOB_STATUS_RUNNING
+
+    def finish_sync(*_args, **_kwargs) -> None:
+        raise RuntimeError("finalize blew up")
+
+    monkeypatch.setattr(worker, "_finish_sync", finish_sync)
+    with pytest.raises(RuntimeError) as raised:
+        worker._process_sync_finalize(db_session, finalize)
+    db_session.rollback()
+    assert worker._record_job_failure(db_session, finalize, raised.value) is False
+    db_session.commit()
+
+    assert finalize.status == JOB_STATUS_FAILED
+    assert parent.status == JOB_STATUS_FAILED
+    assert "finalize blew up" in parent.error_text
+    assert db_session.get(Event, event.id).status == "failed"
+    worker._delete_finished_listings(db_session)
+    assert db_session.execute(select(func.count()).select_from(SyncListingFile)).scalar_one() == 0
+
+
+def test_reaper_settles_the_parent_of_an_exhausted_finalize(db_session) -> None:
+    event = _event(db_session)
+    parent = _fan_out(db_session, event, queued=2, listed=3, shard_size=2)
+    (finalize,) = _jobs(db_session, JOB_SYNC_FINALIZE)
+    finalize.status = JOB_STATUS_RUNNING
+    finalize.attempts = 3
+    finalize.locked_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    db_session.commit()
+
+    requeue_expired_jobs(db_session, lease_seconds=60, max_attempts=3, backoff_seconds=1)
+    assert finalize.status == JOB_STATUS_FAILED
+    assert parent.status == JOB_STATUS_FAILED
+    assert db_session.get(Event, event.id).status == "failed"
+
+
+def test_reclaimed_shard_skips_files_already_stored(
+    db_session, sync_settings: Settings, downloader: _StubDownloader
+) -> None:
+    event = _event(db_session)
+    _fan_out(db_session, event, queued=2, listed=2, shard_size=2)
+    (shard,) = _jobs(db_session, JOB_SYNC_SHARD)
+    worker._process_sync_shard(db_session, shard, sync_settings, _StubEngine(sync_settings))
+    db_session.commit()
+
+    shard.status = JOB_STATUS_QUEUED
+    worker._process_sync_shard(db_session, shard, sync_settings, _StubEngine(sync_settings))
+    assert len(downloader.downloads) == 2
+    assert shard.payload["processed"] == 2 and shard.payload["refreshed_files"] == 0
+
+
+def _run_sync_files(db_session, settings: Settings, event: Event, files: list[dict], is_canceled=lambda: False):
+    job = create_job(db_session, job_type=JOB_SYNC_EVENT, event_id=event.id)
+    db_session.commit()
+    listing = worker.SyncListing(listed=len(files), queued=len(files), complete=True)
+    outcome = worker._sync_files(
+        db_session,
+        job=job,
+        event=event,
+        settings=settings,
+        face_engine=_StubEngine(settings),
+        entries=[(item, f"stamp-{item['id']}", None) for item in files],
+        listing=listing,
+        is_canceled=is_canceled,
+    )
+    db_session.rollback()
+    return outcome
+
+
+@pytest.fixture()
+def version_bumps(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    bumps: list[str] = []
+    real = worker.bump_embedding_version
+
+    def record(db, event_id: str) -> None:
+        bumps.append(event_id)
+        real(db, event_id)
+
+    monkeypatch.setattr(worker, "bump_embedding_version", record)
+    return bumps
+
+
+def _stored_ids(db_session, event: Event) -> list[str]:
+    return sorted(db_session.execute(select(Photo.drive_file_id).where(Photo.event_id == event.id)).scalars())
+
+
+def test_failing_image_mid_batch_keeps_the_rest_of_the_batch(
+    db_session,
+    monkeypatch: pytest.MonkeyPatch,
+    sync_settings: Settings,
+    downloader: _StubDownloader,
+    version_bumps: list[str],
+) -> None:
+    settings = sync_settings.model_copy(update={"sync_progress_every": 3, "sync_progress_interval_seconds": 3600})
+    event = _event(db_session)
+    files = [_file(index) for index in range(7)]
+    downloader.failing = {files[4]["id"]}
+    real_face_rows = worker._face_rows
+
+    def face_rows(*, event_id: str, photo_id: str, faces: list[FaceEmbedding]):
+        # Raised inside the per-image savepoint, after the photo row was flushed.
+        if db_session.get(Photo, photo_id).drive_file_id == files[1]["id"]:
+            raise RuntimeError("bad face row")
+        return real_face_rows(event_id=event_id, photo_id=photo_id, faces=faces)
+
+    monkeypatch.setattr(worker, "_face_rows", face_rows)
+    outcome = _run_sync_files(db_session, settings, event, files)
+
+    assert outcome.failures == 2 and outcome.refreshed == 5 and not outcome.canceled
+    assert _stored_ids(db_session, event) == [item["id"] for index, item in enumerate(files) if index not in (1, 4)]
+    assert db_session.execute(select(func.count(Face.id))).scalar_one() == 5
+    # Commits after files 3 and 6 plus the trailing partial batch, one version bump each.
+    assert version_bumps == [event.id] * 3
+    assert db_session.execute(select(Event.embedding_version).where(Event.id == event.id)).scalar_one() == 3
+    assert outcome.job.payload["completed"] == 7 and outcome.job.payload["failures"] == 2
+
+
+def test_throttle_commits_on_interval_before_the_batch_fills(
+    db_session, sync_settings: Settings, downloader: _StubDownloader, version_bumps: list[str]
+) -> None:
+    settings = sync_settings.model_copy(update={"sync_progress_every": 100, "sync_progress_interval_seconds": 0})
+    event = _event(db_session)
+    _run_sync_files(db_session, settings, event, [_file(index) for index in range(3)])
+    assert len(version_bumps) == 3
+    assert len(_stored_ids(db_session, event)) == 3
+
+
+def test_cancel_is_checked_at_batch_boundaries(
+    db_session, sync_settings: Settings, downloader: _StubDownloader, version_bumps: list[str]
+) -> None:
+    settings = sync_settings.model_copy(update={"sync_progress_every": 2, "sync_progress_interval_seconds": 3600})
+    event = _event(db_session)
+    checks: list[int] = []
+
+    def is_canceled() -> bool:
+        checks.append(len(checks))
+        return len(checks) == 2
+
+    outcome = _run_sync_files(db_session, settings, event, [_file(index) for index in range(8)], is_canceled)
+    assert outcome.canceled
+    assert len(checks) == 2
+    # Both committed batches survive the cancel; nothing after the second boundary is stored.
+    assert _stored_ids(db_session, event) == [_file(index)["id"] for index in range(4)]
+    assert len(version_bumps) == 2
+
+
+def test_incremental_listing_only_for_scheduled_refresh_after_recent_full_sync(
+    db_session, sync_settings: Settings
+) -> None:
+    settings = sync_settings.model_copy(update={"sync_full_rescan_hours": 24, "sync_watermark_overlap_seconds": 300})
+    event = _event(db_session)
+    event.drive_modified_watermark = "2026-03-01T12:00:00Z"
+    event.full_synced_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    scheduled = create_job(db_session, job_type=JOB_SYNC_EVENT, event_id=event.id, payload={"trigger": "auto_refresh"})
+    manual = create_job(db_session, job_type=JOB_SYNC_EVENT, event_id=event.id, payload={"trigger": "manual"})
+
+    assert worker._incremental_listing_since(event=event, job=scheduled, settings=settings) == "2026-03-01T11:55:00Z"
+    assert worker._incremental_listing_since(event=event, job=manual, settings=settings) is None
+    event.full_synced_at = datetime.now(timezone.utc) - timedelta(hours=25)
+    assert worker._incremental_listing_since(event=event, job=scheduled, settings=settings) is None
+    event.full_synced_at = datetime.now(timezone.utc)
+    event.drive_modified_watermark = None
+    assert worker._incremental_listing_since(event=event, job=scheduled, settings=settings) is None
+
+
+def test_listing_watermark_tracks_created_and_modified_times() -> None:
+    listing = worker.SyncListing()
+    files = [
+        {**_file(1), "modifiedTime": "2026-03-01T00:00:00Z", "createdTime": "2026-03-05T00:00:00Z"},
+        {**_file(2), "modifiedTime": "2026-03-03T00:00:00Z", "createdTime": "2026-03-02T00:00:00Z"},
+    ]
+    assert len(list(listing.refresh_entries(files, {}))) == 2
+    assert listing.newest_modified == "2026-03-05T00:00:00Z"
+
+
+def _finish(db_session, event: Event, *, full_listing: bool, failures: int) -> None:
+    job = create_job(db_session, job_type=JOB_SYNC_EVENT, event_id=event.id)
+    worker._finish_sync(
+        db_session,
+        job=job,
+        event=event,
+        seen_ids=set(),
+        counts={"total_listed": 1, "refreshed_files": 1 - failures, "failures": failures},
+        full_listing=full_listing,
+        watermark="2026-03-02T00:00:00Z",
+    )
+
+
+def test_failed_delta_sync_holds_the_watermark_back(db_session) -> None:
+    event = _event(db_session)
+    event.drive_modified_watermark = "2026-03-01T00:00:00Z"
+
+    _finish(db_session, event, full_listing=False, failures=1)
+    assert event.drive_modified_watermark == "2026-03-01T00:00:00Z"
+    assert event.full_synced_at is None
+
+    _finish(db_session, event, full_listing=False, failures=0)
+    assert event.drive_modified_watermark == "2026-03-02T00:00:00Z"
+    assert event.full_synced_at is None
+
+
+def test_full_sync_advances_the_watermark_despite_failures(db_session) -> None:
+    event = _event(db_session)
+    event.drive_modified_watermark = "2026-03-01T00:00:00Z"
+
+    _finish(db_session, event, full_listing=True, failures=1)
+    assert event.drive_modified_watermark == "2026-03-02T00:00:00Z"
+    assert event.full_synced_at is not None
+
+
+def test_rendition_falls_back_to_the_original_only_for_small_faces(
+    db_session, monkeypatch: pytest.MonkeyPatch, sync_settings: Settings, downloader: _StubDownloader
+) -> None:
+    settings = sync_settings.model_copy(update={"drive_download_mode": "rendition", "face_resize_max_side": 640})
+    event = _event(db_session)
+    large = {"imageMediaMetadata": {"width": 6000, "height": 4000}}
+    files = [{**_file(index), **large} for index in range(4)]
+    downloader.rendition = _jpeg(32)
+    downloader.content = _jpeg(96)
+
+    # A rendition that shows a face, or no sign of one, is kept as is.
+    monkeypatch.setattr(_StubEngine, "face_min_width", 32)
+    outcome = _run_sync_files(db_session, settings, event, files[:1])
+    assert (outcome.renditions, outcome.original_fallbacks) == (1, 0)
+    monkeypatch.setattr(_StubEngine, "face_min_width", 64)
+    monkeypatch.setattr(_StubEngine, "small_faces", 0)
+    outcome = _run_sync_files(db_session, settings, event, files[1:2])
+    assert (outcome.renditions, outcome.original_fallbacks) == (1, 0)
+    assert downloader.downloads == []
+
+    # Too-small detections send the file back for its original, never a preview;
+    # when the original is unavailable the rendition result is kept.
+    monkeypatch.setattr(_StubEngine, "small_faces", 1)
+    downloader.failing = {files[3]["id"]}
+    outcome = _run_sync_files(db_session, settings, event, files[2:])
+    assert sorted(downloader.downloads) == [files[2]["id"], files[3]["id"]]
+    assert downloader.originals_only == [True, True]
+    assert (outcome.refreshed, outcome.failures) == (2, 0)
+    assert (outcome.renditions, outcome.original_fallbacks) == (1, 1)
+    assert outcome.job.payload["original_fallback_files"] == 1
+    assert outcome.job.payload["rendition_files"] == 1
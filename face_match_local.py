@@ -17,6 +17,14 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+BACKEND_DIR = Path(__file__).resolve().parent / 'backend'
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from app.config import Settings  # noqa: E402
+from app.ml.backends import OpenCVBackend  # noqa: E402
+from app.ml.face_engine import FaceEngine  # noqa: E402
+
 try:
     import psycopg2
     from psycopg2.extras import execute_values
@@ -398,6 +406,16 @@ def face_feature(
     return normalize(vec)
 
 
+def create_embedding_engine(recognizer: cv2.FaceRecognizerSF, sface_model_path: str) -> FaceEngine:
+    # Share the backend's stacked SFace forward (and its per-face fallback) with the sync worker.
+    sface_net: Optional[Any] = None
+    try:
+        sface_net = cv2.dnn.readNetFromONNX(sface_model_path)
+    except Exception:
+        sface_net = None
+    return FaceEngine(Settings(), backend=OpenCVBackend(None, recognizer, sface_net))
+
+
 def pick_reference_face(candidates: List[Tuple[np.ndarray, float, float]], image: np.ndarray) -> Optional[np.ndarray]:
     if not candidates:
         return None
@@ -512,6 +530,7 @@ def build_face_embeddings_for_image(
     max_faces_per_image: int,
     resize_max_side: int,
     min_sharpness: float,
+    embedding_engine: FaceEngine,
 ) -> List[Dict[str, Any]]:
     image = resize_for_inference(original_image, resize_max_side)
     candidates = detect_faces(image, detector, min_face_ratio, max_faces_per_image)
@@ -529,12 +548,20 @@ def build_face_embeddings_for_image(
         if candidates:
             image = original_image
 
-    embeddings: List[Dict[str, Any]] = []
+    kept: List[Tuple[float, float, float]] = []
+    crops: List[np.ndarray] = []
     for face, det_conf, area_ratio in candidates:
         sharpness = face_sharpness(image, face)
         if sharpness < min_sharpness:
             continue
-        feature = face_feature(image, face, recognizer)
+        aligned = recognizer.alignCrop(image, face)
+        if aligned is None or aligned.size == 0:
+            continue
+        crops.append(aligned)
+        kept.append((det_conf, area_ratio, sharpness))
+
+    embeddings: List[Dict[str, Any]] = []
+    for (det_conf, area_ratio, sharpness), feature in zip(kept, embedding_engine.embed_aligned_faces(crops)):
         if feature is None:
             continue
         embeddings.append(
@@ -1182,6 +1209,7 @@ def main() -> int:
             det_size=strict_det_size,
             det_score_threshold=strict_det_score_threshold,
         )
+        embedding_engine = create_embedding_engine(recognizer, sface_model_path)
         reference_detector = detector
         if ref_det_size != strict_det_size or abs(ref_det_score_threshold - strict_det_score_threshold) > 1e-6:
             reference_detector = create_detector(
@@ -1340,6 +1368,7 @@ def main() -> int:
                         max_faces_per_image=max_faces_per_image,
                         resize_max_side=resize_max_side,
                         min_sharpness=min_sharpness,
+                        embedding_engine=embedding_engine,
                     )
                     if use_pgvector:
                         pg_upsert_file_embeddings(